@@ -1,61 +1,50 @@
-import math
+import copy
 import os
+import time
 from math import atan2
 from typing import Dict
 
-import cv2 as cv
-import mcrops
-import numpy as np
 from PyQt5 import QtWidgets
-from PyQt5.QtGui import QColor
+from PyQt5.QtCore import QThread, QSize, Qt, QTimer, pyqtSignal
+from PyQt5.QtGui import QColor, QPixmap, qRgb
 from PyQt5.QtWidgets import QFileDialog, QAction, QListWidgetItem
 
+import tracing
 import utils
 import values
 from applog import logger
-from imageview import Layer, Shape
+from density import DensityMap, colormapColors
+from layer import Layer, setMemoryBudget
+from pipeline import (
+    Pipeline,
+    buildLayers,
+    restyleLayers,
+    IMAGES,
+    IMAGE_CROP_FIELD,
+    SHAPES,
+    SHAPE_ROWS_DIR,
+    SHAPE_ROI_POLY
+)
 from settings import (
     ProjectSettings,
     AppSettings,
     MAX_RECENT_FILES,
     PROJECT_FILE_EXT,
+    PROFILES_DIR_NAME,
     COLORMAPS
 )
+from profiler import RunProfile, listProfiles
+from pyramid import toQImage
+from tilecache import TileCache, projectTileCache
 from ui_mainwindow import Ui_MainWindow
-
-IMAGE_CROP_FIELD = 'Crop Field'
-IMAGE_NORM_FIELD = 'Norm Field'
-IMAGE_VEG_MASK = 'Vegetation Mask'
-IMAGE_WEED_MASK = 'Weed Mask'
-IMAGE_VEG_DENSITY = 'Vegetation Density'
-IMAGE_WEED_DENSITY = 'Weed Density'
-IMAGE_ROI_MASK = 'Roi Mask'
-
-IMAGES = (
-    IMAGE_CROP_FIELD,
-    IMAGE_NORM_FIELD,
-    IMAGE_VEG_MASK,
-    IMAGE_WEED_MASK,
-    IMAGE_VEG_DENSITY,
-    IMAGE_WEED_DENSITY,
-    IMAGE_ROI_MASK,
-)
-
-SHAPE_ROWS_RIDGES = 'Row Ridges'
-SHAPE_ROWS_FURROWS = 'Row Furrows'
-SHAPE_ROWS_DIR = 'Rows Direction'
-SHAPE_ROI_POLY = 'Roi Poly'
-
-SHAPES = (
-    SHAPE_ROWS_RIDGES,
-    SHAPE_ROWS_FURROWS,
-    SHAPE_ROWS_DIR,
-    SHAPE_ROI_POLY,
-)
+from worker import PipelineWorker, ProjectLoader
 
 
 class MainWindow(QtWidgets.QMainWindow):
 
+    # Emitted once the layers of a project are shown
+    projectLoaded = pyqtSignal()
+
     def __init__(self):
         super(MainWindow, self).__init__()
         
@@ -63,6 +52,14 @@ class MainWindow(QtWidgets.QMainWindow):
         self.ui.setupUi(self)
 
         self.images: Dict[str, Layer] = {}
+        self.tileCache: TileCache = None
+        self.runThread: QThread = None
+        self.runWorker: PipelineWorker = None
+        self.runStartTime: float = 0
+        self.loadThread: QThread = None
+        self.projectLoader: ProjectLoader = None
+        # Pipeline answering the density previews of the settings dialog
+        self.densityPreview: Pipeline = None
 
         self.projectSettings: ProjectSettings = ProjectSettings()
         self.appSettings: AppSettings = AppSettings()
@@ -70,8 +67,15 @@ class MainWindow(QtWidgets.QMainWindow):
         self.connectActions()
 
     def closeEvent(self, event):
+        if self.isRunning:
+            self.cancelRun()
+            self.runThread.wait()
+        if self.isLoading:
+            self.loadThread.wait()
         self.saveAppSettings()
         self.saveProject()
+        if self.tileCache is not None:
+            self.tileCache.close()
         event.accept()
 
     def loadAppSettings(self):
@@ -83,11 +87,18 @@ class MainWindow(QtWidgets.QMainWindow):
 
         self.ui.pos = self.appSettings.mainWindowPos
         self.ui.size = self.appSettings.mainWindowSize
+        self.setImagesMemoryBudget()
 
         lastProjectPath = self.appSettings.lastProjectPath
-        if utils.fileExists(lastProjectPath):
-            self.loadProjectFile(lastProjectPath)
         self.updateRecentProjectsActions()
+        if utils.fileExists(lastProjectPath):
+            # Restored once the window is shown
+            QTimer.singleShot(
+                0, lambda: self.loadProjectFile(lastProjectPath)
+            )
+
+    def setImagesMemoryBudget(self):
+        setMemoryBudget(self.appSettings.imagesMemoryBudget * 2 ** 20)
 
     def saveAppSettings(self):
         self.appSettings.mainWindowPos = self.ui.pos
@@ -229,19 +240,76 @@ class MainWindow(QtWidgets.QMainWindow):
             self.loadProjectFile(action.data())
 
     def loadProjectFile(self, filePath):
-        try:
-            projectSettings = ProjectSettings.load(filePath)
-        except Exception as err:
-            logger.error(err)
-            self.ui.errorMsg(f'Error loading project {filePath}.')
-            self.updateRecentProjectsActions()
-        else:
-            self.loadProject(projectSettings)
+        """Open a project in a background thread, the current one stays
+        shown until it is ready."""
+        if self.isLoading or self.isRunning:
+            return
+
+        self.projectLoader = loader = ProjectLoader(
+            filePath, self.appSettings.tileCacheSize * 2 ** 20
+        )
+        self.loadThread = thread = QThread(self)
+        loader.moveToThread(thread)
 
-    def loadProject(self, projectSettings: ProjectSettings):
+        thread.started.connect(loader.run)
+        loader.loaded.connect(self.projectFileLoaded)
+        loader.failed.connect(
+            lambda error: self.projectFileFailed(filePath)
+        )
+        for signal in (loader.loaded, loader.failed):
+            signal.connect(thread.quit)
+        thread.finished.connect(self.loadThreadFinished)
+
+        self.setLoadActive(True)
+        self.statusBar().showMessage(
+            values.openingProjectStatusMessage.format(
+                name=os.path.basename(filePath)
+            )
+        )
+        thread.start()
+
+    def projectFileLoaded(
+        self,
+        projectSettings: ProjectSettings,
+        layers: Dict[str, Layer],
+        tileCache: TileCache
+    ):
+        self.loadProject(projectSettings, layers, tileCache)
+        self.statusBar().showMessage(values.readyStatusMessage)
+
+    def projectFileFailed(self, filePath: str):
+        self.statusBar().showMessage(values.readyStatusMessage)
+        self.ui.errorMsg(
+            values.loadProjectErrorMessage.format(path=filePath)
+        )
+        self.updateRecentProjectsActions()
+
+    def loadThreadFinished(self):
+        self.projectLoader.deleteLater()
+        self.loadThread.deleteLater()
+        self.projectLoader = None
+        self.loadThread = None
+        self.setLoadActive(False)
+
+    @property
+    def isLoading(self) -> bool:
+        return self.loadThread is not None
+
+    def setLoadActive(self, active: bool):
+        self.setProjectActionsDisabled(active)
+        # Busy indicator, the loading time is unknown
+        self.ui.runProgressBar.setRange(0, 0 if active else 1)
+        self.ui.runProgressBar.setVisible(active)
+
+    def loadProject(
+        self,
+        projectSettings: ProjectSettings,
+        layers: Dict[str, Layer] = None,
+        tileCache: TileCache = None
+    ):
         self.projectSettings = projectSettings
         self.setCurrentProject()
-        self.buildImages()
+        self.buildImages(layers, tileCache)
         self.updateShownShapesActions()
         shownImageName = self.projectSettings.shownImageName
         if shownImageName not in self.images:
@@ -250,34 +318,33 @@ class MainWindow(QtWidgets.QMainWindow):
         self.ui.imageListDockWidget.show()
         self.updateShownImage(shownImageName)
         self.saveProject()
-
-    def buildImages(self):
-        self.images = {}
-        se = self.projectSettings
-        readInfo = [
-            (IMAGE_CROP_FIELD, cv.IMREAD_COLOR),
-            (IMAGE_NORM_FIELD, cv.IMREAD_COLOR),
-            (IMAGE_VEG_DENSITY, cv.IMREAD_COLOR),
-            (IMAGE_VEG_MASK, cv.IMREAD_GRAYSCALE),
-            (IMAGE_WEED_DENSITY, cv.IMREAD_COLOR),
-            (IMAGE_WEED_MASK, cv.IMREAD_GRAYSCALE),
-            (IMAGE_ROI_MASK, cv.IMREAD_GRAYSCALE),
-        ]
-        for name, flags in readInfo:
-            fileName = '_'.join(name.lower().split()) + '.png'
-            filePath = os.path.join(se.projectPath, fileName)
-            self.images[name] = Layer(
-                name=name, filePath=filePath, flags=flags
+        self.cacheTiles()
+        self.projectLoaded.emit()
+
+    def buildImages(
+        self,
+        layers: Dict[str, Layer] = None,
+        tileCache: TileCache = None
+    ):
+        """Set the layers of the project, built here unless given along
+        with their tile cache."""
+        if layers is None:
+            layers = buildLayers(self.projectSettings)
+        if tileCache is None:
+            tileCache = projectTileCache(
+                self.projectSettings.projectPath,
+                self.appSettings.tileCacheSize * 2 ** 20
             )
+        self.images = layers
+        if self.tileCache is not None and self.tileCache is not tileCache:
+            self.tileCache.close()
+        self.tileCache = tileCache
+        for image in self.images.values():
+            image.tileCache = self.tileCache
 
-        if not utils.fileExists(self.images[IMAGE_CROP_FIELD].filePath):
-            image = cv.imread(se.cropFieldImagePath, cv.IMREAD_UNCHANGED)
-            if image.ndim == 3 and image.shape[2] == 4:
-                alpha = image[:, :, 3]
-                image = image[:, :, 0:3]
-                image[alpha < 200] = 0
-            self.images[IMAGE_CROP_FIELD].image = image
-            self.images[IMAGE_CROP_FIELD].save()
+    def cacheTiles(self):
+        if self.tileCache is not None:
+            self.tileCache.schedule(list(self.images.values()))
 
     def saveProject(self):
         if not self.projectSettings.projectName:
@@ -293,8 +360,69 @@ class MainWindow(QtWidgets.QMainWindow):
     def setSettings(self):
         self.setSettingsWidgetsValues()
         dialog = self.ui.settingsDialog
-        if dialog.exec_():
+        self.densityPreview = Pipeline(
+            copy.deepcopy(self.projectSettings),
+            self.images
+        )
+        self.previewDensity()
+        accepted = dialog.exec_()
+        self.densityPreview = None
+        if accepted:
             self.getSettingsWidgetsValues()
+            self.applyStyles()
+
+    def previewDensity(self):
+        """Show the density map for the cell size and colormap set in the
+        settings dialog, while its preview page is open."""
+        ui = self.ui.settingsDialog.ui
+        pipeline = self.densityPreview
+        if pipeline is None or \
+                ui.pagesTabWidget.currentWidget() is not ui.mapsPreviewPage:
+            return
+
+        se = pipeline.settings
+        se.resolution = ui.resolutionSpinBox.value()
+        se.mapsCellWidth = ui.mapsCellWidthSpinBox.value()
+        se.mapsCellHeight = ui.mapsCellHeightSpinBox.value()
+        startTime = time.monotonic()
+        try:
+            grid = pipeline.previewDensity(
+                ui.mapsPreviewComboBox.currentData()
+            )
+        except Exception as err:
+            logger.error(err)
+            grid = None
+        elapsed = time.monotonic() - startTime
+
+        if grid is None or grid.size == 0:
+            ui.mapsPreviewLabel.clear()
+            ui.mapsPreviewInfoLabel.setText(values.mapsPreviewEmptyText)
+            return
+        colorTable = [
+            qRgb(*color) for color in
+            colormapColors(ui.mapsColormapComboBox.currentData())
+        ]
+        indices = DensityMap(grid, (1, 1), grid.shape).indices
+        cellWidth, cellHeight = pipeline.cellSize
+        rows, cols = grid.shape
+        size = QSize(cols * cellWidth, rows * cellHeight)
+        size.scale(ui.mapsPreviewLabel.size(), Qt.KeepAspectRatio)
+        pixmap = QPixmap.fromImage(toQImage(indices, colorTable))
+        ui.mapsPreviewLabel.setPixmap(pixmap.scaled(size))
+        ui.mapsPreviewInfoLabel.setText(
+            values.mapsPreviewInfoText.format(
+                cols=cols, rows=rows, elapsed=round(elapsed * 1000)
+            )
+        )
+
+    def applyStyles(self):
+        """Draw the density maps and the shapes with the colormap and styles
+        of the project, without computing them again."""
+        changed = restyleLayers(self.projectSettings, self.images)
+        shownImageName = self.projectSettings.shownImageName
+        shown = self.images.get(shownImageName)
+        if shown is not None and shown in changed:
+            self.updateShownImage(shownImageName)
 
     def getSettingsWidgetsValues(self):
         ui = self.ui.settingsDialog.ui
@@ -306,6 +434,15 @@ class MainWindow(QtWidgets.QMainWindow):
         se.runMapVeg = ui.runMapVegCheckBox.isChecked()
         se.runMapWeeds = ui.runMapWeedsCheckBox.isChecked()
         se.segmentVegThr = ui.segmentVegThrSpinBox.value()
+        se.segmentTileSize = ui.segmentTileSizeSpinBox.value()
+        se.segmentWorkers = ui.segmentWorkersSpinBox.value()
+        self.appSettings.imagesMemoryBudget = \
+            ui.imagesMemoryBudgetSpinBox.value()
+        self.setImagesMemoryBudget()
+        self.appSettings.tileCacheSize = ui.tileCacheSizeSpinBox.value()
+        if self.tileCache is not None:
+            sizeLimit = self.appSettings.tileCacheSize * 2 ** 20
+            self.tileCache.setSizeLimit(sizeLimit)
         se.rowsSeparation = ui.rowsSeparationSpinBox.value()
         se.roiAutoDetect = ui.roiAutoDetectCheckBox.isChecked()
         se.dirAutoDetect = ui.dirAutoDetectCheckBox.isChecked()
@@ -341,6 +478,12 @@ class MainWindow(QtWidgets.QMainWindow):
         ui.runMapVegCheckBox.setChecked(se.runMapVeg)
         ui.runMapWeedsCheckBox.setChecked(se.runMapWeeds)
         ui.segmentVegThrSpinBox.setValue(se.segmentVegThr)
+        ui.segmentTileSizeSpinBox.setValue(se.segmentTileSize)
+        ui.segmentWorkersSpinBox.setValue(se.segmentWorkers)
+        ui.imagesMemoryBudgetSpinBox.setValue(
+            self.appSettings.imagesMemoryBudget
+        )
+        ui.tileCacheSizeSpinBox.setValue(self.appSettings.tileCacheSize)
         ui.rowsSeparationSpinBox.setValue(se.rowsSeparation)
         ui.roiAutoDetectCheckBox.setChecked(se.roiAutoDetect)
         ui.dirAutoDetectCheckBox.setChecked(se.dirAutoDetect)
@@ -385,7 +528,6 @@ class MainWindow(QtWidgets.QMainWindow):
             )
 
         self.run()
-        self.updateImageList()
         # else:
         #     buttons = QtWidgets.QMessageBox.Ok | QtWidgets.QMessageBox.Cancel
         #     ret = self.ui.warnMsg(
@@ -393,6 +535,31 @@ class MainWindow(QtWidgets.QMainWindow):
         #         buttons
         #     )
 
+    def showRunProfile(self):
+        dialog = self.ui.runProfileDialog
+        comboBox = dialog.profilesComboBox
+        comboBox.blockSignals(True)
+        comboBox.clear()
+        dirPath = os.path.join(
+            self.projectSettings.projectPath, PROFILES_DIR_NAME
+        )
+        for filePath in listProfiles(dirPath):
+            name = os.path.splitext(os.path.basename(filePath))[0]
+            comboBox.addItem(name, filePath)
+        comboBox.blockSignals(False)
+        self.runProfileSelected()
+        dialog.exec_()
+
+    def runProfileSelected(self):
+        profile = None
+        filePath = self.ui.runProfileDialog.profilesComboBox.currentData()
+        if filePath:
+            try:
+                profile = RunProfile.load(filePath)
+            except Exception as err:
+                logger.error(err)
+        self.ui.runProfileDialog.setProfile(profile)
+
     def selectRoiPoly(self):
         self.ui.imageView.canvas.deleteShape(SHAPE_ROI_POLY)
         self.ui.imageView.canvas.setToolDrawPolygon(
@@ -443,6 +610,34 @@ class MainWindow(QtWidgets.QMainWindow):
             values.aboutDialogMessage
         )
 
+    def recordTrace(self, checked: bool):
+        if checked:
+            tracing.clear()
+            tracing.enable()
+            self.statusBar().showMessage(values.traceStartedStatusMessage)
+            return
+
+        tracing.disable()
+        filePath, _ = QFileDialog.getSaveFileName(
+            self,
+            values.saveTraceDialogTitle,
+            os.path.join(self.projectSettings.projectPath, 'trace.json'),
+            'Files (*.json)'
+        )
+        if filePath:
+            try:
+                count = tracing.export(filePath)
+            except Exception as err:
+                logger.error(err)
+                self.ui.errorMsg(values.saveTraceErrorMessage)
+            else:
+                self.statusBar().showMessage(
+                    values.traceSavedStatusMessage.format(
+                        count=count, path=filePath
+                    )
+                )
+        tracing.clear()
+
     def connectActions(self):
 
         self.ui.newProjectAct.triggered.connect(self.newProject)
@@ -450,6 +645,10 @@ class MainWindow(QtWidgets.QMainWindow):
         self.ui.saveProjectAct.triggered.connect(self.saveProject)
         self.ui.setSettingsAct.triggered.connect(self.setSettings)
         self.ui.buildCropMapsAct.triggered.connect(self.buildCropMaps)
+        self.ui.runProfileAct.triggered.connect(self.showRunProfile)
+        self.ui.runProfileDialog.profilesComboBox.currentIndexChanged.connect(
+            self.runProfileSelected
+        )
         self.ui.selectRoiPolyAct.triggered.connect(self.selectRoiPoly)
         self.ui.setCropRowsDirAct.triggered.connect(self.setCropRowsDir)
         self.ui.imageInfoToolAct.toggled.connect(self.imageInfoTool)
@@ -460,231 +659,118 @@ class MainWindow(QtWidgets.QMainWindow):
         self.ui.zoomOutAct.triggered.connect(self.ui.imageView.zoomOut)
 
         self.ui.aboutAct.triggered.connect(self.aboutAction)
+        self.ui.recordTraceAct.toggled.connect(self.recordTrace)
+        self.ui.cancelRunButton.clicked.connect(self.cancelRun)
+
+        settingsUi = self.ui.settingsDialog.ui
+        for signal in (
+            settingsUi.pagesTabWidget.currentChanged,
+            settingsUi.resolutionSpinBox.valueChanged,
+            settingsUi.mapsCellWidthSpinBox.valueChanged,
+            settingsUi.mapsCellHeightSpinBox.valueChanged,
+            settingsUi.mapsColormapComboBox.currentIndexChanged,
+            settingsUi.mapsPreviewComboBox.currentIndexChanged,
+        ):
+            signal.connect(self.previewDensity)
+
+    @property
+    def isRunning(self) -> bool:
+        return self.runThread is not None
 
     def run(self):
+        if self.isRunning or self.isLoading:
+            return
 
-        se = self.projectSettings
-
-        cropField = self.images[IMAGE_CROP_FIELD]
-        normField = self.images[IMAGE_NORM_FIELD]
-        vegMask = self.images[IMAGE_VEG_MASK]
-        vegDensity = self.images[IMAGE_VEG_DENSITY]
-        weedMask = self.images[IMAGE_WEED_MASK]
-        weedDensity = self.images[IMAGE_WEED_DENSITY]
-        roiMask = self.images[IMAGE_ROI_MASK]
-
-        if se.runSegmentVeg:
-            vegMask.image = mcrops.veget.segment_vegetation(
-                cropField.image, threshold=se.segmentVegThr
-            )
-            vegMask.transform = cropField.transform
-            vegMask.save()
-
-        if se.runDetectRows:
-
-            (h, w) = vegMask.image.shape
-            roiPoly = np.int32([[0, 0], [w, 0], [w, h], [0, h]])
-
-            try:
-                if se.roiPolygon is not None:
-                    roiPoly = np.array(se.roiPolygon, np.int32)
-                elif se.roiAutoDetect:
-                    roiPoly = mcrops.veget.detect_roi(
-                        vegMask.image,
-                        row_sep=se.rowsSeparation,
-                        resolution=se.resolution
-                    )
-                roiPoly = roiPoly.reshape((-1, 1, 2))
-                roiPoly = mcrops.utils.trim_poly(roiPoly, (0, 0, w, h))
-                cropField.shapes[SHAPE_ROI_POLY] = [Shape(
-                    name=SHAPE_ROI_POLY,
-                    points=roiPoly.reshape((-1, 2)).tolist(),
-                    form=Shape.POLYGON,
-                    lineColor=se.roiColor,
-                    lineWidth=se.drawLineWidth,
-                    visible=se.shapesVisible.get(SHAPE_ROI_POLY, True)
-                )]
-            except Exception as err:
-                logger.error(err)
-
-            rowsDir = se.rowsDirection
-            if se.dirAutoDetect:
-                rowsDir = mcrops.rows.detect_direction(
-                    vegMask.image,
-                    resolution=se.resolution,
-                    window_shape=(se.rowsDirWindowHeight, se.rowsDirWindowWidth)
-                )
-
-                # Draw an arrow indicating the direction of the crop rows
-                pt1 = (int(w / 2), int(h / 2))
-                length = min(w / 2, h / 2)
-                dx = int(math.cos(rowsDir) * length)
-                dy = int(math.sin(rowsDir) * length)
-                pt2 = (
-                    pt1[0] + min(max(0, dx), w - 1),
-                    pt1[1] + min(max(0, dy), h - 1)
-                )
-                cropField.shapes[SHAPE_ROWS_DIR] = [Shape(
-                    name=SHAPE_ROWS_DIR,
-                    points=[pt1, pt2],
-                    form=Shape.LINE,
-                    lineColor=se.rowsDirColor,
-                    lineWidth=se.drawLineWidth,
-                    visible=se.shapesVisible.get(SHAPE_ROWS_DIR, True)
-                )]
-
-            vegMask.image, _, _ = mcrops.veget.norm_image(
-                vegMask.image,
-                roi_poly=roiPoly,
-                rows_direction=rowsDir,
-                roi_trim=se.roiTrim,
-                is_mask=True
-            )
-
-            normField.image, roiPoly, transform = mcrops.veget.norm_image(
-                cropField.image,
-                roi_poly=roiPoly,
-                rows_direction=rowsDir,
-                roi_trim=se.roiTrim
-            )
-            transform = transform.tolist()
-
-            if cropField.transform is not None:
-                # noinspection PyTypeChecker
-                transform = np.dot(cropField.transform, transform).tolist()
-
-            roiMask.image = mcrops.utils.poly_mask(
-                roiPoly, vegMask.image.shape
-            )
-
-            normField.transform = transform
-            vegMask.transform = transform
-            roiMask.transform = transform
-
-            rowsRidges, rowsFurrows = mcrops.rows.detect_rows(
-                veg_mask=vegMask.image,
-                roi_mask=roiMask.image,
-                row_sep=se.rowsSeparation,
-                extent_max=se.rowsDetectMaxExtent,
-                extent_thr=se.rowsDetectExtentThr,
-                fusion_thr=se.rowsDetectFusionThr,
-                link_thr=se.rowsDetectLinkThr,
-                resolution=se.resolution
-            )
-
-            rowsRidges[:, :, [1, 0]] = rowsRidges[:, :, [0, 1]]
-            rowsFurrows[:, :, [1, 0]] = rowsFurrows[:, :, [0, 1]]
-
-            shapes = []
-            visible = se.shapesVisible.get(SHAPE_ROWS_RIDGES, True)
-            # noinspection PyTypeChecker
-            for points in rowsRidges.tolist():
-                shapes.append(
-                    Shape(
-                        name=SHAPE_ROWS_RIDGES,
-                        points=points,
-                        form=Shape.POLYLINE,
-                        lineColor=se.rowsRidgesColor,
-                        lineWidth=se.drawLineWidth,
-                        visible=visible
-                    )
-                )
-            normField.shapes[SHAPE_ROWS_RIDGES] = shapes
-            vegMask.shapes[SHAPE_ROWS_RIDGES] = shapes
-
-            shapes = []
-            visible = se.shapesVisible.get(SHAPE_ROWS_FURROWS, True)
-            # noinspection PyTypeChecker
-            for points in rowsFurrows.tolist():
-                shapes.append(
-                    Shape(
-                        name=SHAPE_ROWS_FURROWS,
-                        points=points,
-                        form=Shape.POLYLINE,
-                        lineColor=se.rowsFurrowsColor,
-                        lineWidth=se.drawLineWidth,
-                        visible=visible
-                    )
-                )
-            normField.shapes[SHAPE_ROWS_FURROWS] = shapes
-            vegMask.shapes[SHAPE_ROWS_FURROWS] = shapes
-
-            cropField.save()
-            normField.save()
-            vegMask.save()
-            roiMask.save()
-
-        if se.runMapVeg:
-            densityMap = mcrops.veget.mask_density(
-                mask=vegMask.image,
-                roi_mask=roiMask.image,
-                cell_size=(se.mapsCellWidth, se.mapsCellHeight),
-                resolution=se.resolution
-            )
+        pipeline = Pipeline(
+            copy.deepcopy(self.projectSettings),
+            self.images
+        )
+        self.runWorker = worker = PipelineWorker(pipeline)
+        self.runThread = thread = QThread(self)
+        worker.moveToThread(thread)
+
+        thread.started.connect(worker.run)
+        worker.stageStarted.connect(self.runStageStarted)
+        worker.layerUpdated.connect(self.runLayerUpdated)
+        worker.finished.connect(self.runFinished)
+        worker.cancelled.connect(self.runCancelled)
+        worker.failed.connect(self.runFailed)
+        for signal in (worker.finished, worker.cancelled, worker.failed):
+            signal.connect(thread.quit)
+        thread.finished.connect(self.runThreadFinished)
+
+        self.runStartTime = time.monotonic()
+        self.setRunActive(True)
+        thread.start()
+
+    def cancelRun(self):
+        if self.isRunning:
+            self.runWorker.cancel()
+            self.ui.cancelRunButton.setEnabled(False)
+            self.statusBar().showMessage(values.runCancellingStatusMessage)
+
+    def setProjectActionsDisabled(self, disabled: bool):
+        for action in (
+            self.ui.newProjectAct,
+            self.ui.openProjectAct,
+            self.ui.openRecentAct,
+            self.ui.saveProjectAct,
+            self.ui.setSettingsAct,
+            self.ui.buildCropMapsAct,
+        ):
+            action.setDisabled(disabled)
+        if not disabled:
+            self.updateRecentProjectsActions()
 
-            vegDensity.image = mcrops.utils.array_image(
-                values=densityMap,
-                colormap=se.mapsColormap,
-                full_scale=True
+    def setRunActive(self, active: bool):
+        self.setProjectActionsDisabled(active)
+        self.ui.runProgressBar.setValue(0)
+        self.ui.runProgressBar.setVisible(active)
+        self.ui.cancelRunButton.setEnabled(True)
+        self.ui.cancelRunButton.setVisible(active)
+
+    def runStageStarted(self, index: int, count: int, title: str, eta: float):
+        self.ui.runProgressBar.setMaximum(count)
+        self.ui.runProgressBar.setValue(index)
+        message = values.runStageStatusMessage.format(
+            index=index + 1, count=count, title=title
+        )
+        if eta >= 0:
+            message += values.runEtaStatusMessage.format(
+                eta=utils.formatDuration(eta)
             )
-            vegDensity.transform = vegMask.transform
-            colormap = mcrops.utils.array_image(
-                values=np.arange(0, 255, dtype=np.uint8),
-                colormap=se.mapsColormap,
-                full_scale=True
-            ).reshape((-1, 3))
-            # Change BGR format to RGB
-            colormap[:, [2, 0]] = colormap[:, [0, 2]]
-            vegDensity.colormap = colormap.tolist()
-            # noinspection PyArgumentList
-            vegDensity.maprange = [
-                float(densityMap.min()), float(densityMap.max())
-            ]
-            vegDensity.save()
-
-        if se.runMapWeeds:
-
-            rowsRidges = []
-            rowsShapes = vegMask.shapes[SHAPE_ROWS_RIDGES]
-            for shape in rowsShapes:
-                rowsRidges.append(shape.points)
-
-            weedMask.image = mcrops.weeds.segment_weeds(
-                image=normField.image,
-                veg_mask=vegMask.image,
-                crop_rows=np.array(rowsRidges)
+        self.statusBar().showMessage(message)
+
+    def runLayerUpdated(self, layer: Layer):
+        if layer.name in self.images:
+            self.images[layer.name].update(layer)
+            self.updateImageList()
+            if layer.name == self.projectSettings.shownImageName:
+                self.updateShownImage(layer.name)
+
+    def runFinished(self):
+        elapsed = time.monotonic() - self.runStartTime
+        self.statusBar().showMessage(
+            values.runFinishedStatusMessage.format(
+                elapsed=utils.formatDuration(elapsed)
             )
+        )
 
-            densityMap = mcrops.veget.mask_density(
-                mask=weedMask.image,
-                roi_mask=roiMask.image,
-                cell_size=(se.mapsCellWidth, se.mapsCellHeight),
-                resolution=se.resolution
-            )
+    def runCancelled(self):
+        self.statusBar().showMessage(values.runCancelledStatusMessage)
 
-            weedDensity.image = mcrops.utils.array_image(
-                values=densityMap,
-                colormap=se.mapsColormap,
-                full_scale=True
-            )
-            weedDensity.transform = vegMask.transform
-            colormap = mcrops.utils.array_image(
-                values=np.arange(0, 255, dtype=np.uint8),
-                colormap=se.mapsColormap,
-                full_scale=True
-            ).reshape((-1, 3)).tolist()
-            # Change BGR format to RGB
-            colormap[:, [2, 0]] = colormap[:, [0, 2]]
-            weedDensity.colormap = colormap.tolist()
-            # noinspection PyArgumentList
-            weedDensity.maprange = [
-                float(densityMap.min()), float(densityMap.max())
-            ]
-            weedDensity.save()
+    def runFailed(self, error: str):
+        self.statusBar().showMessage(values.readyStatusMessage)
+        self.ui.errorMsg(values.runErrorMessage.format(error=error))
 
-        shownImageName = self.projectSettings.shownImageName
-        if shownImageName in self.images:
-            self.ui.imageView.showImage(self.images[shownImageName])
+    def runThreadFinished(self):
+        self.runWorker.deleteLater()
+        self.runThread.deleteLater()
+        self.runWorker = None
+        self.runThread = None
+        self.setRunActive(False)
+        self.updateImageList()
+        self.cacheTiles()
 
 
 if __name__ == '__main__':
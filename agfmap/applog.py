@@ -1,18 +1,27 @@
 import logging.config
-from os import path, mkdir
+import logging.handlers
+from os import path, makedirs
 
 currDir = path.dirname(path.abspath(__file__))
 logsDir = path.join(currDir, '.logs')
 
-if not path.exists(logsDir) or not path.isdir(logsDir):
-    mkdir(logsDir)
-
 LOGGER_DEBUG = True
 LOGGER_NAME = 'agfmap'
 LOGGER_FORMAT = '[{asctime}] {levelname} {module}:{funcName}:{lineno:d} "{message}"'
 LOGGER_FILE = path.join(logsDir, f'{LOGGER_NAME}.log')
 
 
+class LazyFileHandler(logging.handlers.RotatingFileHandler):
+    """Rotating file handler creating its directory and opening its file on
+    the first record, rather than when the application starts."""
+    def __init__(self, filename, **kwargs):
+        super().__init__(filename, delay=True, **kwargs)
+
+    def _open(self):
+        makedirs(path.dirname(self.baseFilename), exist_ok=True)
+        return super()._open()
+
+
 class FilterDebugTrue(logging.Filter):
     def filter(self, record):
         return LOGGER_DEBUG
@@ -50,7 +59,7 @@ logging.config.dictConfig({
         'file': {
             'level': 'INFO',
             'formatter': 'default',
-            'class': 'logging.handlers.RotatingFileHandler',
+            '()': LazyFileHandler,
             'filters': ['debug_false'],
             'filename': LOGGER_FILE,
             'maxBytes': 100 * 1024,
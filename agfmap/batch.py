@@ -0,0 +1,175 @@
+"""Headless batch processing of crop fields.
+
+Usage::
+
+    python agfmap/batch.py manifest.json [--workers N] [--force]
+
+The manifest is a JSON file like::
+
+    {
+        "workers": 4,
+        "projectsPath": "projects",
+        "settings": {"resolution": 20},
+        "fields": [
+            "flights/field-a.tif",
+            {
+                "image": "flights/field-b.tif",
+                "name": "field-b",
+                "settings": {"rowsSeparation": 0.75}
+            }
+        ]
+    }
+
+``settings`` holds `ProjectSettings` values shared by all fields, which can be
+overridden per field. Relative paths are resolved against the directory of
+the manifest. Every field is processed into its own project directory,
+``<projectsPath>/<name>``, with the same layout used by the application, so
+the results can be opened in it. Fields whose project is already complete
+are skipped, which makes it possible to resume an interrupted batch.
+"""
+import argparse
+import functools
+import json
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Iterable, List, Tuple
+
+import utils
+from applog import logger
+from layer import Layer
+from pipeline import Pipeline, buildLayers, restyleLayers
+from settings import ProjectSettings
+
+FIELD_DONE = 'done'
+FIELD_SKIPPED = 'skipped'
+FIELD_FAILED = 'failed'
+
+
+def loadManifest(filePath: str) -> Tuple[List[ProjectSettings], int]:
+    with open(filePath) as fp:
+        manifest: dict = json.load(fp)
+
+    baseDir = os.path.dirname(os.path.abspath(filePath))
+    projectsPath = os.path.join(baseDir, manifest.get('projectsPath', ''))
+    defaults = manifest.get('settings', {})
+
+    fieldsSettings = []
+    for field in manifest.get('fields', []):
+        if isinstance(field, str):
+            field = {'image': field}
+        imagePath = os.path.join(baseDir, field['image'])
+        name = field.get('name')
+        if not name:
+            name = os.path.splitext(os.path.basename(imagePath))[0]
+
+        se = ProjectSettings()
+        overrides = dict(defaults, **field.get('settings', {}))
+        for key, value in overrides.items():
+            if not hasattr(se, key):
+                raise ValueError(f'Unknown setting "{key}" for field {name}')
+            if isinstance(getattr(se, key), tuple):
+                value = tuple(value)
+            setattr(se, key, value)
+        se.projectName = name
+        se.projectPath = os.path.join(projectsPath, name)
+        se.cropFieldImagePath = imagePath
+        fieldsSettings.append(se)
+
+    return fieldsSettings, manifest.get('workers', 1)
+
+
+def updateSettings(se: ProjectSettings, layers: Dict[str, Layer]) -> bool:
+    """Save the settings of a complete project if they changed, along with
+    the layers they restyle. Settings changing no stage output, like colors,
+    would be lost otherwise."""
+    try:
+        saved = ProjectSettings.load(se.projectSettingsPath)
+        if vars(saved) == vars(se):
+            return False
+    except Exception as err:
+        logger.error(err)
+
+    for layer in restyleLayers(se, layers):
+        layer.save()
+    se.save()
+    return True
+
+
+def processField(se: ProjectSettings, force: bool = False) -> Tuple[str, str]:
+    """Run the pipeline on a field, returning a status and a message."""
+    try:
+        if not utils.dirExists(se.projectPath):
+            os.makedirs(se.projectPath)
+        layers = buildLayers(se)
+        pipeline = Pipeline(se, layers)
+        if (
+            not force and
+            utils.fileExists(se.projectSettingsPath) and
+            not pipeline.plan()
+        ):
+            if updateSettings(se, layers):
+                return FIELD_SKIPPED, 'already complete, settings updated'
+            return FIELD_SKIPPED, 'already complete'
+        pipeline.run()
+        se.save()
+    except Exception as err:
+        logger.exception(err)
+        return FIELD_FAILED, str(err)
+    return FIELD_DONE, se.projectPath
+
+
+def report(
+    fieldsSettings: List[ProjectSettings],
+    results: Iterable[Tuple[str, str]]
+) -> int:
+    failed = 0
+    for se, (status, message) in zip(fieldsSettings, results):
+        print(f'{se.projectName}: {status} ({message})', flush=True)
+        if status == FIELD_FAILED:
+            failed += 1
+    return failed
+
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(
+        description='Process crop field images without the user interface.'
+    )
+    parser.add_argument('manifest', help='JSON file listing the fields')
+    parser.add_argument(
+        '-w', '--workers', type=int, default=None,
+        help='number of fields processed at the same time'
+    )
+    parser.add_argument(
+        '-f', '--force', action='store_true',
+        help='process fields even if their project is complete'
+    )
+    args = parser.parse_args(argv)
+
+    fieldsSettings, workers = loadManifest(args.manifest)
+    if args.workers is not None:
+        workers = args.workers
+    workers = max(1, min(workers, len(fieldsSettings)))
+
+    process = functools.partial(processField, force=args.force)
+    if workers == 1:
+        failed = report(fieldsSettings, map(process, fieldsSettings))
+    else:
+        # Fields already run in parallel, so segmentation uses a single
+        # process per field unless a worker count is given
+        for se in fieldsSettings:
+            if se.segmentWorkers <= 0:
+                se.segmentWorkers = 1
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = executor.map(process, fieldsSettings)
+            failed = report(fieldsSettings, results)
+
+    print(
+        f'{len(fieldsSettings) - failed} of {len(fieldsSettings)} '
+        f'fields processed'
+    )
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
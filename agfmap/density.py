@@ -0,0 +1,88 @@
+import os
+from typing import List, Tuple
+
+import cv2 as cv
+import numpy as np
+
+
+def colormapColors(colormap: int) -> List[List[int]]:
+    """RGB colors of the 256 entries of an OpenCV colormap."""
+    values = np.arange(256, dtype=np.uint8).reshape((-1, 1))
+    colors = cv.applyColorMap(values, colormap).reshape((-1, 3))
+    return colors[:, ::-1].tolist()
+
+
+class DensityMap:
+    """Density map kept as a single value per cell of a grid.
+
+    Slicing it like an array gives the color index of the pixels, the
+    density scaled from the range of the grid to 0-255, so colors can be
+    applied at display time. It is saved as a ``.npz`` file holding the
+    float32 grid and the size of its cells.
+    """
+
+    def __init__(
+        self,
+        grid: np.ndarray,
+        cellSize: Tuple[int, int],
+        shape: Tuple[int, int]
+    ):
+        self.grid: np.ndarray = np.float32(grid)
+        self.cellSize: Tuple[int, int] = tuple(cellSize)
+        self.shape: Tuple[int, int] = tuple(shape[0:2])
+        self._indices: np.ndarray = None
+
+    @staticmethod
+    def load(filePath: str, shape: Tuple[int, int]) -> 'DensityMap':
+        with np.load(filePath) as data:
+            return DensityMap(data['grid'], data['cellSize'], shape)
+
+    def save(self, filePath: str):
+        tmpPath = filePath + '.tmp.npz'
+        np.savez(tmpPath, grid=self.grid, cellSize=np.int64(self.cellSize))
+        os.replace(tmpPath, filePath)
+
+    @property
+    def ndim(self) -> int:
+        return 2
+
+    @property
+    def dtype(self) -> np.dtype:
+        return np.dtype(np.uint8)
+
+    @property
+    def nbytes(self) -> int:
+        return self.grid.nbytes
+
+    @property
+    def maprange(self) -> List[float]:
+        # noinspection PyArgumentList
+        return [float(self.grid.min()), float(self.grid.max())]
+
+    @property
+    def indices(self) -> np.ndarray:
+        """Color index of every cell, as `mcrops.utils.array_image` scales
+        values before applying a colormap."""
+        if self._indices is None:
+            low, high = self.maprange
+            if high == low:
+                self._indices = np.clip(
+                    self.grid, 0, 255, dtype=np.uint8, casting='unsafe'
+                )
+            else:
+                self._indices = np.uint8(
+                    255.0 / (high - low) * (self.grid - low)
+                )
+        return self._indices
+
+    def __getitem__(self, key) -> np.ndarray:
+        rows, cols = key if isinstance(key, tuple) else (key, slice(None))
+        y1, y2, _ = rows.indices(self.shape[0])
+        x1, x2, _ = cols.indices(self.shape[1])
+        cellWidth, cellHeight = self.cellSize
+        cellRows = np.arange(y1, max(y1, y2)) // cellHeight
+        cellCols = np.arange(x1, max(x1, x2)) // cellWidth
+        return self.indices[np.ix_(cellRows, cellCols)]
+
+    def unpack(self) -> np.ndarray:
+        return self[:, :]
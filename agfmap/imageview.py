@@ -1,12 +1,6 @@
-import json
-from typing import List, Dict
-
-import cv2 as cv
-import numpy as np
 from PyQt5 import QtCore
-from PyQt5.QtCore import QPoint
+from PyQt5.QtCore import QElapsedTimer, QPoint, QRect, QRectF, QSize, QTimer
 from PyQt5.QtGui import (
-    QImage,
     QPainter,
     QPalette,
     qRed,
@@ -16,130 +10,55 @@ from PyQt5.QtGui import (
     QShowEvent,
     QKeyEvent,
     QCursor,
-    QPixmap
+    QPixmap,
+    QRegion
 )
 from PyQt5.QtWidgets import (
     QSizePolicy,
     QLabel,
     QFrame,
-    QHBoxLayout
+    QHBoxLayout,
+    QWIDGETSIZE_MAX
 )
 
-import utils
+import tracing
 import values
 from applog import logger
+from layer import Layer
 from scale import ColorScale
-from shape import Shape
+from shape import Shape, ShapeCollection
+from shaperender import ShapeRenderer
 
 
 JOIN_THR = 20
 
+# Milliseconds between two zooms of the view, wheel events in between being
+# combined into one zoom
+FRAME_INTERVAL = 16
 
-class Layer:
-    # noinspection PyTypeChecker
-    def __init__(self, name: str, filePath: str = '', flags=None):
-
-        self.name: str = name
-        self.filePath: str = filePath
-        self.shapes: Dict[str, List[Shape]] = {}
-        self.position: list = [0, 0]
-        self.scale: float = 1.0
-        self.colormap: list = None
-        self.maprange: list = [0, 1]
-        self.transform: list = None
-        self.flags = flags
-        self.image: np.ndarray = None
-
-        self.read()
-
-    def read(self):
-        if utils.fileExists(self.filePath):
-            self.image: np.ndarray = cv.imread(self.filePath, flags=self.flags)
-            if self.image is None:
-                return
-
-            try:
-                with open(utils.swapExt(self.filePath, '.im')) as fp:
-                    data: dict = json.load(fp)
-                    self.name = data.get('name', self.name)
-                    self.position = data.get('position', self.position)
-                    self.scale = data.get('scale', self.scale)
-                    self.colormap = data.get('colormap', self.colormap)
-                    self.maprange = data.get('maprange', self.maprange)
-                    self.transform = data.get('transform', self.transform)
-                    self.flags = data.get('flags', self.flags)
-                    shapesData = data.get('shapes', None)
-                    if shapesData is not None:
-                        for name, shapeSet in shapesData.items():
-                            self.shapes[name] = []
-                            for shapeData in shapeSet:
-                                shape = Shape()
-                                shape.data = shapeData
-                                self.shapes[name].append(shape)
-
-            except OSError:
-                pass
-            except Exception as err:
-                logger.error(err)
-
-    def save(self):
-        if self.filePath and self.image is not None:
-            cv.imwrite(self.filePath, self.image)
-            try:
-                dataPath = utils.swapExt(self.filePath, '.im')
-                with open(dataPath, 'wt') as fp:
-                    shapes = {}
-                    for name, shapeSet in self.shapes.items():
-                        shapes[name] = [shape.data for shape in shapeSet]
-                    data = {
-                        'name': self.name,
-                        'shapes': shapes,
-                        'position': self.position,
-                        'scale': self.scale,
-                        'colormap': self.colormap,
-                        'maprange': self.maprange,
-                        'transform': self.transform,
-                        'flags': self.flags,
-                    }
-                    jsonData = json.dumps(data)
-                    fp.write(jsonData)
-            except Exception as err:
-                logger.error(err)
-
-    @property
-    def qImage(self):
-        if not self.isEmpty:
-            return QImage(self.filePath)
-        return None
-
-    @property
-    def isEmpty(self):
-        return not utils.fileExists(self.filePath)
-
-    def getLatLon(self, pos):
-        x, y = pos.x(), pos.y()
-        M = self.transform
-        lon = M[0][0]*x + M[0][1]*y + M[0][2]
-        lat = M[1][0]*x + M[1][1]*y + M[1][2]
-        return lat, lon
-
-    def getShape(self, name):
-        if name in self.shapes:
-            return self.shapes[name]
-        return None
+# Milliseconds without input after which the view is drawn at full quality
+REFINE_DELAY = 150
 
 
 class Canvas(QLabel):
+    """Viewport of the size of its `ImageView`, showing the shown layer at
+    its `scale`, with the top left corner of the image at its `position`.
+
+    The view is drawn into `buffer`, and painted from it. Panning scrolls
+    the buffer, drawing only the strips it uncovers.
+    """
+
     # noinspection PyTypeChecker
     def __init__(self, parent):
         super(Canvas, self).__init__(parent)
 
         self.activeTool = None
         self.layer: Layer = None
-        self.qImage: QImage = None
+        self.imageSize: QSize = None
         self.currentShape: Shape = None
         self.lastDragPos: QPoint = QtCore.QPoint()
-        self.sizeLimits: tuple = (128, 8192)
+        self.sizeLimits: tuple = (128, QWIDGETSIZE_MAX)
+        self.maxScale: float = 32
         self.setToolPan()
         sizePolicy = QSizePolicy(QSizePolicy.Preferred, QSizePolicy.Preferred)
         self.setSizePolicy(sizePolicy)
@@ -150,11 +69,18 @@ class Canvas(QLabel):
         self.infoLabel.setMargin(5)
         self.infoLabel.setVisible(False)
         self.cursorClose = QCursor(QPixmap(values.cursorCloseImage))
-
-    def sizeHint(self):
-        if self.layer is not None and self.qImage is not None:
-            return self.layer.scale * self.qImage.size()
-        return QtCore.QSize(0, 0)
+        self.shapeRenderer: ShapeRenderer = ShapeRenderer()
+        # Drawn fast, at lower detail, while zoomed or panned
+        self.interacting: bool = False
+        self.refineTimer: QTimer = QTimer(self)
+        self.refineTimer.setSingleShot(True)
+        self.refineTimer.setInterval(REFINE_DELAY)
+        self.refineTimer.timeout.connect(self.refine)
+        self.buffer: QPixmap = QPixmap()
+        self.bufferValid: bool = False
+        # Parts of the buffer drawn fast, drawn again by `refine`
+        self.roughRegion: QRegion = QRegion()
+        self.setAttribute(QtCore.Qt.WA_OpaquePaintEvent)
 
     def reset(self):
         if self.layer is not None:
@@ -163,64 +89,148 @@ class Canvas(QLabel):
 
     def setImage(self, imageWrapper):
 
+        pyramid = imageWrapper.pyramid
+        if pyramid is None:
+            # The layer file exists but could not be decoded
+            logger.error(f'Cannot read image {imageWrapper.filePath}')
+            self.layer = None
+            self.imageSize = None
+            self.redraw()
+            return
         self.layer = imageWrapper
-        self.qImage = imageWrapper.qImage
+        self.imageSize = pyramid.size
 
     def updateView(self):
         if self.layer is not None:
             if self.layer.scale == 1.0 and self.layer.position == [0, 0]:
                 self.adjustToParentSize()
-            else:
-                self.resize(self.layer.scale * self.qImage.size())
-                self.move(self.layer.position[0], self.layer.position[1])
-            self.update()
+            self.redraw()
 
     def scaleImage(self, factor):
 
         if self.layer is not None:
             scale = factor * self.layer.scale
-            size = scale * self.qImage.size()
+            size = scale * self.imageSize
             sizeMax = max(size.width(), size.height())
             sizeMin = max(size.width(), size.height())
-            if sizeMin > self.sizeLimits[0] and sizeMax < self.sizeLimits[1]:
-                offset = self.geometry().center()
-                self.resize(size)
-                pos = offset - self.rect().center()
-                self.move(pos)
+            if (
+                sizeMin > self.sizeLimits[0] and
+                sizeMax < self.sizeLimits[1] and
+                scale <= self.maxScale
+            ):
+                # The center of the image stays in place
+                x, y = self.layer.position
+                oldSize = self.layer.scale * self.imageSize
                 self.layer.scale = scale
-                self.layer.position = [pos.x(), pos.y()]
+                self.layer.position = [
+                    x + (oldSize.width() - size.width()) // 2,
+                    y + (oldSize.height() - size.height()) // 2
+                ]
+                self.redraw()
+
+    def interact(self):
+        """Draw fast until input stops for `REFINE_DELAY`."""
+        self.interacting = True
+        self.refineTimer.start()
+
+    def refine(self):
+        self.interacting = False
+        if self.bufferValid and not self.roughRegion.isEmpty():
+            self.drawBuffer(self.roughRegion.boundingRect())
+            self.update()
+
+    def redraw(self):
+        """Draw the whole view again at the next paint."""
+        self.bufferValid = False
+        self.update()
+
+    def pan(self, dx: int, dy: int):
+        """Move the image by (dx, dy) pixels."""
+        x, y = self.layer.position
+        self.layer.position = [x + dx, y + dy]
+        if not self.bufferValid or self.buffer.size() != self.size():
+            self.redraw()
+            return
+        exposed = self.buffer.scroll(dx, dy, self.buffer.rect())
+        self.roughRegion.translate(dx, dy)
+        self.roughRegion &= QRegion(self.buffer.rect())
+        for rect in exposed.rects():
+            self.drawBuffer(rect)
+        self.update()
+
+    def toImage(self, pos: QPoint) -> QPoint:
+        """Pixel of the image at a point of the view."""
+        x, y = self.layer.position
+        return (pos - QPoint(int(x), int(y))) / self.layer.scale
 
     def adjustToParentSize(self):
         if self.layer is not None:
-            w, h = self.qImage.width(), self.qImage.height()
-            W, H = self.parentWidget().width(), self.parentWidget().height()
+            w, h = self.imageSize.width(), self.imageSize.height()
+            W, H = self.width(), self.height()
             self.layer.scale = min(W / float(w), H / float(h))
-            self.resize(self.layer.scale * self.qImage.size())
             self.center()
 
     def center(self):
 
-        offset = (self.parentWidget().size() - self.size())/2
+        offset = (self.size() - self.layer.scale * self.imageSize)/2
         self.layer.position = [offset.width(), offset.height()]
-        self.move(offset.width(), offset.height())
+        self.redraw()
 
     def paintEvent(self, event):
+        with tracing.span('paintEvent', 'render'):
+            self._paint(event)
+
+    def _paint(self, event):
+        if not self.bufferValid or self.buffer.size() != self.size():
+            if self.buffer.size() != self.size():
+                self.buffer = QPixmap(self.size())
+            self.drawBuffer(self.buffer.rect())
+            self.bufferValid = True
         painter = QPainter(self)
-        if self.layer is not None:
-            painter.resetTransform()
-            painter.drawImage(self.rect(), self.qImage)
-            self.drawShapes(painter)
-        else:
-            painter.eraseRect(self.rect())
+        painter.drawPixmap(event.rect(), self.buffer, event.rect())
 
-    def drawShapes(self, painter):
+    def drawBuffer(self, rect: QRect):
+        """Draw a part of the view into `buffer`."""
+        if self.interacting:
+            self.roughRegion |= QRegion(rect)
+        else:
+            self.roughRegion -= QRegion(rect)
+        painter = QPainter(self.buffer)
+        painter.setClipRect(rect)
+        painter.fillRect(rect, self.palette().window())
+        if self.layer is not None:
+            x, y = self.layer.position
+            painter.translate(x, y)
+            # The part of the scaled image to draw
+            rect = QRectF(rect).translated(-x, -y)
+            if not self.interacting:
+                painter.setRenderHint(QPainter.SmoothPixmapTransform)
+            # Only the tiles in the exposed part of the canvas, taken from
+            # the overview level closest to the current scale, or the next
+            # one while interacting
+            with tracing.span('drawTiles', 'render'):
+                tiles = self.layer.pyramid.visibleTiles(
+                    rect, self.layer.scale, coarser=int(self.interacting)
+                )
+                for target, tile in tiles:
+                    painter.drawImage(target, tile)
+            self.drawShapes(painter, rect)
+        painter.end()
+
+    def drawShapes(self, painter, rect: QRectF):
         if len(self.layer.shapes) > 0:
-            painter.resetTransform()
-            painter.scale(self.layer.scale, self.layer.scale)
-            for shapes in self.layer.shapes.values():
-                for shape in shapes:
-                    if shape.visible:
-                        shape.draw(painter)
+            scale = self.layer.scale
+            painter.scale(scale, scale)
+            # Exposed part of the canvas, in image coordinates
+            rect = QRectF(
+                rect.x() / scale, rect.y() / scale,
+                rect.width() / scale, rect.height() / scale
+            )
+            for name, shapes in self.layer.shapes.items():
+                with tracing.span('drawShapes', 'render', group=name):
+                    self.shapeRenderer.draw(
+                        painter, shapes, rect, scale, self.interacting
+                    )
 
     def mousePressEvent(self, event):
         if self.layer is not None:
@@ -238,7 +248,7 @@ class Canvas(QLabel):
                         if shape.form == Shape.LINE and len(shape.points) == 2:
                             self.endDrawing()
                             return
-                        point = event.pos() / self.layer.scale
+                        point = self.toImage(event.pos())
                         if shape.form == shape.POLYGON and len(shape.points) >= 4:
                             dx = abs(point.x() - shape.points[0][0])
                             dy = abs(point.y() - shape.points[0][1])
@@ -249,7 +259,7 @@ class Canvas(QLabel):
                                 return
                         shape.points.append([point.x(), point.y()])
                         shape.points.append([point.x(), point.y()])
-                    self.update()
+                    self.redraw()
                 elif self.activeTool == self.Tools.INFO:
                     text = self.getInfo(event.pos())
                     tpos = self.mapTo(self.parentWidget(), event.pos())
@@ -262,10 +272,10 @@ class Canvas(QLabel):
         if self.layer is not None:
             leftButtonPressed = event.buttons() == QtCore.Qt.LeftButton
             if self.activeTool == self.Tools.PAN and leftButtonPressed:
-                newPos = self.pos() + event.globalPos() - self.lastDragPos
-                self.move(newPos)
-                self.layer.position = [newPos.x(), newPos.y()]
+                delta = event.globalPos() - self.lastDragPos
                 self.lastDragPos = QtCore.QPoint(event.globalPos())
+                self.interact()
+                self.pan(delta.x(), delta.y())
             elif self.activeTool == self.Tools.DRAW:
                 shape = self.currentShape
                 if shape is not None and (
@@ -273,7 +283,7 @@ class Canvas(QLabel):
                     shape.form == Shape.POLYLINE or
                     shape.form == Shape.LINE
                 ) and len(shape.points):
-                    point = event.pos() / self.layer.scale
+                    point = self.toImage(event.pos())
                     index = len(shape.points) - 1
                     shape.points[index] = [point.x(), point.y()]
                     if shape.form == shape.POLYGON and len(shape.points) >= 4:
@@ -283,7 +293,7 @@ class Canvas(QLabel):
                             self.setCursor(self.cursorClose)
                         else:
                             self.setCursor(QtCore.Qt.CrossCursor)
-                    self.update()
+                    self.redraw()
 
     def mouseReleaseEvent(self, event):
         if self.layer is not None:
@@ -379,13 +389,13 @@ class Canvas(QLabel):
         self.currentShape.drawing = False
         self.setToolPan()
         self.setMouseTracking(False)
-        self.update()
+        self.redraw()
 
     def getInfo(self, pos):
         info = ''
-        if self.qImage is not None:
-            pos /= self.layer.scale
-            pixel = self.qImage.pixel(pos)
+        if self.layer is not None and self.imageSize is not None:
+            pos = self.toImage(pos)
+            pixel = self.layer.pyramid.pixel(pos.x(), pos.y())
             r, g, b = qRed(pixel), qGreen(pixel), qBlue(pixel)
             info += f'RGB color: ({r}, {g}, {b})\n'
             info += f'Position: ({pos.x()}, {pos.y()})'
@@ -394,35 +404,41 @@ class Canvas(QLabel):
     def unsetTool(self):
         if self.activeTool == self.Tools.INFO:
             self.infoLabel.setVisible(False)
-            self.update()
+            self.redraw()
         if self.activeTool == self.Tools.DRAW and (
             self.currentShape is not None and
             self.currentShape.drawing and
             self.currentShape.name in self.layer.shapes
         ):
             del self.layer.shapes[self.currentShape.name]
-            self.update()
+            self.redraw()
 
     def deleteShape(self, name: str = None):
         if self.layer is not None:
             if name is None:
                 self.layer.shapes.clear()
-                self.update()
+                self.redraw()
             elif name in self.layer.shapes:
                 del self.layer.shapes[name]
-                self.update()
+                self.redraw()
 
     def setShapeVisible(self, name: str = None, visible: bool = True):
         if self.layer is not None:
             if name is None:
                 for shapeSet in self.layer.shapes.values():
-                    for shape in shapeSet:
-                        shape.visible = visible
-                self.update()
+                    self._setVisible(shapeSet, visible)
+                self.redraw()
             elif name in self.layer.shapes:
-                for shape in self.layer.shapes[name]:
-                    shape.visible = visible
-                self.update()
+                self._setVisible(self.layer.shapes[name], visible)
+                self.redraw()
+
+    @staticmethod
+    def _setVisible(shapeSet, visible: bool):
+        if isinstance(shapeSet, ShapeCollection):
+            shapeSet.visible = visible
+        else:
+            for shape in shapeSet:
+                shape.visible = visible
 
     def getShape(self, name):
         if self.layer is None:
@@ -443,6 +459,12 @@ class ImageView(QFrame):
         super(ImageView, self).__init__(parent)
 
         self.zoomInScale = 1.25
+        # Zoom factor of the wheel events not applied yet
+        self.pendingZoom: float = 1.0
+        self.zoomTimer: QTimer = QTimer(self)
+        self.zoomTimer.setSingleShot(True)
+        self.zoomTimer.timeout.connect(self.applyZoom)
+        self.lastZoomTime: QElapsedTimer = QElapsedTimer()
         self.canvas = Canvas(self)
         self.canvas.resize(0, 0)
         self.setBackgroundRole(QPalette.Shadow)
@@ -464,21 +486,24 @@ class ImageView(QFrame):
             if self.isVisible():
                 self.canvas.updateView()
 
-            if imageWrapper.colormap is not None:
+            if self.canvas.layer is not None and \
+                    imageWrapper.colormap is not None:
                 self.colorScale.setColorMap(imageWrapper.colormap, imageWrapper.maprange)
                 self.colorScale.setVisible(True)
             else:
                 self.colorScale.setVisible(False)
 
     def clear(self):
-        self.canvas.image = None
-        self.canvas.resize(0, 0)
+        self.canvas.layer = None
+        self.canvas.redraw()
 
     def showEvent(self, event: QShowEvent) -> None:
+        self.canvas.setGeometry(self.contentsRect())
         self.canvas.updateView()
         super(ImageView, self).showEvent(event)
 
     def resizeEvent(self, event):
+        self.canvas.setGeometry(self.contentsRect())
         self.canvas.updateView()
         super(ImageView, self).resizeEvent(event)
         
@@ -494,7 +519,20 @@ class ImageView(QFrame):
 
     def wheelEvent(self, event: QWheelEvent):
         delta = event.angleDelta()
-        if delta is not None:
-            self.canvas.scaleImage(
-                pow(self.zoomInScale, delta.y()/120.0)
-            )
+        if delta is not None and delta.y():
+            self.requestZoom(pow(self.zoomInScale, delta.y()/120.0))
+
+    def requestZoom(self, factor: float):
+        """Zoom by `factor` at the next frame, along with the other zooms
+        requested until then."""
+        self.pendingZoom *= factor
+        if not self.zoomTimer.isActive():
+            elapsed = self.lastZoomTime.elapsed() \
+                if self.lastZoomTime.isValid() else FRAME_INTERVAL
+            self.zoomTimer.start(max(0, FRAME_INTERVAL - elapsed))
+
+    def applyZoom(self):
+        factor, self.pendingZoom = self.pendingZoom, 1.0
+        self.lastZoomTime.start()
+        self.canvas.interact()
+        self.canvas.scaleImage(factor)
@@ -0,0 +1,378 @@
+import copy
+import json
+import os
+import threading
+import weakref
+from collections import OrderedDict
+from typing import Iterable, List, Dict, Union
+
+import cv2 as cv
+import numpy as np
+from PyQt5.QtGui import QImage, qRgb
+
+import profiler
+import tracing
+import utils
+from applog import logger
+from pyramid import TilePyramid, toQImage
+from settings import SHAPES_DIR_NAME
+from shape import Shape, ShapeCollection
+from tilecache import TileCache
+
+# Decoded layers, least recently used first, and the number of bytes of pixel
+# data they may keep in memory all together (0 for no limit)
+_memory = {
+    'layers': OrderedDict(),
+    'budget': 0,
+    'lock': threading.Lock(),
+}
+
+
+def setMemoryBudget(budget: int):
+    with _memory['lock']:
+        _memory['budget'] = budget
+        _evict()
+
+
+def _touch(layer: 'Layer'):
+    with _memory['lock']:
+        _memory['layers'][id(layer)] = weakref.ref(layer)
+        _memory['layers'].move_to_end(id(layer))
+        _evict()
+
+
+def _evict():
+    loaded = []
+    for key, ref in list(_memory['layers'].items()):
+        layer = ref()
+        if layer is None or layer._image is None:
+            del _memory['layers'][key]
+        else:
+            loaded.append((key, layer))
+
+    budget = _memory['budget']
+    used = sum(layer.nbytes for _, layer in loaded)
+    # The most recently used layer is never released
+    for key, layer in loaded[:-1]:
+        if budget <= 0 or used <= budget:
+            break
+        # Images not saved since they were set cannot be read back
+        if layer._stored:
+            used -= layer.nbytes
+            layer._image = None
+            layer._qImage = None
+            layer._pyramid = None
+            del _memory['layers'][key]
+
+
+class Layer:
+    # noinspection PyTypeChecker
+    def __init__(
+        self,
+        name: str,
+        filePath: str = '',
+        flags=None,
+        storage: type = None
+    ):
+
+        self.name: str = name
+        self.filePath: str = filePath
+        self.shapes: Dict[str, Union[List[Shape], ShapeCollection]] = {}
+        self.position: list = [0, 0]
+        self.scale: float = 1.0
+        self.colormap: list = None
+        self.maprange: list = [0, 1]
+        self.transform: list = None
+        self.flags = flags
+        self.stageKey: str = ''
+        self.shape: list = None
+        # Class keeping the pixels in memory instead of an array, like
+        # `mask.PackedMask` or `density.DensityMap`, which also reads and
+        # writes the layer file
+        self.storage: type = storage
+        # Pixel data is decoded from `filePath` on first access. `_stored` is
+        # true while the file holds the same image, so it can be released.
+        self._image = None
+        self._stored: bool = True
+        self._qImage: QImage = None
+        self._pyramid: TilePyramid = None
+        # Where the overviews of the image are kept between sessions
+        self.tileCache: TileCache = None
+        # Metadata as last read from or written to disk
+        self._savedData: str = ''
+
+        self.read()
+
+    @property
+    def pixels(self):
+        """The image as it is kept in memory, an instance of `storage` if
+        the layer has one."""
+        # Another thread may release the image, keep a reference to it
+        image = self._image
+        if image is None and self._stored:
+            if utils.fileExists(self.filePath):
+                with tracing.span('read', 'layer', layer=self.name), \
+                        profiler.measure('read', self.name) as entry:
+                    if self.storage is not None:
+                        image = self.storage.load(self.filePath, self.shape)
+                    else:
+                        image = cv.imread(self.filePath, flags=self.flags)
+                    entry['image'] = profiler.describe(image)
+                self._image = image
+        if image is not None:
+            _touch(self)
+        return image
+
+    @property
+    def image(self) -> np.ndarray:
+        image = self.pixels
+        if image is not None and not isinstance(image, np.ndarray):
+            return image.unpack()
+        return image
+
+    @image.setter
+    def image(self, image: np.ndarray):
+        if self.storage is not None and isinstance(image, np.ndarray):
+            image = self.storage.fromArray(image)
+        if image is not None:
+            self.shape = list(image.shape[0:2])
+        self._image = image
+        self._qImage = None
+        self._pyramid = None
+        self._stored = image is None
+        if image is not None:
+            _touch(self)
+
+    def read(self):
+        """Read the layer metadata, pixel data is decoded on demand."""
+        if utils.fileExists(self.filePath):
+            try:
+                with open(utils.swapExt(self.filePath, '.im')) as fp:
+                    data: dict = json.load(fp)
+                    self.name = data.get('name', self.name)
+                    self.position = data.get('position', self.position)
+                    self.scale = data.get('scale', self.scale)
+                    self.colormap = data.get('colormap', self.colormap)
+                    self.maprange = data.get('maprange', self.maprange)
+                    self.transform = data.get('transform', self.transform)
+                    self.flags = data.get('flags', self.flags)
+                    self.stageKey = data.get('stageKey', self.stageKey)
+                    self.shape = data.get('shape', self.shape)
+                    shapesData = data.get('shapes', None)
+                    if shapesData is not None:
+                        for name, shapeSet in shapesData.items():
+                            self._readShapes(name, shapeSet)
+                self._savedData = self.jsonData()
+
+            except OSError:
+                pass
+            except Exception as err:
+                logger.error(err)
+
+    def _readShapes(self, name: str, shapeSet: Union[list, dict]):
+        if isinstance(shapeSet, dict):
+            try:
+                self.shapes[name] = ShapeCollection.load(
+                    self.shapesDirPath, shapeSet
+                )
+            except OSError as err:
+                logger.error(err)
+            return
+        shapes = []
+        for shapeData in shapeSet:
+            shape = Shape()
+            shape.data = shapeData
+            shapes.append(shape)
+        # Crop rows of older projects are lists of shapes
+        collection = ShapeCollection.fromShapes(shapes) \
+            if len(shapes) > 1 else None
+        self.shapes[name] = shapes if collection is None else collection
+
+    @property
+    def shapesDirPath(self) -> str:
+        return os.path.join(os.path.dirname(self.filePath), SHAPES_DIR_NAME)
+
+    def jsonData(self) -> str:
+        shapes = {}
+        for name, shapeSet in self.shapes.items():
+            if isinstance(shapeSet, ShapeCollection):
+                shapes[name] = shapeSet.data
+            else:
+                shapes[name] = [shape.data for shape in shapeSet]
+        data = {
+            'name': self.name,
+            'shapes': shapes,
+            'position': self.position,
+            'scale': self.scale,
+            'colormap': self.colormap,
+            'maprange': self.maprange,
+            'transform': self.transform,
+            'flags': self.flags,
+            'stageKey': self.stageKey,
+            'shape': self.shape,
+        }
+        return json.dumps(data)
+
+    def save(self):
+        """Write the parts of the layer that changed, each file is replaced
+        at once so an interrupted save leaves the previous one."""
+        if not self.filePath:
+            return
+        with tracing.span('save', 'layer', layer=self.name), \
+                profiler.measure('save', self.name):
+            self._save()
+
+    def _save(self):
+        image = self._image
+        if not self._stored and isinstance(image, self.storage or ()):
+            image.save(self.filePath)
+            self._stored = True
+        elif not self._stored and image is not None:
+            ext = os.path.splitext(self.filePath)[1]
+            ok, buffer = cv.imencode(ext, image)
+            if not ok:
+                raise OSError(f'Cannot encode image {self.filePath}')
+            utils.writeFileAtomic(self.filePath, buffer.tobytes())
+            self._stored = True
+        if not self.isEmpty:
+            try:
+                for shapeSet in self.shapes.values():
+                    if isinstance(shapeSet, ShapeCollection):
+                        shapeSet.save(self.shapesDirPath)
+                jsonData = self.jsonData()
+                if jsonData != self._savedData:
+                    dataPath = utils.swapExt(self.filePath, '.im')
+                    utils.writeFileAtomic(dataPath, jsonData.encode())
+                    self._savedData = jsonData
+            except Exception as err:
+                logger.error(err)
+
+    def copy(self) -> 'Layer':
+        layer = copy.copy(self)
+        layer.shapes = dict(self.shapes)
+        layer._pyramid = None
+        return layer
+
+    def update(self, other: 'Layer'):
+        self._image = other._image
+        self._stored = other._stored
+        self._qImage = other._qImage
+        self._pyramid = None
+        self._savedData = other._savedData
+        if self._image is not None:
+            _touch(self)
+        self.shapes = dict(other.shapes)
+        self.colormap = other.colormap
+        self.maprange = other.maprange
+        self.transform = other.transform
+        self.flags = other.flags
+        self.stageKey = other.stageKey
+        self.shape = other.shape
+
+    @property
+    def qImage(self) -> QImage:
+        qImage = self._qImage
+        if qImage is None:
+            image = self.image
+            if image is not None:
+                qImage = self._qImage = toQImage(image, self.colorTable)
+        return qImage
+
+    @property
+    def colorTable(self) -> List[int]:
+        """Colors of the values of gray images, like density maps, which are
+        drawn through the colormap of the layer."""
+        if self.colormap is None:
+            return None
+        return [qRgb(*color) for color in self.colormap]
+
+    def setColormap(self, colormap: list):
+        self.colormap = colormap
+        self._qImage = None
+        if self._pyramid is not None:
+            self._pyramid.setColorTable(self.colorTable)
+
+    @property
+    def pyramid(self) -> TilePyramid:
+        pyramid = self._pyramid
+        if pyramid is not None:
+            return pyramid
+
+        cached = None
+        if self.tileCache is not None and self._stored and not self.isEmpty:
+            cached = self.tileCache.load(self.tileCache.key(self.filePath))
+        if cached is not None:
+            shape, overviews = cached
+            pyramid = TilePyramid(
+                shape, lambda: self.pixels, overviews,
+                colorTable=self.colorTable
+            )
+        else:
+            image = self.pixels
+            if image is None:
+                return None
+            pyramid = TilePyramid(
+                image.shape, lambda: self.pixels, colorTable=self.colorTable
+            )
+        self._pyramid = pyramid
+        return pyramid
+
+    def cacheTiles(self):
+        """Compute the overviews of the image and store them in the tile
+        cache, unless they are already there."""
+        if self.tileCache is None or not self._stored or self.isEmpty:
+            return
+        key = self.tileCache.key(self.filePath)
+        if self.tileCache.contains(key):
+            return
+        image = self.pixels
+        if image is None:
+            return
+        overviews = TilePyramid(image.shape, lambda: image).build()
+        # The file may have been replaced while computing them
+        if self._stored and self.tileCache.key(self.filePath) == key:
+            self.tileCache.store(key, image.shape, overviews)
+
+    @property
+    def nbytes(self) -> int:
+        """Memory used by the decoded image and its overviews."""
+        image, pyramid = self._image, self._pyramid
+        nbytes = 0 if image is None else image.nbytes
+        if pyramid is not None:
+            nbytes += pyramid.nbytes
+        return nbytes
+
+    @property
+    def isEmpty(self):
+        return not utils.fileExists(self.filePath)
+
+    def getLatLon(self, pos):
+        x, y = pos.x(), pos.y()
+        M = self.transform
+        lon = M[0][0]*x + M[0][1]*y + M[0][2]
+        lat = M[1][0]*x + M[1][1]*y + M[1][2]
+        return lat, lon
+
+    def getShape(self, name):
+        if name in self.shapes:
+            return self.shapes[name]
+        return None
+
+
+def removeUnusedShapes(dirPath: str, layers: Iterable[Layer]):
+    """Remove the files of the shape collections of a project directory
+    that none of its layers uses."""
+    shapesDirPath = os.path.join(dirPath, SHAPES_DIR_NAME)
+    if not utils.dirExists(shapesDirPath):
+        return
+    used = {
+        shapeSet.fileName
+        for layer in layers for shapeSet in layer.shapes.values()
+        if isinstance(shapeSet, ShapeCollection)
+    }
+    for fileName in os.listdir(shapesDirPath):
+        if fileName not in used:
+            try:
+                os.remove(os.path.join(shapesDirPath, fileName))
+            except OSError as err:
+                logger.error(err)
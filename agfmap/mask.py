@@ -0,0 +1,230 @@
+import os
+from typing import Tuple, Union
+
+import cv2 as cv
+import numpy as np
+
+# Rows packed or unpacked at once, bounding the temporary memory used
+BAND_HEIGHT = 256
+
+
+class PackedMask:
+    """Binary image keeping eight pixels per byte, each row padded to a
+    whole number of bytes.
+
+    Slicing it like an array unpacks only the requested rows and columns
+    into a uint8 array of 0 and 255 values. It is saved as the ``.npy`` file
+    of its packed rows.
+    """
+
+    def __init__(self, bits: np.ndarray, width: int):
+        self.bits: np.ndarray = bits
+        self.width: int = width
+
+    @staticmethod
+    def fromArray(mask: np.ndarray) -> 'PackedMask':
+        """Pack the non zero pixels of a mask."""
+        h, w = mask.shape[0:2]
+        bits = np.empty((h, (w + 7) // 8), np.uint8)
+        for y in range(0, h, BAND_HEIGHT):
+            band = mask[y:y + BAND_HEIGHT]
+            bits[y:y + BAND_HEIGHT] = np.packbits(band > 0, axis=1)
+        return PackedMask(bits, w)
+
+    @staticmethod
+    def load(filePath: str, shape: Tuple[int, int]) -> 'PackedMask':
+        return PackedMask(np.load(filePath), shape[1])
+
+    def save(self, filePath: str):
+        tmpPath = filePath + '.tmp.npy'
+        np.save(tmpPath, self.bits)
+        os.replace(tmpPath, filePath)
+
+    @property
+    def shape(self) -> Tuple[int, int]:
+        return self.bits.shape[0], self.width
+
+    @property
+    def ndim(self) -> int:
+        return 2
+
+    @property
+    def dtype(self) -> np.dtype:
+        return np.dtype(np.uint8)
+
+    @property
+    def nbytes(self) -> int:
+        return self.bits.nbytes
+
+    def __getitem__(self, key) -> np.ndarray:
+        rows, cols = key if isinstance(key, tuple) else (key, slice(None))
+        y1, y2, _ = rows.indices(self.bits.shape[0])
+        x1, x2, _ = cols.indices(self.width)
+        x2 = max(x1, x2)
+        bits = np.unpackbits(self.bits[y1:y2, x1 // 8:(x2 + 7) // 8], axis=1)
+        offset = x1 % 8
+        return bits[:, offset:offset + x2 - x1] * np.uint8(255)
+
+    def unpack(self) -> np.ndarray:
+        return self[:, :]
+
+    def rowCounts(self, y1: int, y2: int) -> np.ndarray:
+        """Number of non zero pixels in every column of rows `y1` to `y2`."""
+        counts = np.zeros(self.width, np.int64)
+        for y in range(y1, y2, BAND_HEIGHT):
+            band = self.bits[y:min(y + BAND_HEIGHT, y2)]
+            bits = np.unpackbits(band, axis=1)[:, :self.width]
+            counts += bits.sum(0, dtype=np.int64)
+        return counts
+
+
+class SummedAreaTable:
+    """Number of non zero pixels of a mask above and to the left of every
+    position, so the pixels of any rectangle are counted in constant time.
+
+    `sums` has one more row and column than the mask, the first ones being
+    zero, and is saved with the stage outputs like any other array.
+    """
+
+    def __init__(self, sums: np.ndarray):
+        self.sums: np.ndarray = sums
+
+    @staticmethod
+    def fromMask(mask: 'Mask') -> 'SummedAreaTable':
+        h, w = mask.shape[0:2]
+        dtype = np.uint32 if h * w < 2 ** 32 else np.uint64
+        sums = np.zeros((h + 1, w + 1), dtype)
+        for y in range(0, h, BAND_HEIGHT):
+            band = mask[y:y + BAND_HEIGHT] > 0
+            rows = sums[y + 1:y + 1 + band.shape[0], 1:]
+            np.cumsum(band, axis=1, dtype=dtype, out=rows)
+            rows[0] += sums[y, 1:]
+            np.cumsum(rows, axis=0, dtype=dtype, out=rows)
+        return SummedAreaTable(sums)
+
+    @property
+    def shape(self) -> Tuple[int, int]:
+        return self.sums.shape[0] - 1, self.sums.shape[1] - 1
+
+    def count(self, x1, y1, x2, y2) -> np.ndarray:
+        """Non zero pixels of the rectangles from (`x1`, `y1`) to (`x2`,
+        `y2`), excluded. Coordinates may be arrays of the same shape."""
+        s = self.sums
+        return (
+            np.int64(s[y2, x2]) - np.int64(s[y1, x2]) -
+            np.int64(s[y2, x1]) + np.int64(s[y1, x1])
+        )
+
+    def coverage(self, x1: int, y1: int, x2: int, y2: int) -> float:
+        """Fraction of non zero pixels of a rectangle."""
+        area = max(0, x2 - x1) * max(0, y2 - y1)
+        return float(self.count(x1, y1, x2, y2)) / area if area else 0.0
+
+    def cellCounts(
+        self,
+        cellSize: Tuple[int, int],
+        offset: Tuple[int, int] = (0, 0)
+    ) -> np.ndarray:
+        h, w = self.shape
+        xs = gridEdges(w, cellSize[0], offset[0])
+        ys = gridEdges(h, cellSize[1], offset[1])
+        s = self.sums[np.ix_(ys, xs)].astype(np.int64)
+        return s[1:, 1:] - s[:-1, 1:] - s[1:, :-1] + s[:-1, :-1]
+
+
+Mask = Union[np.ndarray, PackedMask]
+# Anything pixels can be counted on
+Coverage = Union[np.ndarray, PackedMask, SummedAreaTable]
+
+
+def maskOverview(
+    mask: Mask,
+    level: int,
+    box: Tuple[int, int, int, int] = None
+) -> np.ndarray:
+    """Mask reduced by a factor of 2 ** `level`, each of its pixels being
+    set if any of the pixels it covers is. Only the part of the mask inside
+    `box`, (y1, y2, x1, x2), is reduced if it is given."""
+    factor = 2 ** level
+    if box is None:
+        box = (0, mask.shape[0], 0, mask.shape[1])
+    y1, y2, x1, x2 = box
+    h, w = y2 - y1, x2 - x1
+    shape = ((h - 1) // factor + 1, (w - 1) // factor + 1)
+    overview = np.empty(shape, np.uint8)
+    kernel = np.ones((factor, factor), np.uint8)
+    bandHeight = max(1, BAND_HEIGHT // factor) * factor
+    for y in range(0, h, bandHeight):
+        rows = mask[y1 + y:y1 + min(y + bandHeight, h), x1:x2]
+        band = np.uint8(rows > 0) * np.uint8(255)
+        # Dilating with the anchor at the kernel corner takes the maximum
+        # of the block each kept pixel starts
+        if factor > 1:
+            band = cv.dilate(band, kernel, anchor=(0, 0))
+        rows = band[::factor, ::factor]
+        overview[y // factor:y // factor + rows.shape[0]] = rows
+    return overview
+
+
+def gridEdges(length: int, cellLength: int, offset: int = 0) -> np.ndarray:
+    """Boundaries of the cells of a grid along one axis, the grid lines
+    being at `offset` plus multiples of `cellLength`. The first and last
+    cells are cut at 0 and `length`."""
+    start = offset % cellLength
+    edges = np.arange(start if start > 0 else cellLength, length, cellLength)
+    return np.concatenate(([0], edges, [length]))
+
+
+def cellCounts(
+    mask: Coverage,
+    cellSize: Tuple[int, int],
+    offset: Tuple[int, int] = (0, 0)
+) -> np.ndarray:
+    """Number of non zero pixels in each cell of a grid of `cellSize`
+    (width, height) pixels laid over a mask, reading one row of cells at a
+    time."""
+    if isinstance(mask, SummedAreaTable):
+        return mask.cellCounts(cellSize, offset)
+    h, w = mask.shape[0:2]
+    xs = gridEdges(w, cellSize[0], offset[0])
+    ys = gridEdges(h, cellSize[1], offset[1])
+    counts = np.zeros((ys.size - 1, xs.size - 1), np.int64)
+    for row, (y1, y2) in enumerate(zip(ys[:-1], ys[1:])):
+        if isinstance(mask, PackedMask):
+            rowCounts = mask.rowCounts(y1, y2)
+        else:
+            rowCounts = np.count_nonzero(mask[y1:y2], axis=0)
+        counts[row] = np.add.reduceat(rowCounts, xs[:-1])
+    return counts
+
+
+def densityGrid(
+    mask: Coverage,
+    roiMask: Coverage = None,
+    cellSize: Tuple[int, int] = (100, 100),
+    offset: Tuple[int, int] = (0, 0)
+) -> np.ndarray:
+    """Ratio of non zero pixels of `mask` to those of `roiMask` in every
+    cell of a grid, like `mcrops.veget.mask_density` with a single value per
+    cell. Cells mostly outside of the region of interest are set to 0.
+
+    Given summed area tables of the masks, the time taken only depends on
+    the number of cells.
+    """
+    roiRatioThr = 0.1
+    h, w = mask.shape[0:2]
+
+    # Area of every cell, smaller on the borders of the grid
+    heights = np.diff(gridEdges(h, cellSize[1], offset[1]))
+    widths = np.diff(gridEdges(w, cellSize[0], offset[0]))
+    cellArea = np.outer(heights, widths).astype(np.float64)
+
+    counts = cellCounts(mask, cellSize, offset)
+    roiArea = cellArea
+    if roiMask is not None:
+        roiArea = cellCounts(roiMask, cellSize, offset).astype(np.float64)
+
+    density = np.zeros(counts.shape, np.float32)
+    valid = roiArea / cellArea > roiRatioThr
+    density[valid] = counts[valid] / roiArea[valid]
+    return density
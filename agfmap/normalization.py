@@ -0,0 +1,97 @@
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Sequence, Tuple
+
+import cv2 as cv
+import numpy as np
+
+import tracing
+
+
+class Normalization:
+    """Rotation and crop making the crop rows of a field horizontal, like
+    `mcrops.veget.norm_image`, computed once for all the images of a field.
+
+    `matrix` maps the pixels of the field to those of the normalized images,
+    of `size` (width, height), and `transform` maps them back. `roiPoly` is
+    the region of interest in the normalized images.
+    """
+
+    def __init__(
+        self,
+        shape: Tuple[int, ...],
+        roiPoly: np.ndarray,
+        rowsDirection: float = 0,
+        roiTrim: bool = True
+    ):
+        import mcrops
+
+        h, w = shape[0:2]
+        roiPoly = np.reshape(np.array(roiPoly, np.int32), (-1, 1, 2))
+        roiPoly = mcrops.utils.trim_poly(roiPoly, (0, 0, w, h))
+
+        # Rotated image bounds, as in `mcrops.utils.rotate_image`
+        matrix = mcrops.utils.transform_matrix(rowsDirection)
+        corners = np.array([[0, 0, 1], [w, 0, 1], [w, h, 1], [0, h, 1]])
+        corners = np.int32(np.dot(matrix, corners.T)).T[:, 0:-1]
+        x, y, w, h = cv.boundingRect(corners.reshape(1, -1, 2))
+        matrix[0:2, -1] = [-x, -y]
+
+        roiPoly = cv.transform(roiPoly, matrix[0:2, :])
+        roiPoly = mcrops.utils.trim_poly(roiPoly, (0, 0, w, h))
+        if roiTrim:
+            # Cropping is a translation, folded into the rotation so the
+            # images are warped straight to their final size
+            x, y, boxW, boxH = cv.boundingRect(roiPoly)
+            w, h = min(boxW, w - x), min(boxH, h - y)
+            roiPoly -= [[x, y]]
+            matrix = np.dot(
+                mcrops.utils.transform_matrix(translate=(-x, -y)), matrix
+            )
+
+        self.matrix: np.ndarray = matrix
+        self.size: Tuple[int, int] = (w, h)
+        self.roiPoly: np.ndarray = roiPoly
+        self.transform: np.ndarray = np.linalg.inv(matrix)
+
+    @property
+    def roiMask(self) -> np.ndarray:
+        import mcrops
+        return mcrops.utils.poly_mask(self.roiPoly, self.size[::-1])
+
+    def warp(
+        self,
+        image: np.ndarray,
+        isMask: bool = False,
+        roiMask: np.ndarray = None
+    ) -> np.ndarray:
+        """Normalize an image of the field, setting the pixels outside of
+        the region of interest to 0."""
+        interp = cv.INTER_NEAREST if isMask else cv.INTER_LINEAR
+        with tracing.span('warp', 'normalization', isMask=isMask):
+            image = cv.warpAffine(
+                image,
+                self.matrix[0:2, :],
+                self.size,
+                flags=interp,
+                borderMode=cv.BORDER_CONSTANT,
+                borderValue=0
+            )
+            if roiMask is None:
+                roiMask = self.roiMask
+            return cv.bitwise_and(image, image, mask=roiMask)
+
+    def warpAll(
+        self,
+        images: Sequence[Tuple[np.ndarray, bool]],
+        roiMask: np.ndarray = None
+    ) -> List[np.ndarray]:
+        """Normalize several (image, isMask) pairs, each in its own thread.
+        OpenCV releases the GIL while warping."""
+        if roiMask is None:
+            roiMask = self.roiMask
+        with ThreadPoolExecutor(max(1, len(images))) as executor:
+            futures = [
+                executor.submit(self.warp, image, isMask, roiMask)
+                for image, isMask in images
+            ]
+            return [future.result() for future in futures]
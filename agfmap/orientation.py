@@ -0,0 +1,187 @@
+import math
+from typing import Optional, Tuple
+
+import cv2 as cv
+import numpy as np
+
+from mask import BAND_HEIGHT, Mask
+
+# Fewest pixels between two crop rows on the overview of the vegetation mask
+# the ROI is detected on, which is dilated by two row periods
+ROWS_MIN_PIXELS = 6
+
+# Resolution, in pixels per meter, and number of angles from 0 to pi the rows
+# direction is scored at, as in `mcrops.rows.detect_direction`
+DIRECTION_RESOLUTION = 10
+DIRECTION_STEPS = 360
+# Angles skipped by the first, coarse, search of the rows direction
+DIRECTION_STRIDE = 3
+# Ratio by which the best coarse score must beat those of the angles away from
+# it for the coarse search to be trusted, all the angles are scored otherwise
+DIRECTION_MARGIN = 1.25
+
+
+def _level(factor: float) -> int:
+    if factor < 2:
+        return 0
+    return int(math.log2(factor))
+
+
+def overviewLevel(resolution: float, rowsSeparation: float) -> int:
+    """Largest power of two reduction of a mask of `resolution` pixels per
+    meter keeping crop rows `ROWS_MIN_PIXELS` apart, which the ROI is
+    detected on."""
+    return _level(rowsSeparation * resolution / ROWS_MIN_PIXELS)
+
+
+def directionLevel(resolution: float, rowsSeparation: float) -> int:
+    """Level of the overview the rows direction is detected on, which also
+    keeps twice the resolution the direction is scored at."""
+    return min(
+        overviewLevel(resolution, rowsSeparation),
+        _level(resolution / (2 * DIRECTION_RESOLUTION))
+    )
+
+
+def detectRoi(
+    overview: np.ndarray,
+    level: int,
+    rowsSeparation: float,
+    resolution: float
+) -> Optional[np.ndarray]:
+    """`mcrops.veget.detect_roi` run on an overview of a vegetation mask,
+    given in the pixels of the mask, or ``None`` if no ROI is found."""
+    import mcrops
+
+    factor = 2 ** level
+    roiPoly = mcrops.veget.detect_roi(
+        overview,
+        row_sep=rowsSeparation,
+        resolution=resolution / factor
+    ).reshape((-1, 2))
+
+    oh, ow = overview.shape[0:2]
+    if np.array_equal(roiPoly, [[0, 0], [ow, 0], [ow, oh], [0, oh]]):
+        # No ROI found, it is the whole image
+        return None
+    # Overview pixels stand for the center of the pixels they cover
+    return np.int32(roiPoly * factor + factor // 2)
+
+
+def refineRoi(
+    mask: Mask,
+    roiPoly: np.ndarray,
+    level: int,
+    rowsSeparation: float,
+    resolution: float
+) -> np.ndarray:
+    """Recompute at full resolution a ROI found on an overview of `mask`.
+
+    The ROI is the convex hull of the vegetation dilated by a square, which
+    is the hull of the vegetation pixels grown by that square. Only the
+    pixels of a band along the coarse outline may be vertices of that hull,
+    so only that band of the mask is read.
+    """
+    h = mask.shape[0]
+    factor = 2 ** level
+    dilation = int(2 * rowsSeparation * resolution)
+    # Hull vertices are up to half the diagonal of the dilation square away
+    # from the outline, which is itself a few overview pixels off
+    thickness = 2 * (dilation + 2 * factor) + 1
+    points = []
+    for y in range(0, h, BAND_HEIGHT):
+        rows = mask[y:y + BAND_HEIGHT] > 0
+        band = np.zeros(rows.shape, np.uint8)
+        cv.polylines(
+            band, [np.int32(roiPoly - [0, y]).reshape((-1, 1, 2))],
+            True, 255, thickness
+        )
+        ys, xs = np.nonzero(rows & (band > 0))
+        if xs.size > 0:
+            bandPoints = np.int32(np.stack((xs, ys + y), 1))
+            points.append(cv.convexHull(bandPoints))
+    if not points:
+        return roiPoly
+
+    hull = cv.convexHull(np.concatenate(points)).reshape((-1, 2))
+    if dilation > 0:
+        # Pixels covered by a dilation with the anchor at the kernel center
+        low, high = dilation - 1 - dilation // 2, dilation // 2
+        corners = np.array([
+            [-low, -low], [high, -low], [high, high], [-low, high]
+        ])
+        hull = (hull[:, None, :] + corners[None, :, :]).reshape((-1, 2))
+        hull = cv.convexHull(np.int32(hull)).reshape((-1, 2))
+    return np.int32(hull)
+
+
+def directionScores(
+    mask: np.ndarray,
+    resolution: float,
+    windowShape: Tuple[float, float],
+    angles: np.ndarray
+) -> np.ndarray:
+    """Peak to peak vegetation profile of a window of `windowShape` meters
+    at the center of `mask`, rotated by each of `angles`, scored as in
+    `mcrops.rows.detect_direction`."""
+    h, w = mask.shape[0:2]
+    wh = int(windowShape[0] * resolution)
+    ww = int(windowShape[1] * resolution)
+    ys, xs = np.mgrid[0:wh, 0:ww]
+    xs, ys = xs.ravel(), ys.ravel()
+    scores = np.zeros(len(angles))
+    for index, angle in enumerate(angles):
+        c, s = math.cos(angle), math.sin(angle)
+        # Rotated points are truncated before moving them to the center, as
+        # `mcrops` does, which truncates towards zero on both sides of it
+        tx = np.clip(np.int32(c * xs + s * ys) + int(w / 2), 0, w - 1)
+        ty = np.clip(np.int32(c * ys - s * xs) + int(h / 2), 0, h - 1)
+        profile = mask[ty, tx].reshape((wh, ww)).sum(axis=0, dtype=np.int64)
+        scores[index] = np.ptp(profile) if profile.size else 0
+    return scores
+
+
+def detectDirection(
+    overview: np.ndarray,
+    level: int,
+    resolution: float,
+    windowShape: Tuple[float, float],
+    refine: bool = False
+) -> float:
+    """Rows direction of an overview of a vegetation mask, like
+    `mcrops.rows.detect_direction` on the mask.
+
+    Angles are first scored every `DIRECTION_STRIDE` steps, and then one by
+    one around the best of them. A narrow peak may fall between the coarse
+    angles, so all of them are scored instead, as `mcrops` does, if `refine`
+    is set or if the best coarse angle is not clearly ahead of the others.
+    """
+    resolution /= 2 ** level
+    scale = DIRECTION_RESOLUTION / resolution
+    if scale < 1:
+        overview = cv.resize(
+            overview, (0, 0), fx=scale, fy=scale,
+            interpolation=cv.INTER_NEAREST
+        )
+        resolution = DIRECTION_RESOLUTION
+
+    angles = np.linspace(0, math.pi, DIRECTION_STEPS)
+    fine = np.arange(DIRECTION_STEPS)
+    if not refine:
+        coarse = fine[::DIRECTION_STRIDE]
+        scores = directionScores(
+            overview, resolution, windowShape, angles[coarse]
+        )
+        index = int(np.argmax(scores))
+        # Coarse steps from the best angle, directions wrapping around at pi
+        steps = np.abs(np.arange(coarse.size) - index)
+        steps = np.minimum(steps, coarse.size - steps)
+        others = scores[steps > 1]
+        if others.size == 0 or \
+                scores[index] >= DIRECTION_MARGIN * others.max():
+            best = coarse[index]
+            fine = fine[max(0, best - DIRECTION_STRIDE):
+                        best + DIRECTION_STRIDE + 1]
+    scores = directionScores(overview, resolution, windowShape, angles[fine])
+    best = fine[int(np.argmax(scores))]
+    return math.pi / 2 - angles[best]
@@ -0,0 +1,954 @@
+import math
+import os
+import threading
+from typing import Callable, Dict, List, Optional, Tuple
+
+import cv2 as cv
+import numpy as np
+
+# mcrops, which loads SciPy and scikit-learn, is imported by the stages using
+# it to keep it out of the application startup
+from applog import logger
+from layer import Layer, removeUnusedShapes
+from density import DensityMap, colormapColors
+from mask import (
+    Mask, PackedMask, SummedAreaTable, densityGrid, maskOverview
+)
+from normalization import Normalization
+from orientation import (
+    overviewLevel, directionLevel, detectRoi, refineRoi, detectDirection
+)
+from profiler import RunProfile, describe
+from settings import (
+    ProjectSettings, CACHE_DIR_NAME, MAX_RUN_PROFILES, PROFILES_DIR_NAME
+)
+import tiling
+import tracing
+import utils
+from shape import Shape, ShapeCollection
+from stagecache import StageCache, hashArray, hashValues
+
+IMAGE_CROP_FIELD = 'Crop Field'
+IMAGE_NORM_FIELD = 'Norm Field'
+IMAGE_VEG_MASK = 'Vegetation Mask'
+IMAGE_WEED_MASK = 'Weed Mask'
+IMAGE_VEG_DENSITY = 'Vegetation Density'
+IMAGE_WEED_DENSITY = 'Weed Density'
+IMAGE_ROI_MASK = 'Roi Mask'
+
+IMAGES = (
+    IMAGE_CROP_FIELD,
+    IMAGE_NORM_FIELD,
+    IMAGE_VEG_MASK,
+    IMAGE_WEED_MASK,
+    IMAGE_VEG_DENSITY,
+    IMAGE_WEED_DENSITY,
+    IMAGE_ROI_MASK,
+)
+
+# Binary images, stored bit-packed
+MASKS = (
+    IMAGE_VEG_MASK,
+    IMAGE_WEED_MASK,
+    IMAGE_ROI_MASK,
+)
+
+# Images stored as a grid of density values, colored when displayed
+DENSITY_MAPS = (
+    IMAGE_VEG_DENSITY,
+    IMAGE_WEED_DENSITY,
+)
+
+SHAPE_ROWS_RIDGES = 'Row Ridges'
+SHAPE_ROWS_FURROWS = 'Row Furrows'
+SHAPE_ROWS_DIR = 'Rows Direction'
+SHAPE_ROI_POLY = 'Roi Poly'
+
+SHAPES = (
+    SHAPE_ROWS_RIDGES,
+    SHAPE_ROWS_FURROWS,
+    SHAPE_ROWS_DIR,
+    SHAPE_ROI_POLY,
+)
+
+
+def buildLayers(settings: ProjectSettings) -> Dict[str, Layer]:
+    """Create the layers of a project, importing the crop field image
+    the first time."""
+    layers = {}
+    readInfo = [
+        (IMAGE_CROP_FIELD, cv.IMREAD_COLOR),
+        (IMAGE_NORM_FIELD, cv.IMREAD_COLOR),
+        (IMAGE_VEG_DENSITY, cv.IMREAD_COLOR),
+        (IMAGE_VEG_MASK, cv.IMREAD_GRAYSCALE),
+        (IMAGE_WEED_DENSITY, cv.IMREAD_COLOR),
+        (IMAGE_WEED_MASK, cv.IMREAD_GRAYSCALE),
+        (IMAGE_ROI_MASK, cv.IMREAD_GRAYSCALE),
+    ]
+    for name, flags in readInfo:
+        storage, ext = None, '.png'
+        if name in MASKS:
+            storage, ext = PackedMask, '.npy'
+        elif name in DENSITY_MAPS:
+            storage, ext = DensityMap, '.npz'
+        fileName = '_'.join(name.lower().split()) + ext
+        filePath = os.path.join(settings.projectPath, fileName)
+        pngPath = utils.swapExt(filePath, '.png')
+        if storage is PackedMask and not utils.fileExists(filePath) and \
+                utils.fileExists(pngPath):
+            # Masks of older projects are PNG images
+            layer = Layer(name=name, filePath=pngPath, flags=flags)
+            image = layer.image
+            layer.filePath, layer.storage = filePath, storage
+            layer.image = image
+            layer.save()
+            os.remove(pngPath)
+        layers[name] = Layer(
+            name=name, filePath=filePath, flags=flags, storage=storage
+        )
+
+    if not utils.fileExists(layers[IMAGE_CROP_FIELD].filePath):
+        image = cv.imread(settings.cropFieldImagePath, cv.IMREAD_UNCHANGED)
+        if image is None:
+            raise OSError(f'Cannot read image {settings.cropFieldImagePath}')
+        if image.ndim == 3 and image.shape[2] == 4:
+            alpha = image[:, :, 3]
+            image = image[:, :, 0:3]
+            image[alpha < 200] = 0
+        layers[IMAGE_CROP_FIELD].image = image
+        layers[IMAGE_CROP_FIELD].save()
+    return layers
+
+
+def restyleLayers(
+    settings: ProjectSettings,
+    layers: Dict[str, Layer]
+) -> List[Layer]:
+    """Apply the display settings of a project, the colormap of the density
+    maps and the style of the shapes found by the pipeline, to its layers.
+    They take part in no stage key, so cached stages do not apply them.
+    Return the layers that changed."""
+    styles = {
+        SHAPE_ROI_POLY: settings.roiColor,
+        SHAPE_ROWS_DIR: settings.rowsDirColor,
+        SHAPE_ROWS_RIDGES: settings.rowsRidgesColor,
+        SHAPE_ROWS_FURROWS: settings.rowsFurrowsColor,
+    }
+    colormap = colormapColors(settings.mapsColormap)
+    changed = []
+    for name, layer in layers.items():
+        if name in DENSITY_MAPS and not layer.isEmpty and \
+                layer.colormap != colormap:
+            layer.setColormap(colormap)
+            changed.append(layer)
+
+    # Layers may share their shapes, all of them are saved when they change
+    restyled = set()
+    for layer in layers.values():
+        for name, shapeSet in layer.shapes.items():
+            if name not in styles:
+                continue
+            shapes = [shapeSet] if isinstance(shapeSet, ShapeCollection) \
+                else shapeSet
+            for shape in shapes:
+                if shape.setStyle(
+                    styles[name],
+                    settings.drawLineWidth,
+                    settings.shapesVisible.get(name, True)
+                ):
+                    restyled.add(id(shapeSet))
+    for layer in layers.values():
+        if layer not in changed and any(
+            id(shapeSet) in restyled for shapeSet in layer.shapes.values()
+        ):
+            changed.append(layer)
+    return changed
+
+
+class PipelineCancelled(Exception):
+    pass
+
+
+class Stage:
+
+    def __init__(
+        self,
+        name: str,
+        title: str,
+        method: Callable[[], None],
+        inputs: Tuple[str, ...] = (),
+        params: Tuple[str, ...] = (),
+        outputs: Tuple[str, ...] = (),
+        layers: Dict[str, str] = None,
+        publishes: Tuple[str, ...] = ()
+    ):
+        self.name: str = name
+        self.title: str = title
+        self.method: Callable[[], None] = method
+        # Names of the pipeline values read by the stage
+        self.inputs: Tuple[str, ...] = inputs
+        # Names of the project settings read by the stage
+        self.params: Tuple[str, ...] = params
+        # Names of the pipeline values written to the stage cache
+        self.outputs: Tuple[str, ...] = outputs
+        # Pipeline values that are also layer images, by layer name
+        self.layers: Dict[str, str] = {} if layers is None else layers
+        # Layers whose shapes or metadata are modified by the stage
+        self.publishes: Tuple[str, ...] = publishes
+        self.key: str = ''
+
+
+class Pipeline:
+    """Crop analysis pipeline.
+
+    The pipeline works on detached copies of the project layers, so it can run
+    outside the GUI thread. Every layer modified by a stage is saved and then
+    handed to `onLayerUpdated`, which is the only way results leave the
+    pipeline. Cancellation is cooperative and takes effect between stages.
+
+    Stages exchange data through named values. The key of a stage is a hash of
+    the project settings it reads and the keys of its input values, so a stage
+    is re-run only when something upstream of it has changed. Otherwise its
+    outputs are taken, on demand, from the stage cache or from the layers it
+    wrote in a previous run.
+    """
+
+    # Layers holding the pipeline values not produced by any enabled stage
+    SOURCES = {
+        'cropField': IMAGE_CROP_FIELD,
+        'vegMask': IMAGE_VEG_MASK,
+        'normVegMask': IMAGE_VEG_MASK,
+        'normField': IMAGE_NORM_FIELD,
+        'roiMask': IMAGE_ROI_MASK,
+        'weedMask': IMAGE_WEED_MASK,
+    }
+
+    # Cached values read in place rather than loaded whole, summed area
+    # tables being only read around the edges of the grid cells
+    MAPPED_VALUES = ('roiCoverage', 'vegCoverage', 'weedCoverage')
+
+    # noinspection PyTypeChecker
+    def __init__(self, settings: ProjectSettings, layers: Dict[str, Layer]):
+
+        self.settings: ProjectSettings = settings
+        self.layers: Dict[str, Layer] = {
+            name: layer.copy() for name, layer in layers.items()
+        }
+        self.cache: StageCache = StageCache(
+            os.path.join(settings.projectPath, CACHE_DIR_NAME)
+        )
+        self.onStageStarted: Callable[[int, int, str], None] = None
+        self.onLayerUpdated: Callable[[Layer], None] = None
+        self.values: dict = {}
+        self._loaders: Dict[str, Callable] = {}
+        self._writers: Dict[str, str] = {}
+        self._cancelEvent = threading.Event()
+        # Timings of the last run
+        self.profile: RunProfile = None
+
+    @property
+    def stages(self) -> List[Stage]:
+        se = self.settings
+        vegMask = 'normVegMask' if se.runDetectRows else 'vegMask'
+        stages = []
+        if se.runSegmentVeg or se.runDetectRows:
+            stages.append(Stage(
+                name='extent',
+                title='Finding the valid image data',
+                method=self.findExtent,
+                inputs=('cropField',),
+                outputs=('dataBox',)
+            ))
+        if se.runSegmentVeg:
+            stages.append(Stage(
+                name='segmentation',
+                title='Segmenting vegetation',
+                method=self.segmentVegetation,
+                inputs=('cropField', 'dataBox'),
+                params=('segmentVegThr',),
+                layers={'vegMask': IMAGE_VEG_MASK}
+            ))
+        if se.runDetectRows:
+            # Only the settings actually used to find the ROI and the rows
+            # direction take part in the stage key
+            if se.roiPolygon is not None:
+                params = ('roiPolygon',)
+            elif se.roiAutoDetect:
+                params = (
+                    'roiAutoDetect', 'roiRefine', 'rowsSeparation',
+                    'resolution'
+                )
+            else:
+                params = ('roiAutoDetect',)
+            if se.dirAutoDetect:
+                params += (
+                    'dirAutoDetect', 'dirRefine', 'resolution',
+                    'rowsSeparation', 'rowsDirWindowWidth',
+                    'rowsDirWindowHeight'
+                )
+            else:
+                params += ('dirAutoDetect', 'rowsDirection')
+            stages.append(Stage(
+                name='orientation',
+                title='Detecting ROI and rows direction',
+                method=self.detectOrientation,
+                inputs=('vegMask', 'dataBox'),
+                params=params,
+                outputs=('roiPoly', 'rowsDir'),
+                publishes=(IMAGE_CROP_FIELD,)
+            ))
+            stages.append(Stage(
+                name='normalization',
+                title='Normalizing images',
+                method=self.normalize,
+                inputs=('cropField', 'vegMask', 'roiPoly', 'rowsDir'),
+                params=('roiTrim',),
+                outputs=('transform',),
+                layers={
+                    'normField': IMAGE_NORM_FIELD,
+                    'normVegMask': IMAGE_VEG_MASK,
+                    'roiMask': IMAGE_ROI_MASK,
+                }
+            ))
+            stages.append(Stage(
+                name='rows',
+                title='Detecting crop rows',
+                method=self.detectRows,
+                inputs=('normVegMask', 'roiMask'),
+                params=(
+                    'rowsSeparation', 'rowsDetectMaxExtent',
+                    'rowsDetectExtentThr', 'rowsDetectFusionThr',
+                    'rowsDetectLinkThr', 'resolution'
+                ),
+                outputs=('rowsRidges', 'rowsFurrows'),
+                publishes=(IMAGE_NORM_FIELD, IMAGE_VEG_MASK)
+            ))
+        if se.runMapVeg or se.runMapWeeds:
+            stages.append(Stage(
+                name='roiCoverage',
+                title='Indexing the region of interest',
+                method=self.computeRoiCoverage,
+                inputs=('roiMask',),
+                outputs=('roiCoverage',)
+            ))
+        if se.runMapVeg:
+            stages.append(Stage(
+                name='vegCoverage',
+                title='Indexing vegetation',
+                method=self.computeVegCoverage,
+                inputs=(vegMask,),
+                outputs=('vegCoverage',)
+            ))
+            stages.append(Stage(
+                name='vegDensity',
+                title='Computing vegetation density',
+                method=self.computeVegDensity,
+                inputs=('vegCoverage', 'roiCoverage'),
+                params=('mapsCellWidth', 'mapsCellHeight', 'resolution'),
+                outputs=('vegDensity', 'vegDensityShape')
+            ))
+            stages.append(Stage(
+                name='vegMap',
+                title='Mapping vegetation density',
+                method=self.mapVegDensity,
+                inputs=('vegDensity', 'vegDensityShape'),
+                params=('mapsCellWidth', 'mapsCellHeight', 'resolution'),
+                layers={'vegMap': IMAGE_VEG_DENSITY}
+            ))
+        if se.runMapWeeds:
+            stages.append(Stage(
+                name='weeds',
+                title='Segmenting weeds',
+                method=self.segmentWeeds,
+                inputs=('normField', vegMask, 'rowsRidges'),
+                layers={'weedMask': IMAGE_WEED_MASK}
+            ))
+            stages.append(Stage(
+                name='weedCoverage',
+                title='Indexing weeds',
+                method=self.computeWeedCoverage,
+                inputs=('weedMask',),
+                outputs=('weedCoverage',)
+            ))
+            stages.append(Stage(
+                name='weedDensity',
+                title='Computing weed density',
+                method=self.computeWeedDensity,
+                inputs=('weedCoverage', 'roiCoverage'),
+                params=('mapsCellWidth', 'mapsCellHeight', 'resolution'),
+                outputs=('weedDensity', 'weedDensityShape')
+            ))
+            stages.append(Stage(
+                name='weedMap',
+                title='Mapping weed density',
+                method=self.mapWeedDensity,
+                inputs=('weedDensity', 'weedDensityShape'),
+                params=('mapsCellWidth', 'mapsCellHeight', 'resolution'),
+                layers={'weedMap': IMAGE_WEED_DENSITY}
+            ))
+        return stages
+
+    @property
+    def isCancelled(self) -> bool:
+        return self._cancelEvent.is_set()
+
+    def cancel(self):
+        self._cancelEvent.set()
+
+    def plan(self, stages: List[Stage] = None) -> List[Stage]:
+        """Return the stages that must run, as far as it is known before
+        running any of them.
+
+        A stage downstream of a pending one may still turn out to be cached,
+        when the re-computed values are identical to the previous ones.
+        """
+        if stages is None:
+            stages = self.stages
+        self._prepare(stages)
+        keys: Dict[str, str] = {}
+        return [stage for stage in stages if not self._resolve(stage, keys)]
+
+    def run(self):
+        """Run the stages that are not cached, recording their timings in
+        `profile`, which is saved in the project even if the run fails."""
+        self.profile = RunProfile()
+        try:
+            with self.profile.activate():
+                self._run()
+        except PipelineCancelled:
+            self.profile.status = 'cancelled'
+            raise
+        except Exception:
+            self.profile.status = 'failed'
+            raise
+        else:
+            self.profile.status = 'finished'
+            removeUnusedShapes(
+                self.settings.projectPath, self.layers.values()
+            )
+        finally:
+            self._saveProfile()
+
+    def _run(self):
+        stages = self.stages
+        count = len(self.plan(stages))
+        logger.info(f'Pipeline: {count} of {len(stages)} stages to run')
+
+        keys: Dict[str, str] = {}
+        self._loaders = {}
+        index = 0
+        for stage in stages:
+            if self._resolve(stage, keys):
+                self.profile.record(
+                    'stage', stage.name, title=stage.title, cached=True
+                )
+                continue
+            if self.isCancelled:
+                raise PipelineCancelled()
+            count = max(count, index + 1)
+            logger.info(f'Pipeline stage {index + 1}/{count}: {stage.title}')
+            if self.onStageStarted is not None:
+                self.onStageStarted(index, count, stage.title)
+            with tracing.span(stage.name, 'pipeline'), self.profile.measure(
+                'stage', stage.name, title=stage.title, cached=False
+            ) as entry:
+                stage.method()
+                self._commit(stage, keys)
+            stored, backed = self._split(stage)
+            entry['inputs'] = self._describe(stage.inputs)
+            entry['outputs'] = self._describe(stored + list(backed))
+            index += 1
+
+        # Shapes and maps of cached stages keep the style of their last run
+        self.publish(*restyleLayers(self.settings, self.layers))
+
+    def get(self, name: str):
+        if name not in self.values:
+            if name in self._loaders:
+                value = self._loaders[name]()
+                if isinstance(value, PackedMask):
+                    value = value.unpack()
+                self.values[name] = value
+            elif name in self.SOURCES:
+                self.values[name] = self.layers[self.SOURCES[name]].image
+            elif name == 'rowsRidges':
+                shapes = self.layers[IMAGE_VEG_MASK].shapes.get(
+                    SHAPE_ROWS_RIDGES, []
+                )
+                if isinstance(shapes, ShapeCollection):
+                    self.values[name] = shapes.toArray()
+                else:
+                    self.values[name] = np.array([
+                        shape.points for shape in shapes
+                    ])
+            else:
+                raise KeyError(name)
+        return self.values[name]
+
+    def getMask(self, name: str) -> Mask:
+        """Like `get`, but masks read from layers or from the stage cache
+        are not unpacked."""
+        if name not in self.values:
+            if name in self._loaders:
+                mask = self._loaders[name]()
+                if isinstance(mask, PackedMask):
+                    return mask
+                self.values[name] = mask
+            else:
+                layer = self.layers[self.SOURCES[name]]
+                if layer.storage is PackedMask:
+                    return layer.pixels
+        return self.get(name)
+
+    def getCoverage(self, name: str) -> Optional[SummedAreaTable]:
+        """Summed area table of a mask, kept in the value `name`, or
+        ``None`` when the mask does not exist."""
+        sums = self.get(name)
+        return None if sums is None else SummedAreaTable(sums)
+
+    def previewDensity(self, name: str) -> Optional[np.ndarray]:
+        """Grid of the density value `name` for the current map settings,
+        without running the pipeline.
+
+        Coverage tables are loaded from the stage cache when they are up to
+        date, or else computed from the masks, and kept for the next calls,
+        so changing the size of the cells only takes a few milliseconds.
+        """
+        coverage = {
+            'vegDensity': 'vegCoverage',
+            'weedDensity': 'weedCoverage',
+        }[name]
+        compute = {
+            'roiCoverage': self.computeRoiCoverage,
+            'vegCoverage': self.computeVegCoverage,
+            'weedCoverage': self.computeWeedCoverage,
+        }
+        names = (coverage, 'roiCoverage')
+        if any(valueName not in self.values for valueName in names):
+            self.plan()
+            for valueName in names:
+                if valueName not in self.values and \
+                        valueName not in self._loaders:
+                    compute[valueName]()
+        table = self.getCoverage(coverage)
+        if table is None:
+            return None
+        return self._densityGrid(table)
+
+    def publish(self, *layers: Layer):
+        for layer in layers:
+            layer.save()
+            if self.onLayerUpdated is not None:
+                self.onLayerUpdated(layer)
+
+    def _prepare(self, stages: List[Stage]):
+        # Only the last stage writing a layer saves it
+        self._writers = {}
+        for stage in stages:
+            for layerName in stage.layers.values():
+                self._writers[layerName] = stage.name
+
+    def _split(self, stage: Stage) -> Tuple[List[str], Dict[str, str]]:
+        """Split the stage outputs into the values kept in the stage cache
+        and the ones kept in layers."""
+        stored = list(stage.outputs)
+        backed = {}
+        for name, layerName in stage.layers.items():
+            if self._writers[layerName] == stage.name:
+                backed[name] = layerName
+            else:
+                stored.append(name)
+        return stored, backed
+
+    def _resolve(self, stage: Stage, keys: Dict[str, str]) -> bool:
+        """Compute the stage key and check whether its outputs are cached.
+
+        Keys of the stage outputs are added to `keys`. Cached outputs are
+        registered to be loaded on first use.
+        """
+        inputKeys = [
+            keys[name] if name in keys else self._sourceKey(name)
+            for name in stage.inputs
+        ]
+        params = [getattr(self.settings, name) for name in stage.params]
+        stage.key = hashValues(stage.name, params, inputKeys)
+
+        stored, backed = self._split(stage)
+        cached = self.cache.isValid(stage.name, stage.key, stored) and all(
+            self.layers[layerName].stageKey == stage.key and
+            not self.layers[layerName].isEmpty
+            for layerName in backed.values()
+        )
+
+        for name in backed:
+            keys[name] = stage.key
+        if cached:
+            hashes = self.cache.hashes(stage.name)
+            for name in stored:
+                keys[name] = hashes[name]
+                self._loaders[name] = self._cacheLoader(stage, name)
+            for name, layerName in backed.items():
+                self._loaders[name] = self._layerLoader(layerName)
+        else:
+            for name in stored:
+                keys[name] = stage.key
+        return cached
+
+    def _commit(self, stage: Stage, keys: Dict[str, str]):
+        stored, backed = self._split(stage)
+
+        published = []
+        for layerName in backed.values():
+            layer = self.layers[layerName]
+            layer.stageKey = stage.key
+            published.append(layer)
+        for layerName in stage.publishes:
+            layer = self.layers[layerName]
+            if layer not in published:
+                published.append(layer)
+        self.publish(*published)
+
+        # Downstream stages are keyed by the content of the cached values, so
+        # they are not invalidated when a re-run gives the same result
+        outputs = {}
+        hashes = {}
+        for name in stored:
+            value = self.values[name]
+            if isinstance(value, np.ndarray):
+                hashes[name] = hashArray(value)
+                layerName = stage.layers.get(name)
+                if layerName is not None and \
+                        self.layers[layerName].storage is PackedMask:
+                    # Masks are cached packed, as their layers are saved
+                    value = PackedMask.fromArray(value)
+            else:
+                hashes[name] = hashValues(value)
+            keys[name] = hashes[name]
+            outputs[name] = value
+        self.cache.store(stage.name, stage.key, outputs, hashes)
+
+    def _sourceKey(self, name: str) -> str:
+        if name == 'cropField':
+            layer = self.layers[IMAGE_CROP_FIELD]
+            if layer.isEmpty:
+                return ''
+            return self.cache.sourceHash(
+                layer.filePath, lambda: hashArray(layer.image)
+            )
+        if name in self.SOURCES:
+            layer = self.layers[self.SOURCES[name]]
+            if layer.stageKey:
+                return layer.stageKey
+            if layer.image is not None:
+                return hashArray(layer.image)
+            return ''
+        return hashValues(self.get(name).tolist())
+
+    def _describe(self, names) -> Dict[str, dict]:
+        # Inputs taken from the cache or from layers are only known once the
+        # stage has loaded them
+        return {
+            name: describe(self.values[name])
+            for name in names if name in self.values
+        }
+
+    def _saveProfile(self):
+        profile = self.profile
+        for line in profile.summary():
+            logger.info(f'Pipeline profile: {line}')
+        try:
+            profile.save(
+                os.path.join(self.settings.projectPath, PROFILES_DIR_NAME),
+                MAX_RUN_PROFILES
+            )
+        except Exception as err:
+            logger.error(err)
+
+    def _cacheLoader(self, stage: Stage, name: str) -> Callable:
+        mapped = name in self.MAPPED_VALUES
+        return lambda: self.cache.load(stage.name, name, mapped)
+
+    def _layerLoader(self, layerName: str) -> Callable:
+        layer = self.layers[layerName]
+        if layer.storage is PackedMask:
+            # Unpacked by `get`, and kept packed by `getMask`
+            return lambda: layer.pixels
+        return lambda: layer.image
+
+    ######################################################################
+    #  Stages
+    ######################################################################
+
+    def findExtent(self):
+        # Transparent borders of orthomosaics are zeroed when imported, the
+        # next stages only look inside the box of the remaining pixels
+        self.values['dataBox'] = list(tiling.dataBox(self.get('cropField')))
+
+    def segmentVegetation(self):
+        se = self.settings
+        cropField = self.layers[IMAGE_CROP_FIELD]
+        vegMask = self.layers[IMAGE_VEG_MASK]
+
+        vegMask.image = self.values['vegMask'] = tiling.segmentVegetation(
+            self.get('cropField'),
+            threshold=se.segmentVegThr,
+            tileSize=se.segmentTileSize,
+            workers=se.segmentWorkers,
+            box=self.get('dataBox')
+        )
+        vegMask.transform = cropField.transform
+
+    def detectOrientation(self):
+        import mcrops
+
+        se = self.settings
+        cropField = self.layers[IMAGE_CROP_FIELD]
+        vegMask = self.getMask('vegMask')
+
+        (h, w) = vegMask.shape[0:2]
+        box = self.get('dataBox')
+        y1, y2, x1, x2 = box
+        roiPoly = np.int32([[x1, y1], [x2, y1], [x2, y2], [x1, y2]])
+
+        # Both the field outline and the rows direction are coarse features,
+        # detected on overviews of the mask where rows are still apart. The
+        # direction needs a finer one, the other one is reduced from it
+        level = overviewLevel(se.resolution, se.rowsSeparation)
+        dirLevel = directionLevel(se.resolution, se.rowsSeparation)
+        overview = dirOverview = None
+        if se.dirAutoDetect:
+            dirOverview = maskOverview(vegMask, dirLevel, box)
+        if se.roiPolygon is None and se.roiAutoDetect:
+            if dirOverview is None:
+                overview = maskOverview(vegMask, level, box)
+            elif level > dirLevel:
+                overview = maskOverview(dirOverview, level - dirLevel)
+            else:
+                overview = dirOverview
+
+        try:
+            if se.roiPolygon is not None:
+                roiPoly = np.array(se.roiPolygon, np.int32)
+            elif se.roiAutoDetect:
+                detected = detectRoi(
+                    overview,
+                    level,
+                    rowsSeparation=se.rowsSeparation,
+                    resolution=se.resolution
+                )
+                if detected is not None:
+                    roiPoly = detected + [x1, y1]
+                    if se.roiRefine and level > 0:
+                        roiPoly = refineRoi(
+                            vegMask,
+                            roiPoly,
+                            level,
+                            rowsSeparation=se.rowsSeparation,
+                            resolution=se.resolution
+                        )
+            roiPoly = roiPoly.reshape((-1, 1, 2))
+            roiPoly = mcrops.utils.trim_poly(roiPoly, (0, 0, w, h))
+            cropField.shapes[SHAPE_ROI_POLY] = [Shape(
+                name=SHAPE_ROI_POLY,
+                points=roiPoly.reshape((-1, 2)).tolist(),
+                form=Shape.POLYGON,
+                lineColor=se.roiColor,
+                lineWidth=se.drawLineWidth,
+                visible=se.shapesVisible.get(SHAPE_ROI_POLY, True)
+            )]
+        except Exception as err:
+            logger.error(err)
+
+        rowsDir = se.rowsDirection
+        if se.dirAutoDetect:
+            rowsDir = detectDirection(
+                dirOverview,
+                dirLevel,
+                resolution=se.resolution,
+                windowShape=(se.rowsDirWindowHeight, se.rowsDirWindowWidth),
+                refine=se.dirRefine
+            )
+
+            # Draw an arrow indicating the direction of the crop rows
+            pt1 = (int(w / 2), int(h / 2))
+            length = min(w / 2, h / 2)
+            dx = int(math.cos(rowsDir) * length)
+            dy = int(math.sin(rowsDir) * length)
+            pt2 = (
+                pt1[0] + min(max(0, dx), w - 1),
+                pt1[1] + min(max(0, dy), h - 1)
+            )
+            cropField.shapes[SHAPE_ROWS_DIR] = [Shape(
+                name=SHAPE_ROWS_DIR,
+                points=[pt1, pt2],
+                form=Shape.LINE,
+                lineColor=se.rowsDirColor,
+                lineWidth=se.drawLineWidth,
+                visible=se.shapesVisible.get(SHAPE_ROWS_DIR, True)
+            )]
+
+        self.values['roiPoly'] = np.int32(roiPoly)
+        self.values['rowsDir'] = float(rowsDir)
+
+    def normalize(self):
+        se = self.settings
+        cropField = self.layers[IMAGE_CROP_FIELD]
+        normField = self.layers[IMAGE_NORM_FIELD]
+        vegMask = self.layers[IMAGE_VEG_MASK]
+        roiMask = self.layers[IMAGE_ROI_MASK]
+
+        # The transform is computed once, then each image is warped
+        # straight to the normalized size in its own thread
+        image = self.get('cropField')
+        norm = Normalization(
+            image.shape,
+            roiPoly=self.get('roiPoly'),
+            rowsDirection=self.get('rowsDir'),
+            roiTrim=se.roiTrim
+        )
+        roiMask.image = mask = norm.roiMask
+        normField.image, vegMask.image = norm.warpAll(
+            [(image, False), (self.get('vegMask'), True)],
+            roiMask=mask
+        )
+        transform = norm.transform.tolist()
+
+        if cropField.transform is not None:
+            # noinspection PyTypeChecker
+            transform = np.dot(cropField.transform, transform).tolist()
+
+        normField.transform = transform
+        vegMask.transform = transform
+        roiMask.transform = transform
+
+        self.values['normField'] = normField.image
+        # Masks are stored binary, use them as stored so that the next
+        # stages get the same input whether these outputs are cached or not
+        self.values['normVegMask'] = vegMask.image
+        self.values['roiMask'] = roiMask.image
+        self.values['transform'] = transform
+
+    def detectRows(self):
+        import mcrops
+
+        se = self.settings
+        normField = self.layers[IMAGE_NORM_FIELD]
+        vegMask = self.layers[IMAGE_VEG_MASK]
+
+        rowsRidges, rowsFurrows = mcrops.rows.detect_rows(
+            veg_mask=self.get('normVegMask'),
+            roi_mask=self.get('roiMask'),
+            row_sep=se.rowsSeparation,
+            extent_max=se.rowsDetectMaxExtent,
+            extent_thr=se.rowsDetectExtentThr,
+            fusion_thr=se.rowsDetectFusionThr,
+            link_thr=se.rowsDetectLinkThr,
+            resolution=se.resolution
+        )
+
+        rowsRidges[:, :, [1, 0]] = rowsRidges[:, :, [0, 1]]
+        rowsFurrows[:, :, [1, 0]] = rowsFurrows[:, :, [0, 1]]
+
+        for name, rows, color in (
+            (SHAPE_ROWS_RIDGES, rowsRidges, se.rowsRidgesColor),
+            (SHAPE_ROWS_FURROWS, rowsFurrows, se.rowsFurrowsColor),
+        ):
+            # Both layers share the vertices, saved once in the project
+            shapes = ShapeCollection.fromArray(
+                rows,
+                name=name,
+                form=Shape.POLYLINE,
+                lineColor=color,
+                lineWidth=se.drawLineWidth,
+                visible=se.shapesVisible.get(name, True)
+            )
+            normField.shapes[name] = shapes
+            vegMask.shapes[name] = shapes
+
+        self.values['rowsRidges'] = rowsRidges
+        self.values['rowsFurrows'] = rowsFurrows
+
+    def computeRoiCoverage(self):
+        self.values['roiCoverage'] = self._coverageSums('roiMask')
+
+    def computeVegCoverage(self):
+        vegMask = 'normVegMask' if self.settings.runDetectRows else 'vegMask'
+        self.values['vegCoverage'] = self._coverageSums(vegMask)
+
+    def computeVegDensity(self):
+        table = self.getCoverage('vegCoverage')
+        self.values['vegDensity'] = self._densityGrid(table)
+        self.values['vegDensityShape'] = list(table.shape)
+
+    def mapVegDensity(self):
+        self.values['vegMap'] = self._mapDensity(
+            self.get('vegDensity'),
+            self.get('vegDensityShape'),
+            self.layers[IMAGE_VEG_DENSITY]
+        )
+
+    def segmentWeeds(self):
+        import mcrops
+
+        vegMask = 'normVegMask' if self.settings.runDetectRows else 'vegMask'
+        weedMask = self.layers[IMAGE_WEED_MASK]
+
+        weedMask.image = self.values['weedMask'] = \
+            mcrops.weeds.segment_weeds(
+                image=self.get('normField'),
+                veg_mask=self.get(vegMask),
+                crop_rows=self.get('rowsRidges')
+            )
+        weedMask.transform = self.layers[IMAGE_VEG_MASK].transform
+
+    def computeWeedCoverage(self):
+        self.values['weedCoverage'] = self._coverageSums('weedMask')
+
+    def computeWeedDensity(self):
+        table = self.getCoverage('weedCoverage')
+        self.values['weedDensity'] = self._densityGrid(table)
+        self.values['weedDensityShape'] = list(table.shape)
+
+    def mapWeedDensity(self):
+        self.values['weedMap'] = self._mapDensity(
+            self.get('weedDensity'),
+            self.get('weedDensityShape'),
+            self.layers[IMAGE_WEED_DENSITY]
+        )
+
+    @property
+    def cellSize(self) -> Tuple[int, int]:
+        """Width and height of the cells of density maps, in pixels."""
+        se = self.settings
+        return (
+            max(1, int(se.mapsCellWidth * se.resolution)),
+            max(1, int(se.mapsCellHeight * se.resolution))
+        )
+
+    def _coverageSums(self, maskName: str) -> Optional[np.ndarray]:
+        mask = self.getMask(maskName)
+        if mask is None:
+            return None
+        return SummedAreaTable.fromMask(mask).sums
+
+    def _densityGrid(self, table: SummedAreaTable) -> np.ndarray:
+        # The density is constant inside every cell of the grid, so keeping
+        # a single value per cell is enough to rebuild the full map
+        return densityGrid(
+            table, self.getCoverage('roiCoverage'), self.cellSize
+        )
+
+    def _mapDensity(
+        self,
+        grid: np.ndarray,
+        shape: List[int],
+        density: Layer
+    ) -> DensityMap:
+        # Colors are applied when the map is displayed, so changing the
+        # colormap does not need the map to be computed again
+        densityMap = DensityMap(grid, self.cellSize, shape)
+        density.image = densityMap
+        density.transform = self.layers[IMAGE_VEG_MASK].transform
+        density.colormap = colormapColors(self.settings.mapsColormap)
+        density.maprange = densityMap.maprange
+        return densityMap
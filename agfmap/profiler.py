@@ -0,0 +1,314 @@
+import json
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Dict, List, Optional
+
+import utils
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# Seconds between two readings of the resident memory of the process
+RSS_SAMPLE_INTERVAL = 0.005
+
+# Environment variable enabling `tracemalloc` in the profiles of pipeline
+# runs, which slows down the allocations it measures
+TRACE_MEMORY_ENV_VAR = 'AGFMAP_TRACE_MEMORY'
+
+# Profile recording the spans of the calling thread, if any
+_local = threading.local()
+
+
+def processRss(pid='self') -> int:
+    with open(f'/proc/{pid}/statm') as fp:
+        return int(fp.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+
+
+def childPids() -> List[int]:
+    """Processes started by this one, like the workers of
+    `tiling.segmentVegetation`, where Linux lists them."""
+    pids = []
+    try:
+        for task in os.listdir('/proc/self/task'):
+            with open(f'/proc/self/task/{task}/children') as fp:
+                pids.extend(int(pid) for pid in fp.read().split())
+    except (OSError, ValueError):
+        pass
+    return pids
+
+
+def currentRss() -> Optional[int]:
+    """Resident memory of the process and of its child processes in bytes.
+    Where it cannot be read, the peak resident memory of the process alone
+    since it started is returned."""
+    try:
+        rss = processRss()
+    except (OSError, ValueError, AttributeError):
+        rss = None
+    if rss is not None:
+        for pid in childPids():
+            try:
+                rss += processRss(pid)
+            except (OSError, ValueError):
+                # The process already exited
+                pass
+        return rss
+    if resource is not None:
+        maxRss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Kilobytes on Linux, bytes on macOS
+        return maxRss if sys.platform == 'darwin' else maxRss * 1024
+    return None
+
+
+def cpuTime() -> float:
+    """CPU time used by the process and its finished child processes, like
+    the workers of `tiling.segmentVegetation`."""
+    times = os.times()
+    return times.user + times.system + \
+        times.children_user + times.children_system
+
+
+def describe(value) -> Optional[dict]:
+    """Size of a pipeline value, for arrays and anything shaped like them."""
+    info = {}
+    if hasattr(value, 'shape'):
+        info['shape'] = list(value.shape)
+    if hasattr(value, 'dtype'):
+        info['dtype'] = str(value.dtype)
+    if hasattr(value, 'nbytes'):
+        info['nbytes'] = int(value.nbytes)
+    if not info and isinstance(value, (list, tuple)):
+        info['length'] = len(value)
+    return info or None
+
+
+@contextmanager
+def measure(kind: str, name: str, **info):
+    """Record a span in the profile active in the calling thread, or do
+    nothing when there is none."""
+    profile: RunProfile = getattr(_local, 'profile', None)
+    if profile is None:
+        yield {}
+    else:
+        with profile.measure(kind, name, **info) as entry:
+            yield entry
+
+
+class RunProfile:
+    """Wall time, CPU time and memory used by the stages of a pipeline run
+    and by the layer reads and writes they make.
+
+    Entries are recorded in the order spans start. Memory is sampled by a
+    background thread while the profile is active, and every entry gets the
+    peak resident memory reached during its span, worker processes included
+    where they can be listed. When `traceMemory` is set, which defaults to
+    the `TRACE_MEMORY_ENV_VAR` environment variable being set, stages also
+    get the peak of the memory allocated through Python, NumPy arrays
+    included, as reported by `tracemalloc`.
+    """
+
+    def __init__(self, traceMemory: bool = None):
+        self.startTime: str = datetime.now().isoformat(timespec='seconds')
+        self.entries: List[dict] = []
+        self.wallTime: float = 0
+        self.cpuTime: float = 0
+        self.peakRss: Optional[int] = None
+        self.status: str = ''
+        if traceMemory is None:
+            traceMemory = bool(os.environ.get(TRACE_MEMORY_ENV_VAR))
+        self.traceMemory: bool = traceMemory
+        self._stack: List[dict] = []
+        self._peakRss: int = 0
+        self._lock = threading.Lock()
+        self._stopEvent = threading.Event()
+        self._sampler: threading.Thread = None
+        self._tracing: bool = False
+
+    @contextmanager
+    def activate(self):
+        """Record the spans of the calling thread until the block exits."""
+        self._start()
+        previous = getattr(_local, 'profile', None)
+        _local.profile = self
+        try:
+            yield self
+        finally:
+            _local.profile = previous
+            self._stop()
+
+    @contextmanager
+    def measure(self, kind: str, name: str, **info):
+        entry = dict(kind=kind, name=name, **info)
+        if self._stack:
+            entry['parent'] = self._stack[-1]['name']
+        self.entries.append(entry)
+        self._stack.append(entry)
+
+        traced = self._tracing and kind == 'stage'
+        if traced:
+            self._resetTracePeak()
+            traceBase = tracemalloc.get_traced_memory()[0]
+        with self._lock:
+            outerPeak = self._peakRss
+            self._peakRss = currentRss() or 0
+        wallStart, cpuStart = time.perf_counter(), cpuTime()
+        try:
+            yield entry
+        finally:
+            entry['wallTime'] = time.perf_counter() - wallStart
+            entry['cpuTime'] = cpuTime() - cpuStart
+            with self._lock:
+                self._peakRss = max(self._peakRss, currentRss() or 0)
+                entry['peakRss'] = self._peakRss or None
+                self._peakRss = max(outerPeak, self._peakRss)
+            if traced:
+                peak = tracemalloc.get_traced_memory()[1]
+                entry['tracemallocPeak'] = max(0, peak - traceBase)
+            self._stack.pop()
+
+    def record(self, kind: str, name: str, **info):
+        """Add an entry for something that took no measurable time, like a
+        stage whose outputs were found in the cache."""
+        entry = dict(kind=kind, name=name, wallTime=0.0, cpuTime=0.0, **info)
+        if self._stack:
+            entry['parent'] = self._stack[-1]['name']
+        self.entries.append(entry)
+        return entry
+
+    def _start(self):
+        self._wallStart, self._cpuStart = time.perf_counter(), cpuTime()
+        self._peakRss = currentRss() or 0
+        self._stopEvent.clear()
+        self._sampler = threading.Thread(target=self._sample, daemon=True)
+        self._sampler.start()
+        # Another profile, or the user, may be tracing already
+        if self.traceMemory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._tracing = True
+
+    def _stop(self):
+        self._stopEvent.set()
+        self._sampler.join()
+        if self._tracing:
+            tracemalloc.stop()
+            self._tracing = False
+        self.wallTime = time.perf_counter() - self._wallStart
+        self.cpuTime = cpuTime() - self._cpuStart
+        self.peakRss = max(self._peakRss, currentRss() or 0) or None
+
+    def _sample(self):
+        while not self._stopEvent.wait(RSS_SAMPLE_INTERVAL):
+            rss = currentRss() or 0
+            with self._lock:
+                if rss > self._peakRss:
+                    self._peakRss = rss
+
+    @staticmethod
+    def _resetTracePeak():
+        if hasattr(tracemalloc, 'reset_peak'):
+            tracemalloc.reset_peak()
+        else:
+            # Python < 3.9, forgetting the current traces also resets the
+            # peak, memory freed afterwards is then not subtracted from it
+            tracemalloc.clear_traces()
+
+    @property
+    def stages(self) -> List[dict]:
+        return [entry for entry in self.entries if entry['kind'] == 'stage']
+
+    @property
+    def data(self) -> dict:
+        return {
+            'startTime': self.startTime,
+            'status': self.status,
+            'wallTime': self.wallTime,
+            'cpuTime': self.cpuTime,
+            'peakRss': self.peakRss,
+            'entries': self.entries,
+        }
+
+    def save(self, dirPath: str, maxCount: int = 0) -> str:
+        """Write the profile to a new JSON file of `dirPath`, removing the
+        oldest ones beyond `maxCount` (0 for no limit)."""
+        if not utils.dirExists(dirPath):
+            os.makedirs(dirPath)
+        fileName = self.startTime.replace(':', '-') + '.json'
+        filePath = os.path.join(dirPath, fileName)
+        utils.writeFileAtomic(
+            filePath, json.dumps(self.data, indent=2).encode()
+        )
+        if maxCount > 0:
+            for oldPath in listProfiles(dirPath)[maxCount:]:
+                os.remove(oldPath)
+        return filePath
+
+    @staticmethod
+    def load(filePath: str) -> 'RunProfile':
+        with open(filePath) as fp:
+            data: dict = json.load(fp)
+        profile = RunProfile()
+        profile.startTime = data.get('startTime', '')
+        profile.status = data.get('status', '')
+        profile.wallTime = data.get('wallTime', 0)
+        profile.cpuTime = data.get('cpuTime', 0)
+        profile.peakRss = data.get('peakRss')
+        profile.entries = data.get('entries', [])
+        return profile
+
+    def summary(self) -> List[str]:
+        """One line per stage and per kind of layer access, slowest first."""
+        lines = [
+            f'{self.status or "run"} in {self.wallTime:.2f} s, '
+            f'{self.cpuTime:.2f} s CPU, '
+            f'peak RSS {formatSize(self.peakRss)}'
+        ]
+        stages = sorted(
+            self.stages, key=lambda entry: entry['wallTime'], reverse=True
+        )
+        for entry in stages:
+            if entry.get('cached'):
+                lines.append(f'  {entry["name"]}: cached')
+                continue
+            share = entry['wallTime'] / self.wallTime if self.wallTime else 0
+            lines.append(
+                f'  {entry["name"]}: {entry["wallTime"]:.2f} s '
+                f'({share:.0%}), {entry["cpuTime"]:.2f} s CPU, '
+                f'peak RSS {formatSize(entry.get("peakRss"))}'
+            )
+        totals: Dict[str, List[float]] = {}
+        for entry in self.entries:
+            if entry['kind'] != 'stage':
+                total = totals.setdefault(entry['kind'], [0, 0.0])
+                total[0] += 1
+                total[1] += entry['wallTime']
+        for kind, (count, wallTime) in sorted(totals.items()):
+            lines.append(f'  layer {kind}: {count} in {wallTime:.2f} s')
+        return lines
+
+
+def formatSize(size: Optional[int]) -> str:
+    if size is None:
+        return '-'
+    for unit in ('B', 'KB', 'MB'):
+        if size < 1024:
+            return f'{size:.0f} {unit}'
+        size /= 1024
+    return f'{size:.1f} GB'
+
+
+def listProfiles(dirPath: str) -> List[str]:
+    """Paths of the profiles saved in `dirPath`, newest first."""
+    if not utils.dirExists(dirPath):
+        return []
+    fileNames = [name for name in os.listdir(dirPath) if name.endswith('.json')]
+    return [
+        os.path.join(dirPath, name)
+        for name in sorted(fileNames, reverse=True)
+    ]
@@ -0,0 +1,174 @@
+import math
+from typing import Callable, Dict, Iterator, List, Tuple
+
+import cv2 as cv
+import numpy as np
+from PyQt5.QtCore import QRectF, QSize
+from PyQt5.QtGui import QImage
+
+TILE_SIZE = 512
+
+# Rows of images unpacked on demand halved at once
+BAND_HEIGHT = 1024
+
+
+def toQImage(image: np.ndarray, colorTable: List[int] = None) -> QImage:
+    """Wrap an 8-bit gray, BGR or BGRA image in a QImage without copying
+    its pixels. The QImage keeps a reference to the array in `ndarray`.
+    Gray images given a `colorTable` are indexed by their values."""
+    channels = 1 if image.ndim == 2 else image.shape[2]
+    if channels == 1 and colorTable is not None:
+        fmt = QImage.Format_Indexed8
+    elif channels == 1:
+        fmt = QImage.Format_Grayscale8
+    elif channels == 4:
+        fmt = QImage.Format_ARGB32
+    elif hasattr(QImage, 'Format_BGR888'):
+        fmt = QImage.Format_BGR888
+    else:
+        # Qt older than 5.14
+        image = cv.cvtColor(image, cv.COLOR_BGR2RGB)
+        fmt = QImage.Format_RGB888
+    # Rows may be padded, but pixels must be packed within a row
+    if image.strides[-1] != 1 or image.strides[1] != channels:
+        image = np.ascontiguousarray(image)
+
+    h, w = image.shape[0:2]
+    qImage = QImage(image.ctypes.data, w, h, image.strides[0], fmt)
+    if fmt == QImage.Format_Indexed8:
+        qImage.setColorTable(colorTable)
+    qImage.ndarray = image
+    return qImage
+
+
+def halve(image) -> np.ndarray:
+    h, w = image.shape[0:2]
+    if not isinstance(image, np.ndarray):
+        # Images unpacked on demand, like `mask.PackedMask`, are processed a
+        # band of rows at a time
+        return np.vstack([
+            halve(image[y:y + BAND_HEIGHT]) for y in range(0, h, BAND_HEIGHT)
+        ])
+    return cv.resize(
+        image, ((w + 1) // 2, (h + 1) // 2), interpolation=cv.INTER_AREA
+    )
+
+
+class TilePyramid:
+    """Power-of-two overviews of an image, split into tiles for drawing.
+
+    Level 0 is the image itself, obtained from `loadImage`, and every next
+    level halves the size of the previous one, down to a single tile. Levels
+    are computed, and tiles wrapped in QImages sharing their pixels, the
+    first time they are drawn, unless `overviews` are given. Gray images
+    are drawn through `colorTable` if there is one.
+    """
+
+    def __init__(
+        self,
+        shape: Tuple[int, ...],
+        loadImage: Callable[[], np.ndarray],
+        overviews: List[np.ndarray] = (),
+        tileSize: int = TILE_SIZE,
+        colorTable: List[int] = None
+    ):
+        self.shape: Tuple[int, ...] = tuple(shape)
+        self.loadImage: Callable[[], np.ndarray] = loadImage
+        self.overviews: List[np.ndarray] = list(overviews)
+        self.tileSize: int = tileSize
+        self.colorTable: List[int] = colorTable
+        self.tiles: Dict[Tuple[int, int, int], QImage] = {}
+        h, w = self.shape[0:2]
+        self.levelCount: int = 1 + max(
+            0, math.ceil(math.log2(max(h, w, 1) / tileSize))
+        )
+
+    @property
+    def size(self) -> QSize:
+        return QSize(self.shape[1], self.shape[0])
+
+    @property
+    def nbytes(self) -> int:
+        # Memory mapped overviews are left to the operating system
+        return sum(
+            level.nbytes for level in self.overviews
+            if not isinstance(level, np.memmap)
+        )
+
+    def setColorTable(self, colorTable: List[int]):
+        self.colorTable = colorTable
+        for qImage in self.tiles.values():
+            qImage.setColorTable(colorTable)
+
+    def levelFor(self, scale: float) -> int:
+        """Smallest level with at least one pixel per screen pixel."""
+        if scale >= 1:
+            return 0
+        level = int(math.floor(math.log2(1 / scale)))
+        return min(level, self.levelCount - 1)
+
+    def level(self, index: int) -> np.ndarray:
+        if index == 0:
+            return self.loadImage()
+        while len(self.overviews) < index:
+            self.overviews.append(halve(self.level(len(self.overviews))))
+        return self.overviews[index - 1]
+
+    def build(self) -> List[np.ndarray]:
+        """Compute all the overviews."""
+        self.level(self.levelCount - 1)
+        return self.overviews
+
+    def tile(self, index: int, row: int, col: int) -> QImage:
+        key = (index, row, col)
+        qImage = self.tiles.get(key)
+        if qImage is None:
+            y, x = row * self.tileSize, col * self.tileSize
+            image = self.level(index)
+            qImage = toQImage(
+                image[y:y + self.tileSize, x:x + self.tileSize],
+                self.colorTable
+            )
+            # Tiles of arrays are views, others hold unpacked copies
+            if isinstance(image, np.ndarray):
+                self.tiles[key] = qImage
+        return qImage
+
+    def pixel(self, x: int, y: int) -> int:
+        """Color of a pixel of the full resolution image."""
+        h, w = self.shape[0:2]
+        if not (0 <= x < w and 0 <= y < h):
+            return 0
+        size = self.tileSize
+        return self.tile(0, y // size, x // size).pixel(x % size, y % size)
+
+    def visibleTiles(
+        self,
+        rect: QRectF,
+        scale: float,
+        coarser: int = 0
+    ) -> Iterator[Tuple[QRectF, QImage]]:
+        """Tiles intersecting `rect`, given in the coordinates of the image
+        scaled by `scale`, along with the rect each one covers in them.
+        Tiles are taken `coarser` levels above the one for `scale`, fewer
+        of them to draw while the view changes."""
+        index = min(self.levelFor(scale) + coarser, self.levelCount - 1)
+        h, w = self.level(index).shape[0:2]
+        baseH, baseW = self.shape[0:2]
+        sx, sy = scale * baseW / w, scale * baseH / h
+
+        size = self.tileSize
+        col1 = max(0, int(rect.left() / sx) // size)
+        col2 = min(w - 1, int(rect.right() / sx)) // size
+        row1 = max(0, int(rect.top() / sy) // size)
+        row2 = min(h - 1, int(rect.bottom() / sy)) // size
+        for row in range(row1, row2 + 1):
+            for col in range(col1, col2 + 1):
+                tile = self.tile(index, row, col)
+                target = QRectF(
+                    col * size * sx,
+                    row * size * sy,
+                    tile.width() * sx,
+                    tile.height() * sy
+                )
+                yield target, tile
@@ -4,6 +4,8 @@ from PyQt5 import QtCore
 from PyQt5.QtGui import QImage, qRgb, QPainter
 from PyQt5.QtWidgets import QSizePolicy, QLabel
 
+import tracing
+
 
 class ColorScale(QLabel):
 
@@ -67,7 +69,10 @@ class ColorScale(QLabel):
         return QtCore.QSize(self.widthHint, self.parentWidget().height())
 
     def paintEvent(self, event):
+        with tracing.span('paintColorScale', 'render'):
+            self._paint()
 
+    def _paint(self):
         rect = self.contentsRect()
         x, y = rect.x(), rect.y()
         w, h = rect.width(), rect.height()
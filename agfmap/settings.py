@@ -1,12 +1,24 @@
 # -*- coding: utf-8 -*-
 import pickle
-from os import path, mkdir
+from os import path, makedirs
 from typing import List, Tuple, Dict
 import cv2 as cv
 
 
 DATA_DIR_NAME = '.data'
 
+CACHE_DIR_NAME = '.cache'
+
+TILE_CACHE_DIR_NAME = 'tiles'
+
+PROFILES_DIR_NAME = '.profiles'
+
+# Vertices of the shape collections of a project
+SHAPES_DIR_NAME = 'shapes'
+
+# Run profiles kept in every project
+MAX_RUN_PROFILES: int = 20
+
 APP_SETTINGS_FILE_NAME: str = 'settings'
 
 MAX_RECENT_FILES: int = 10
@@ -39,9 +51,6 @@ COLORMAPS = {
 currDir = path.dirname(path.abspath(__file__))
 rootPath = path.join(currDir, DATA_DIR_NAME)
 
-if not path.exists(rootPath) or not path.isdir(rootPath):
-    mkdir(rootPath)
-
 APP_SETTINGS_PATH = path.join(rootPath, APP_SETTINGS_FILE_NAME)
 
 
@@ -52,8 +61,18 @@ class AppSettings:
         self.mainWindowSize: Tuple[int, int] = (640, 480)
         self.openFilesDirPath: str = ''
         self.lastProjectPath: str = ''
+        # Memory for decoded images, in megabytes (0 for no limit)
+        self.imagesMemoryBudget: int = 2048
+        # Disk space for image overviews of each project, in megabytes
+        self.tileCacheSize: int = 4096
+
+    def __setstate__(self, state):
+        self.__init__()
+        self.__dict__.update(state)
 
     def save(self):
+        # Created on first save rather than on import
+        makedirs(path.dirname(APP_SETTINGS_PATH), exist_ok=True)
         with open(APP_SETTINGS_PATH, 'wb') as appFile:
             pickle.dump(self, appFile)
 
@@ -75,11 +94,18 @@ class ProjectSettings(object):
         self.runMapVeg: bool = True
         self.runMapWeeds: bool = True
         self.segmentVegThr: float = 1.0
+        self.segmentTileSize: int = 2048
+        self.segmentWorkers: int = 0
         self.rowsSeparation: float = 0.7
         self.roiAutoDetect: bool = True
         self.roiPolygon: list = None
         self.roiTrim: bool = True
+        # Recompute at full resolution the ROI detected on a mask overview
+        self.roiRefine: bool = False
         self.dirAutoDetect: bool = True
+        # Score every angle when detecting the rows direction on a mask
+        # overview, rather than only around the best of a coarse search
+        self.dirRefine: bool = False
         self.rowsDirection: float = 0
         self.rowsDirWindowWidth: float = 30
         self.rowsDirWindowHeight: float = 20
@@ -98,6 +124,11 @@ class ProjectSettings(object):
         self.rowsFurrowsColor: Tuple[int, int, int] = (255, 255, 0)
         self.drawLineWidth: int = 2
 
+    def __setstate__(self, state):
+        # Project files saved by older versions lack the newest settings
+        self.__init__()
+        self.__dict__.update(state)
+
     @property
     def projectSettingsPath(self) -> str:
         return path.join(self.projectPath, self.projectName + PROJECT_FILE_EXT)
@@ -1,5 +1,8 @@
-from typing import List, Dict
+from typing import List, Dict, Optional
+import hashlib
 import json
+import os
+import weakref
 
 import cv2 as cv
 import numpy as np
@@ -72,6 +75,24 @@ class Shape:
         self.drawing = data.get('drawing', self.drawing)
         self._initPaint()
 
+    @property
+    def pen(self) -> QPen:
+        return self._pen
+
+    def setStyle(
+        self,
+        lineColor: tuple,
+        lineWidth: int,
+        visible: bool
+    ) -> bool:
+        """Set the style of the shape, returning whether it changed."""
+        style = (tuple(lineColor), lineWidth, visible)
+        if style == (tuple(self.lineColor), self.lineWidth, self.visible):
+            return False
+        self.lineColor, self.lineWidth, self.visible = style
+        self._initPaint()
+        return True
+
     def _initPaint(self):
         r, g, b = self.lineColor
         self._pen: QPen = QPen(QColor(r, g, b), self.lineWidth)
@@ -120,6 +141,202 @@ class Shape:
                 painter.drawPolyline(poly)
 
 
+class ShapeCollection:
+    """Shapes of the same form and style, like the crop rows found by the
+    pipeline, with the vertices of all of them in a single array.
+
+    Vertices are kept as one (N, 2) int32 or float32 array, and the first
+    vertex of every shape in `offsets`, which ends with N. Iterating over a
+    collection gives `Shape` copies of its shapes. Collections are meant to
+    be shared by the layers showing them, and to be replaced rather than
+    modified. They are saved once, in a ``.npz`` file named after their
+    content, see `save`.
+    """
+
+    __slots__ = (
+        'name', 'form', 'vertices', 'offsets', 'lineColor', 'lineWidth',
+        'visible', 'fileName', '_pen', '__weakref__'
+    )
+
+    # Collections read from disk, by file path, so that layers loading the
+    # same file share it
+    _loaded = weakref.WeakValueDictionary()
+
+    # noinspection PyTypeChecker
+    def __init__(
+        self,
+        vertices: np.ndarray,
+        offsets: np.ndarray,
+        form: str = Shape.POLYLINE,
+        name: str = '',
+        lineColor: tuple = (0, 0, 0),
+        lineWidth: int = 2,
+        visible: bool = True
+    ):
+        dtype = np.int32 if np.issubdtype(vertices.dtype, np.integer) \
+            else np.float32
+        self.vertices: np.ndarray = \
+            np.ascontiguousarray(vertices, dtype).reshape((-1, 2))
+        self.offsets: np.ndarray = np.int64(offsets)
+        self.form: str = form
+        self.name: str = name
+        self.lineColor: tuple = tuple(lineColor)
+        self.lineWidth: int = lineWidth
+        self.visible: bool = visible
+        # Name of the file the vertices were last saved to or read from
+        self.fileName: str = ''
+        self._pen: QPen = None
+        self._initPaint()
+
+    def setStyle(
+        self,
+        lineColor: tuple,
+        lineWidth: int,
+        visible: bool
+    ) -> bool:
+        """Set the style of the shapes, returning whether it changed."""
+        style = (tuple(lineColor), lineWidth, visible)
+        if style == (self.lineColor, self.lineWidth, self.visible):
+            return False
+        self.lineColor, self.lineWidth, self.visible = style
+        self._initPaint()
+        return True
+
+    def _initPaint(self):
+        r, g, b = self.lineColor
+        self._pen = QPen(QColor(r, g, b), self.lineWidth)
+        self._pen.setCosmetic(True)
+
+    @staticmethod
+    def fromArray(rows: np.ndarray, **kwargs) -> 'ShapeCollection':
+        """Collection of the shapes of a (count, vertices, 2) array."""
+        count, length = rows.shape[0:2]
+        offsets = np.arange(count + 1) * length
+        return ShapeCollection(rows.reshape((-1, 2)), offsets, **kwargs)
+
+    @staticmethod
+    def fromShapes(shapes: List[Shape]) -> Optional['ShapeCollection']:
+        """Collection of a list of shapes, or ``None`` if their form or
+        style differ."""
+        if not shapes:
+            return None
+        first = shapes[0]
+        style = (first.form, first.name, first.lineColor, first.lineWidth)
+        if any(
+            (shape.form, shape.name, shape.lineColor, shape.lineWidth) != style
+            or shape.drawing or shape.pos is not None or len(shape.points) < 1
+            for shape in shapes
+        ):
+            return None
+        lengths = [len(shape.points) for shape in shapes]
+        vertices = np.concatenate([
+            np.reshape(shape.points, (-1, 2)) for shape in shapes
+        ])
+        return ShapeCollection(
+            vertices,
+            np.concatenate([[0], np.cumsum(lengths)]),
+            form=first.form,
+            name=first.name,
+            lineColor=first.lineColor,
+            lineWidth=first.lineWidth,
+            visible=all(shape.visible for shape in shapes)
+        )
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def __getitem__(self, index: int) -> Shape:
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError(index)
+        return Shape(
+            form=self.form,
+            name=self.name,
+            points=self.points(index).tolist(),
+            lineColor=self.lineColor,
+            lineWidth=self.lineWidth,
+            visible=self.visible
+        )
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self[index]
+
+    def points(self, index: int) -> np.ndarray:
+        return self.vertices[self.offsets[index]:self.offsets[index + 1]]
+
+    def toArray(self) -> np.ndarray:
+        """The (count, vertices, 2) array of shapes of the same length."""
+        return self.vertices.reshape((len(self), -1, 2))
+
+    @property
+    def pen(self) -> QPen:
+        return self._pen
+
+    @property
+    def drawing(self) -> bool:
+        return False
+
+    @property
+    def data(self) -> dict:
+        """Metadata of the collection, its vertices are in `fileName`."""
+        return {
+            'name': self.name,
+            'shape': self.form,
+            'lineColor': self.lineColor,
+            'lineWidth': self.lineWidth,
+            'visible': self.visible,
+            'count': len(self),
+            'file': self.fileName,
+        }
+
+    def contentHash(self) -> str:
+        digest = hashlib.blake2b(digest_size=8)
+        digest.update(self.vertices.dtype.str.encode())
+        digest.update(memoryview(self.vertices).cast('B'))
+        digest.update(memoryview(self.offsets).cast('B'))
+        return digest.hexdigest()
+
+    def save(self, dirPath: str) -> str:
+        """Write the vertices to `dirPath`, unless they were already, and
+        return the name of their file."""
+        if not self.fileName:
+            self.fileName = '_'.join(self.name.lower().split()) + \
+                f'.{self.contentHash()}.npz'
+        filePath = os.path.join(dirPath, self.fileName)
+        if not utils.fileExists(filePath):
+            if not utils.dirExists(dirPath):
+                os.makedirs(dirPath)
+            tmpPath = filePath + '.tmp.npz'
+            np.savez(tmpPath, vertices=self.vertices, offsets=self.offsets)
+            os.replace(tmpPath, filePath)
+            ShapeCollection._loaded[os.path.abspath(filePath)] = self
+        return self.fileName
+
+    @staticmethod
+    def load(dirPath: str, data: dict) -> 'ShapeCollection':
+        """Collection of the metadata saved by a layer, reading its file
+        only if no other layer did."""
+        filePath = os.path.abspath(os.path.join(dirPath, data['file']))
+        collection = ShapeCollection._loaded.get(filePath)
+        if collection is None:
+            with np.load(filePath) as arrays:
+                collection = ShapeCollection(
+                    arrays['vertices'], arrays['offsets']
+                )
+            collection.fileName = data['file']
+            ShapeCollection._loaded[filePath] = collection
+        collection.form = data.get('shape', collection.form)
+        collection.name = data.get('name', collection.name)
+        collection.setStyle(
+            data.get('lineColor', collection.lineColor),
+            data.get('lineWidth', collection.lineWidth),
+            data.get('visible', collection.visible)
+        )
+        return collection
+
+
 class ImageWrapper:
     # noinspection PyTypeChecker
     def __init__(self, name: str, filePath: str = '', flags=None):
@@ -0,0 +1,406 @@
+import math
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple, Union
+
+import cv2 as cv
+import numpy as np
+from PyQt5.QtCore import QRectF, Qt
+from PyQt5.QtGui import QPainter, QPainterPath, QPen, QPolygonF
+
+from shape import Shape, ShapeCollection
+
+# Vertices of the pieces polylines are split in, each one culled and
+# simplified on its own
+CHUNK_VERTICES = 64
+
+# Side of the cells of the grid indexing the pieces, in image pixels
+INDEX_CELL_SIZE = 512
+
+# Side of the areas whose pieces are drawn as one path, in screen pixels at
+# the smallest scale of a level of detail
+BATCH_SIZE = 512
+
+# Distance, in screen pixels, simplified lines may be off the original ones
+SIMPLIFY_TOLERANCE = 0.5
+
+# Shape groups whose polygons are kept between repaints
+MAX_CACHED_GROUPS = 16
+
+# Forms drawn from cached polygons, the other ones are drawn by `Shape.draw`
+CACHED_FORMS = (Shape.POLYGON, Shape.POLYLINE, Shape.LINE)
+
+
+def toPolygonF(points: np.ndarray) -> QPolygonF:
+    """Polygon of a (N, 2) array of points, copied at once."""
+    polygon = QPolygonF(len(points))
+    if len(points):
+        buffer = polygon.data()
+        buffer.setsize(len(points) * 2 * np.dtype(np.float64).itemsize)
+        np.frombuffer(buffer, np.float64).reshape((-1, 2))[:] = points
+    return polygon
+
+
+def simplify(points: np.ndarray, tolerance: float) -> np.ndarray:
+    """Douglas-Peucker simplification of an open polyline, which keeps its
+    end points so that consecutive pieces stay joined."""
+    if len(points) <= 2:
+        return points
+    simplified = cv.approxPolyDP(
+        np.float32(points).reshape((-1, 1, 2)), tolerance, False
+    )
+    return simplified.reshape((-1, 2)).astype(np.float64)
+
+
+class GridIndex:
+    """Uniform grid over a set of boxes, listing for every cell the boxes
+    crossing it.
+
+    Boxes are given as rows of ``x1, y1, x2, y2``. Items of a cell are kept
+    sorted by cell, so those of a row of cells are a single slice.
+    """
+
+    def __init__(self, boxes: np.ndarray, cellSize: float = INDEX_CELL_SIZE):
+        self.boxes: np.ndarray = np.float64(boxes).reshape((-1, 4))
+        self.cellSize: float = cellSize
+        self.origin: np.ndarray = np.zeros(2)
+        self.cols: int = 0
+        self.rows: int = 0
+        self.items: np.ndarray = np.zeros(0, np.int64)
+        self.offsets: np.ndarray = np.zeros(1, np.int64)
+        if len(self.boxes):
+            self._build()
+
+    def _build(self):
+        boxes = self.boxes
+        self.origin = boxes[:, 0:2].min(axis=0)
+        cells = np.int64((boxes - np.tile(self.origin, 2)) // self.cellSize)
+        self.cols = int(cells[:, 2].max()) + 1
+        self.rows = int(cells[:, 3].max()) + 1
+
+        # One entry per cell crossed by every box
+        widths = cells[:, 2] - cells[:, 0] + 1
+        counts = widths * (cells[:, 3] - cells[:, 1] + 1)
+        items = np.repeat(np.arange(len(boxes)), counts)
+        steps = np.arange(counts.sum()) - np.repeat(
+            np.cumsum(counts) - counts, counts
+        )
+        widths = np.repeat(widths, counts)
+        x = np.repeat(cells[:, 0], counts) + steps % widths
+        y = np.repeat(cells[:, 1], counts) + steps // widths
+        cellIds = y * self.cols + x
+
+        order = np.argsort(cellIds, kind='stable')
+        self.items = items[order]
+        self.offsets = np.searchsorted(
+            cellIds[order], np.arange(self.rows * self.cols + 1)
+        )
+
+    def query(self, rect: QRectF) -> np.ndarray:
+        """Sorted indices of the boxes intersecting `rect`."""
+        if not len(self.boxes):
+            return self.items
+        x1, y1, x2, y2 = rect.left(), rect.top(), rect.right(), rect.bottom()
+        ox, oy = self.origin
+        col1 = max(0, int((x1 - ox) // self.cellSize))
+        col2 = min(self.cols - 1, int((x2 - ox) // self.cellSize))
+        row1 = max(0, int((y1 - oy) // self.cellSize))
+        row2 = min(self.rows - 1, int((y2 - oy) // self.cellSize))
+        if col1 > col2 or row1 > row2:
+            return self.items[0:0]
+
+        slices = [
+            self.items[
+                self.offsets[row * self.cols + col1]:
+                self.offsets[row * self.cols + col2 + 1]
+            ]
+            for row in range(row1, row2 + 1)
+        ]
+        candidates = np.unique(np.concatenate(slices))
+        boxes = self.boxes[candidates]
+        inside = (boxes[:, 0] <= x2) & (boxes[:, 2] >= x1) & \
+            (boxes[:, 1] <= y2) & (boxes[:, 3] >= y1)
+        return candidates[inside]
+
+
+class ShapeBatch:
+    """Pieces of a shape group drawn with the same pen in the same area,
+    stroked as a single path. Pieces of a line following each other are
+    drawn as one run, given as the line and its first and last vertex."""
+    __slots__ = ('pen', 'runs', 'path')
+
+    def __init__(self, pen: int, runs: np.ndarray):
+        self.pen: int = pen
+        self.runs: np.ndarray = runs
+        self.path: QPainterPath = None
+
+
+class ShapeGroup:
+    """Polygons of a list or collection of shapes, split in pieces of
+    `CHUNK_VERTICES` vertices with a grid index of their bounding boxes.
+
+    Below full scale, the pieces are batched by pen and area, each batch a
+    path drawn at once, with the pieces of a line within the area joined and
+    simplified for the level of detail. Areas are about the same size on
+    screen whatever the level, so a repaint takes a few draw calls whatever
+    the number of shapes. Batches are made for every level drawn so far,
+    each with its own grid index.
+    """
+
+    def __init__(self, shapes: Union[List[Shape], ShapeCollection]):
+        self.shapes: Union[List[Shape], ShapeCollection] = shapes
+        self.signature: list = self.signatureOf(shapes)
+        # Shapes drawn by `Shape.draw`, like those being drawn by the user
+        self.others: List[Shape] = []
+        self.pens: list = []
+        # Points of the lines drawn from cache, pieces being slices of them
+        self.lines: List[np.ndarray] = []
+        chunkLines: List[np.ndarray] = []
+        chunkStarts: List[np.ndarray] = []
+        if isinstance(shapes, ShapeCollection):
+            if shapes.visible and shapes.form in CACHED_FORMS:
+                self.pens.append(shapes.pen)
+                self.lines = self._collectionLines(shapes)
+            elif shapes.visible:
+                self.others.extend(shapes)
+            shapes = []
+        linePens: List[int] = [0] * len(self.lines)
+        for shape in shapes:
+            if not shape.visible:
+                continue
+            points = self._points(shape)
+            if points is None:
+                self.others.append(shape)
+                continue
+            self.pens.append(shape.pen)
+            self.lines.append(points)
+            linePens.append(len(self.pens) - 1)
+
+        boxes: List[np.ndarray] = []
+        for line, points in enumerate(self.lines):
+            if len(points) < 2:
+                continue
+            starts = np.arange(0, len(points) - 1, CHUNK_VERTICES)
+            chunkLines.append(np.full(len(starts), line))
+            chunkStarts.append(starts)
+            # Chunks share their last vertex with the next one
+            ends = points[np.minimum(starts + CHUNK_VERTICES, len(points) - 1)]
+            boxes.append(np.hstack([
+                np.minimum(np.minimum.reduceat(points, starts), ends),
+                np.maximum(np.maximum.reduceat(points, starts), ends)
+            ]))
+
+        # Line and first vertex of every piece
+        self.chunkLines: np.ndarray = np.int64(np.concatenate(chunkLines)) \
+            if chunkLines else np.zeros(0, np.int64)
+        self.chunkStarts: np.ndarray = np.int64(np.concatenate(chunkStarts)) \
+            if chunkStarts else np.zeros(0, np.int64)
+        self.chunkPens: np.ndarray = np.int64(linePens)[self.chunkLines]
+        self.boxes: np.ndarray = \
+            np.concatenate(boxes) if boxes else np.zeros((0, 4))
+        self.index: GridIndex = GridIndex(self.boxes)
+        # Polygons of the pieces at full detail, built when first drawn
+        self.polygons: List[Optional[QPolygonF]] = \
+            [None] * len(self.chunkLines)
+        # Batches and their index by level of detail
+        self.levels: Dict[int, Tuple[GridIndex, List[ShapeBatch]]] = {}
+        self.thinPens: list = []
+        for pen in self.pens:
+            thinPen = QPen(pen)
+            thinPen.setWidth(1)
+            self.thinPens.append(thinPen)
+
+    @staticmethod
+    def signatureOf(shapes: Union[List[Shape], ShapeCollection]) -> list:
+        """What the cached polygons depend on, points edited in place
+        excepted."""
+        if isinstance(shapes, ShapeCollection):
+            # Collections are replaced rather than modified
+            return [(id(shapes.vertices), id(shapes.pen), shapes.visible,
+                     shapes.form)]
+        return [
+            (id(shape.points), len(shape.points), id(shape.pen),
+             shape.visible, shape.drawing, shape.form)
+            for shape in shapes
+        ]
+
+    @staticmethod
+    def _collectionLines(collection: ShapeCollection) -> List[np.ndarray]:
+        """Points of the shapes of a collection, views of a single copy of
+        its vertices unless they are polygons."""
+        vertices = np.float64(collection.vertices)
+        lines = np.split(vertices, collection.offsets[1:-1])
+        if collection.form == Shape.LINE:
+            lines = [points[0:2] for points in lines]
+        elif collection.form == Shape.POLYGON:
+            # Shapes are not filled, a closed polyline draws the same
+            lines = [
+                np.concatenate([points, points[0:1]]) for points in lines
+            ]
+        return lines
+
+    @staticmethod
+    def _points(shape: Shape) -> Optional[np.ndarray]:
+        if shape.form not in CACHED_FORMS or shape.drawing:
+            return None
+        if len(shape.points) < 2:
+            return np.zeros((0, 2))
+        points = np.float64(shape.points).reshape((-1, 2))
+        if shape.form == Shape.LINE:
+            points = points[0:2]
+        elif shape.form == Shape.POLYGON:
+            # Shapes are not filled, a closed polyline draws the same
+            points = np.concatenate([points, points[0:1]])
+        if shape.pos is not None:
+            points = points + shape.pos
+        return points
+
+    def chunkPoints(self, chunk: int) -> np.ndarray:
+        start = self.chunkStarts[chunk]
+        return self.lines[self.chunkLines[chunk]][
+            start:start + CHUNK_VERTICES + 1
+        ]
+
+    def batches(self, level: int) -> Tuple[GridIndex, List[ShapeBatch]]:
+        cached = self.levels.get(level)
+        if cached is not None:
+            return cached
+
+        # Pieces go to the cell of their center, the cells being about the
+        # same size on screen whatever the level. Cells are not split, the
+        # view crossing only a few of them.
+        size = BATCH_SIZE * 2 ** level
+        boxes = self.boxes
+        cells = np.int64((boxes[:, 0:2] + boxes[:, 2:4]) / 2 // size)
+        # Sorted by piece within a cell, so that the pieces of a line
+        # following each other stay together
+        order = np.lexsort((cells[:, 0], cells[:, 1], self.chunkPens))
+        keys = np.stack([self.chunkPens, cells[:, 1], cells[:, 0]], 1)[order]
+        if not len(order):
+            cached = self.levels[level] = (GridIndex(np.zeros((0, 4))), [])
+            return cached
+        isStart = np.r_[True, np.any(keys[1:] != keys[:-1], axis=1)]
+        starts = np.flatnonzero(isStart)
+
+        # Runs of pieces of the same line, each one starting on the last
+        # vertex of the previous one
+        lines, firsts = self.chunkLines[order], self.chunkStarts[order]
+        isRunStart = isStart | np.r_[True, (
+            (lines[1:] != lines[:-1]) |
+            (firsts[1:] != firsts[:-1] + CHUNK_VERTICES)
+        )]
+        runStarts = np.flatnonzero(isRunStart)
+        runEnds = np.r_[runStarts[1:], len(order)] - 1
+        lengths = np.int64([len(points) for points in self.lines])
+        lasts = np.minimum(
+            firsts[runEnds] + CHUNK_VERTICES, lengths[lines[runEnds]] - 1
+        )
+        runs = np.stack([lines[runStarts], firsts[runStarts], lasts], 1)
+        # Batch of every run
+        runBatches = np.cumsum(isStart)[runStarts] - 1
+        runSplits = np.searchsorted(runBatches, np.arange(1, len(starts)))
+
+        batches = [
+            ShapeBatch(int(keys[start, 0]), batchRuns)
+            for start, batchRuns in zip(starts, np.split(runs, runSplits))
+        ]
+        batchBoxes = np.zeros((len(batches), 4))
+        sortedBoxes = boxes[order]
+        batchBoxes[:, 0:2] = np.minimum.reduceat(sortedBoxes[:, 0:2], starts)
+        batchBoxes[:, 2:4] = np.maximum.reduceat(sortedBoxes[:, 2:4], starts)
+        cached = self.levels[level] = (GridIndex(batchBoxes, size), batches)
+        return cached
+
+    def polygon(self, chunk: int) -> QPolygonF:
+        polygon = self.polygons[chunk]
+        if polygon is None:
+            polygon = self.polygons[chunk] = toPolygonF(
+                self.chunkPoints(chunk)
+            )
+        return polygon
+
+    def path(self, batch: ShapeBatch, level: int) -> QPainterPath:
+        if batch.path is None:
+            # Within the tolerance on screen at the largest scale of the level
+            tolerance = SIMPLIFY_TOLERANCE * 2 ** (level - 1)
+            path = QPainterPath()
+            for line, first, last in batch.runs.tolist():
+                points = self.lines[line][first:last + 1]
+                path.addPolygon(toPolygonF(simplify(points, tolerance)))
+            batch.path = path
+        return batch.path
+
+    def draw(
+        self,
+        painter: QPainter,
+        rect: QRectF,
+        scale: float,
+        fast: bool = False
+    ):
+        """Draw the pieces crossing `rect`, in image coordinates, simplified
+        for the given scale of the image on screen. When `fast`, lines are
+        drawn one pixel wide, which Qt rasterizes many times faster."""
+        if self.pens:
+            margin = max(pen.widthF() for pen in self.pens) / scale
+            rect = rect.adjusted(-margin, -margin, margin, margin)
+        painter.setBrush(Qt.NoBrush)
+        pens = self.thinPens if fast else self.pens
+        lastPen = -1
+        if scale < 1:
+            # Zoomed out views draw simplified pieces in batches, a level of
+            # detail for every halving of the scale. Paths are stroked whole,
+            # hidden parts included, so zoomed in views draw the visible
+            # pieces one by one instead.
+            level = int(math.ceil(-math.log2(scale)))
+            index, batches = self.batches(level)
+            for i in index.query(rect):
+                batch = batches[i]
+                if batch.pen != lastPen:
+                    painter.setPen(pens[batch.pen])
+                    lastPen = batch.pen
+                painter.drawPath(self.path(batch, level))
+        else:
+            for chunk in self.index.query(rect):
+                pen = self.chunkPens[chunk]
+                if pen != lastPen:
+                    painter.setPen(pens[pen])
+                    lastPen = pen
+                painter.drawPolyline(self.polygon(chunk))
+        for shape in self.others:
+            shape.draw(painter)
+
+
+class ShapeRenderer:
+    """Draws the shape groups of layers from `ShapeGroup` caches, which are
+    rebuilt when their list or collection of shapes changes."""
+
+    def __init__(self):
+        self.groups: OrderedDict = OrderedDict()
+
+    def group(
+        self,
+        shapes: Union[List[Shape], ShapeCollection]
+    ) -> ShapeGroup:
+        # Keyed by list, layers sharing their shapes share the cache, and the
+        # group keeps the list alive so its id is not reused
+        key = id(shapes)
+        group: ShapeGroup = self.groups.get(key)
+        if group is None or group.signature != ShapeGroup.signatureOf(shapes):
+            group = ShapeGroup(shapes)
+        self.groups[key] = group
+        self.groups.move_to_end(key)
+        while len(self.groups) > MAX_CACHED_GROUPS:
+            self.groups.popitem(last=False)
+        return group
+
+    def draw(
+        self,
+        painter: QPainter,
+        shapes: Union[List[Shape], ShapeCollection],
+        rect: QRectF,
+        scale: float,
+        fast: bool = False
+    ):
+        self.group(shapes).draw(painter, rect, scale, fast)
+
+    def clear(self):
+        self.groups.clear()
@@ -0,0 +1,134 @@
+import hashlib
+import json
+import os
+from typing import Callable, Dict, Iterable
+
+import numpy as np
+
+import utils
+from mask import PackedMask
+
+MANIFEST_FILE_NAME = 'stages.json'
+
+
+def hashArray(array: np.ndarray) -> str:
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(str((array.shape, array.dtype.str)).encode())
+    digest.update(memoryview(np.ascontiguousarray(array)).cast('B'))
+    return digest.hexdigest()
+
+
+def hashValues(*values) -> str:
+    data = json.dumps(values, sort_keys=True, default=str)
+    return hashlib.blake2b(data.encode(), digest_size=16).hexdigest()
+
+
+class StageCache:
+    """Persistent store for the outputs of pipeline stages.
+
+    Each stage keeps a single entry, identified by the key of the run that
+    produced it, along with a content hash of every output. Array outputs are
+    saved as ``.npy`` files next to the manifest, packed masks as the ``.npy``
+    file of their bits, any other output must be JSON serializable and is kept
+    in the manifest itself.
+    """
+
+    def __init__(self, dirPath: str):
+        self.dirPath: str = dirPath
+        self.manifest: Dict[str, dict] = {'stages': {}, 'sources': {}}
+        self.read()
+
+    @property
+    def manifestPath(self) -> str:
+        return os.path.join(self.dirPath, MANIFEST_FILE_NAME)
+
+    def read(self):
+        if utils.fileExists(self.manifestPath):
+            with open(self.manifestPath) as fp:
+                self.manifest.update(json.load(fp))
+
+    def write(self):
+        if not utils.dirExists(self.dirPath):
+            os.makedirs(self.dirPath)
+        tmpPath = self.manifestPath + '.tmp'
+        with open(tmpPath, 'wt') as fp:
+            json.dump(self.manifest, fp)
+        os.replace(tmpPath, self.manifestPath)
+
+    def filePath(self, stage: str, name: str) -> str:
+        return os.path.join(self.dirPath, f'{stage}.{name}.npy')
+
+    def isValid(self, stage: str, key: str, names: Iterable[str]) -> bool:
+        entry = self.manifest['stages'].get(stage)
+        if entry is None or entry['key'] != key:
+            return False
+        for name in names:
+            if name in entry['arrays']:
+                if not utils.fileExists(self.filePath(stage, name)):
+                    return False
+            elif name not in entry['values']:
+                return False
+        return True
+
+    def load(self, stage: str, name: str, mapped: bool = False):
+        """Output `name` of a stage. Arrays are `mapped` read only into
+        memory, rather than read whole, if they are only partly used."""
+        entry = self.manifest['stages'][stage]
+        masks = entry.get('masks', {})
+        if name in masks:
+            return PackedMask.load(self.filePath(stage, name), masks[name])
+        if name in entry['arrays']:
+            return np.load(
+                self.filePath(stage, name), mmap_mode='r' if mapped else None
+            )
+        return entry['values'][name]
+
+    def hashes(self, stage: str) -> Dict[str, str]:
+        return self.manifest['stages'][stage]['hashes']
+
+    def store(
+        self,
+        stage: str,
+        key: str,
+        outputs: dict,
+        hashes: Dict[str, str]
+    ):
+        if not utils.dirExists(self.dirPath):
+            os.makedirs(self.dirPath)
+        entry = {
+            'key': key, 'arrays': [], 'masks': {}, 'values': {},
+            'hashes': hashes
+        }
+        for name, value in outputs.items():
+            if isinstance(value, PackedMask):
+                value.save(self.filePath(stage, name))
+                entry['arrays'].append(name)
+                entry['masks'][name] = list(value.shape)
+            elif isinstance(value, np.ndarray):
+                filePath = self.filePath(stage, name)
+                tmpPath = filePath + '.tmp.npy'
+                np.save(tmpPath, value)
+                os.replace(tmpPath, filePath)
+                entry['arrays'].append(name)
+            else:
+                entry['values'][name] = value
+        self.manifest['stages'][stage] = entry
+        self.write()
+
+    def sourceHash(self, filePath: str, compute: Callable[[], str]) -> str:
+        """Content hash of a source file, recomputed only when it changes."""
+        try:
+            stat = os.stat(filePath)
+            signature = [stat.st_size, stat.st_mtime_ns]
+        except OSError:
+            return compute()
+
+        source = self.manifest['sources'].get(filePath)
+        if source is not None and source['signature'] == signature:
+            return source['hash']
+
+        value = compute()
+        self.manifest['sources'][filePath] = {
+            'signature': signature, 'hash': value
+        }
+        return value
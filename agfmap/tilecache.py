@@ -0,0 +1,189 @@
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+import utils
+from applog import logger
+from settings import CACHE_DIR_NAME, TILE_CACHE_DIR_NAME
+
+MANIFEST_FILE_NAME = 'tiles.json'
+
+
+def hashFile(filePath: str) -> str:
+    digest = hashlib.blake2b(digest_size=16)
+    with open(filePath, 'rb') as fp:
+        for chunk in iter(lambda: fp.read(2 ** 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class TileCache:
+    """Persistent store for the overview levels of layer images.
+
+    Entries are keyed by the content hash of the image file, so they stay
+    valid across sessions for as long as the file does not change. Levels are
+    saved as ``.npy`` files and memory mapped when loaded. Once the cache
+    grows over `sizeLimit` bytes, the least recently used entries are removed.
+    Loading an entry only marks it used in memory, the manifest is written
+    when entries are stored or removed, and by `close`. Overviews are
+    computed by a background thread, see `schedule`.
+    """
+
+    def __init__(self, dirPath: str, sizeLimit: int = 0):
+        self.dirPath: str = dirPath
+        self.sizeLimit: int = sizeLimit
+        self.manifest: Dict[str, dict] = {'entries': {}, 'sources': {}}
+        self.lock: threading.RLock = threading.RLock()
+        self.pending: list = []
+        self.working: bool = False
+        # Whether entries were used since the manifest was written
+        self.touched: bool = False
+        self.read()
+
+    @property
+    def manifestPath(self) -> str:
+        return os.path.join(self.dirPath, MANIFEST_FILE_NAME)
+
+    def read(self):
+        try:
+            if utils.fileExists(self.manifestPath):
+                with open(self.manifestPath) as fp:
+                    self.manifest.update(json.load(fp))
+        except Exception as err:
+            logger.error(err)
+
+    def write(self):
+        with self.lock:
+            if not utils.dirExists(self.dirPath):
+                os.makedirs(self.dirPath)
+            utils.writeFileAtomic(
+                self.manifestPath, json.dumps(self.manifest).encode()
+            )
+            self.touched = False
+
+    def close(self):
+        """Write the manifest if entries were used since it was."""
+        with self.lock:
+            if self.touched:
+                self.write()
+
+    def key(self, filePath: str) -> str:
+        """Content hash of a file, recomputed only when it changes."""
+        stat = os.stat(filePath)
+        signature = [stat.st_size, stat.st_mtime_ns]
+        with self.lock:
+            source = self.manifest['sources'].get(filePath)
+            if source is not None and source['signature'] == signature:
+                return source['hash']
+
+        value = hashFile(filePath)
+        with self.lock:
+            self.manifest['sources'][filePath] = {
+                'signature': signature, 'hash': value
+            }
+        return value
+
+    def levelPath(self, key: str, index: int) -> str:
+        return os.path.join(self.dirPath, key, f'{index}.npy')
+
+    def contains(self, key: str) -> bool:
+        with self.lock:
+            return key in self.manifest['entries']
+
+    def load(self, key: str) -> Optional[Tuple[tuple, List[np.ndarray]]]:
+        """Shape of the image and its overviews, from the largest one."""
+        with self.lock:
+            entry = self.manifest['entries'].get(key)
+            if entry is None:
+                return None
+            try:
+                overviews = [
+                    np.load(self.levelPath(key, index), mmap_mode='r')
+                    for index in range(1, entry['levels'])
+                ]
+            except (OSError, ValueError):
+                self.remove(key)
+                self.write()
+                return None
+            entry['used'] = time.time()
+            self.touched = True
+            return tuple(entry['shape']), overviews
+
+    def store(self, key: str, shape: tuple, overviews: List[np.ndarray]):
+        entryPath = os.path.join(self.dirPath, key)
+        if not utils.dirExists(entryPath):
+            os.makedirs(entryPath)
+        for index, level in enumerate(overviews, 1):
+            filePath = self.levelPath(key, index)
+            tmpPath = filePath + '.tmp.npy'
+            np.save(tmpPath, level)
+            os.replace(tmpPath, filePath)
+
+        with self.lock:
+            self.manifest['entries'][key] = {
+                'shape': list(shape),
+                'levels': len(overviews) + 1,
+                'size': sum(level.nbytes for level in overviews),
+                'used': time.time(),
+            }
+            self.evict(keep=key)
+            self.write()
+
+    def setSizeLimit(self, sizeLimit: int):
+        with self.lock:
+            self.sizeLimit = sizeLimit
+            self.evict()
+            self.write()
+
+    def remove(self, key: str):
+        with self.lock:
+            self.manifest['entries'].pop(key, None)
+            shutil.rmtree(os.path.join(self.dirPath, key), ignore_errors=True)
+
+    def evict(self, keep: str = ''):
+        if self.sizeLimit <= 0:
+            return
+        with self.lock:
+            entries = self.manifest['entries']
+            used = sum(entry['size'] for entry in entries.values())
+            for key in sorted(entries, key=lambda k: entries[k]['used']):
+                if used <= self.sizeLimit:
+                    break
+                if key != keep:
+                    used -= entries[key]['size']
+                    self.remove(key)
+
+    def schedule(self, layers: list):
+        """Cache the overviews of the given layers in a background thread."""
+        with self.lock:
+            self.pending.extend(layers)
+            if self.working:
+                return
+            self.working = True
+        threading.Thread(target=self._work, daemon=True).start()
+
+    def _work(self):
+        while True:
+            with self.lock:
+                if not self.pending:
+                    self.working = False
+                    return
+                layer = self.pending.pop(0)
+            try:
+                layer.cacheTiles()
+            except Exception as err:
+                logger.error(err)
+
+
+def projectTileCache(projectPath: str, sizeLimit: int = 0) -> TileCache:
+    """Tile cache kept in the cache directory of a project."""
+    return TileCache(
+        os.path.join(projectPath, CACHE_DIR_NAME, TILE_CACHE_DIR_NAME),
+        sizeLimit
+    )
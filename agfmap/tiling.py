@@ -0,0 +1,192 @@
+import collections
+import multiprocessing
+import os
+from concurrent.futures import Future, ProcessPoolExecutor
+from typing import Iterator, Optional, Tuple
+
+import numpy as np
+
+import tracing
+
+# Margin, in pixels, added around every tile before processing it. Only the
+# inner part of a tile is written back, so operations looking at the
+# neighbourhood of a pixel give the same result as on the whole image.
+TILE_OVERLAP = 16
+
+# (y1, y2, x1, x2)
+Box = Tuple[int, int, int, int]
+
+# Rows of images scanned at once for valid data
+DATA_BAND_HEIGHT = 1024
+
+# Tiles sent to every worker process before the first ones are done
+MAX_PENDING_TILES = 2
+
+
+def tileGrid(
+    shape: Tuple[int, ...],
+    tileSize: int,
+    overlap: int = TILE_OVERLAP
+) -> Iterator[Tuple[Box, Box]]:
+    """Split an image shape into tiles.
+
+    Yields pairs of boxes: the part of the image a tile is responsible for,
+    and the same box grown by `overlap` pixels and clipped to the image.
+    """
+    h, w = shape[0:2]
+    for y1 in range(0, h, tileSize):
+        y2 = min(y1 + tileSize, h)
+        for x1 in range(0, w, tileSize):
+            x2 = min(x1 + tileSize, w)
+            outer = (
+                max(y1 - overlap, 0),
+                min(y2 + overlap, h),
+                max(x1 - overlap, 0),
+                min(x2 + overlap, w)
+            )
+            yield (y1, y2, x1, x2), outer
+
+
+def dataBox(image: np.ndarray) -> Box:
+    """Bounding box of the pixels of an image with any non zero channel,
+    which are the valid data of orthomosaics whose transparent borders were
+    zeroed. It is the whole image if there is no such pixel."""
+    h, w = image.shape[0:2]
+    rows = np.zeros(h, bool)
+    cols = np.zeros(w, bool)
+    for y in range(0, h, DATA_BAND_HEIGHT):
+        band = image[y:y + DATA_BAND_HEIGHT]
+        if band.ndim == 3:
+            valid = band[:, :, 0] != 0
+            for channel in range(1, band.shape[2]):
+                valid |= band[:, :, channel] != 0
+        else:
+            valid = band != 0
+        rows[y:y + band.shape[0]] = valid.any(axis=1)
+        cols |= valid.any(axis=0)
+    ys, xs = np.flatnonzero(rows), np.flatnonzero(cols)
+    if ys.size == 0:
+        return 0, h, 0, w
+    return int(ys[0]), int(ys[-1]) + 1, int(xs[0]), int(xs[-1]) + 1
+
+
+def workerCount(workers: int) -> int:
+    if workers <= 0:
+        return os.cpu_count() or 1
+    return workers
+
+
+def segmentVegetation(
+    image: np.ndarray,
+    threshold: float = 1,
+    tileSize: int = 2048,
+    workers: int = 0,
+    box: Box = None
+) -> np.ndarray:
+    """Tiled version of `mcrops.veget.segment_vegetation`.
+
+    Temporary arrays are allocated per tile, so the peak memory used on top
+    of the input image and the output mask depends on `tileSize` and
+    `workers` only. With more than one worker, tiles are processed in a
+    process pool, which is sent a copy of a few tiles at a time and sends
+    back the mask of each one.
+
+    Only the pixels inside `box` are segmented, and tiles whose pixels are
+    all zero, which are nodata, are skipped. Both are left out of the mask.
+    """
+    mask = np.zeros(image.shape[0:2], np.uint8)
+    if box is not None:
+        y1, y2, x1, x2 = box
+        image, boxMask = image[y1:y2, x1:x2], mask[y1:y2, x1:x2]
+    else:
+        boxMask = mask
+
+    # The mask is already zero in the skipped tiles
+    tiles = [
+        (inner, outer) for inner, outer in tileGrid(image.shape, tileSize)
+        if image[inner[0]:inner[1], inner[2]:inner[3]].any()
+    ]
+    workers = min(workerCount(workers), len(tiles))
+
+    if workers <= 1:
+        for inner, outer in tiles:
+            _writeTile(boxMask, inner, _segmentTile(
+                _window(image, outer), inner, outer, threshold
+            ))
+        return mask
+
+    # Spawned processes do not inherit the threads of the GUI
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=context,
+        initializer=_initWorker,
+        initargs=(tracing.isEnabled(),)
+    ) as executor:
+        # Tiles are submitted as earlier ones are done, so only a few of
+        # them are copied at any time
+        pending = collections.deque()
+        for inner, outer in tiles:
+            if len(pending) >= MAX_PENDING_TILES * workers:
+                _collectTile(boxMask, *pending.popleft())
+            future = executor.submit(
+                _segmentWorkerTile,
+                _window(image, outer), inner, outer, threshold
+            )
+            pending.append((inner, future))
+        while pending:
+            _collectTile(boxMask, *pending.popleft())
+    return mask
+
+
+def _window(image: np.ndarray, box: Box) -> np.ndarray:
+    y1, y2, x1, x2 = box
+    return image[y1:y2, x1:x2]
+
+
+def _writeTile(mask: np.ndarray, inner: Box, tileMask: np.ndarray):
+    y1, y2, x1, x2 = inner
+    mask[y1:y2, x1:x2] = tileMask
+
+
+def _collectTile(mask: np.ndarray, inner: Box, future: Future):
+    tileMask, events = future.result()
+    _writeTile(mask, inner, tileMask)
+    if events is not None:
+        tracing.addEvents(*events)
+
+
+def _segmentTile(
+    window: np.ndarray,
+    inner: Box,
+    outer: Box,
+    threshold: float
+) -> np.ndarray:
+    """Mask of the `inner` box of a tile, `window` holding the pixels of
+    its `outer` box."""
+    import mcrops
+
+    y1, y2, x1, x2 = inner
+    oy1, _, ox1, _ = outer
+    with tracing.span('segmentTile', 'tiling', box=list(inner)):
+        tileMask = mcrops.veget.segment_vegetation(window, threshold=threshold)
+        return tileMask[y1 - oy1:y2 - oy1, x1 - ox1:x2 - ox1]
+
+
+def _initWorker(traced: bool):
+    if traced:
+        tracing.enable()
+
+
+def _segmentWorkerTile(
+    window: np.ndarray,
+    inner: Box,
+    outer: Box,
+    threshold: float
+) -> Tuple[np.ndarray, Optional[tuple]]:
+    """Segment a tile in a worker process, returning its mask and the spans
+    it recorded if tracing is enabled."""
+    tileMask = _segmentTile(window, inner, outer, threshold)
+    if tracing.isEnabled():
+        return tileMask, tracing.takeEvents()
+    return tileMask, None
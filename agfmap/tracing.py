@@ -0,0 +1,160 @@
+"""Recording of nested spans, exported in the Chrome Trace Event format.
+
+Traces can be opened in Perfetto (https://ui.perfetto.dev) or in the
+``chrome://tracing`` page of Chromium browsers. Recording is off by default,
+`span` then returns a shared no-op context manager. Setting the
+``AGFMAP_TRACE`` environment variable to a file path records the whole
+session of the process and exports it there on exit.
+"""
+import atexit
+import json
+import multiprocessing
+import os
+import threading
+import time
+from contextlib import nullcontext
+from typing import List
+
+import utils
+from applog import logger
+
+TRACE_ENV_VAR = 'AGFMAP_TRACE'
+
+# Events kept in memory at most, later ones are dropped
+MAX_TRACE_EVENTS = 1000000
+
+_enabled = False
+_events: List[dict] = []
+_threadNames = {}
+_lock = threading.Lock()
+_null = nullcontext()
+
+
+class _Span:
+    __slots__ = ('name', 'category', 'args', 'start')
+
+    def __init__(self, name: str, category: str, args: dict):
+        self.name = name
+        self.category = category
+        self.args = args
+        self.start = 0.0
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        end = time.perf_counter()
+        addEvent(self.name, self.category, self.start, end, self.args)
+        return False
+
+
+def isEnabled() -> bool:
+    return _enabled
+
+
+def enable():
+    global _enabled
+    _enabled = True
+
+
+def disable():
+    global _enabled
+    _enabled = False
+
+
+def span(name: str, category: str = '', **args):
+    """Context manager recording the time taken by its block. Arguments are
+    shown along with the span and must be JSON serializable."""
+    if not _enabled:
+        return _null
+    return _Span(name, category, args)
+
+
+def addEvent(
+    name: str,
+    category: str,
+    start: float,
+    end: float,
+    args: dict = None
+):
+    """Record a span of `time.perf_counter` times, which are shared by all
+    the processes of the machine."""
+    thread = threading.current_thread()
+    event = {
+        'name': name,
+        'cat': category,
+        'ph': 'X',
+        'ts': start * 1e6,
+        'dur': (end - start) * 1e6,
+        'pid': os.getpid(),
+        'tid': thread.ident,
+    }
+    if args:
+        event['args'] = args
+    with _lock:
+        key = (os.getpid(), thread.ident)
+        if key not in _threadNames:
+            _threadNames[key] = thread.name
+        if len(_events) < MAX_TRACE_EVENTS:
+            _events.append(event)
+
+
+def addEvents(events: List[dict], threadNames: dict = None):
+    """Merge the events recorded by another process."""
+    with _lock:
+        _events.extend(events[:max(0, MAX_TRACE_EVENTS - len(_events))])
+        if threadNames:
+            _threadNames.update(threadNames)
+
+
+def takeEvents() -> tuple:
+    """Remove and return the events recorded so far, and the names of their
+    threads, to send them to the process exporting the trace."""
+    with _lock:
+        events, threadNames = list(_events), dict(_threadNames)
+        _events.clear()
+        _threadNames.clear()
+    return events, threadNames
+
+
+def clear():
+    takeEvents()
+
+
+def export(filePath: str) -> int:
+    """Write the recorded events to a JSON file, and return their number."""
+    with _lock:
+        events = list(_events)
+        threadNames = dict(_threadNames)
+    processes = {pid for pid, _ in threadNames}
+    metadata = [
+        {
+            'name': 'process_name', 'ph': 'M', 'pid': pid, 'tid': 0,
+            'args': {'name': 'agfmap' if pid == os.getpid() else 'worker'},
+        }
+        for pid in processes
+    ] + [
+        {
+            'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': tid,
+            'args': {'name': name},
+        }
+        for (pid, tid), name in threadNames.items()
+    ]
+    data = {'traceEvents': metadata + events, 'displayTimeUnit': 'ms'}
+    utils.writeFileAtomic(filePath, json.dumps(data).encode())
+    return len(events)
+
+
+def _exportOnExit(filePath: str):
+    try:
+        export(filePath)
+    except OSError as err:
+        logger.error(err)
+
+
+# Worker processes are traced on behalf of the main one, see `tiling`
+if os.environ.get(TRACE_ENV_VAR) and \
+        multiprocessing.parent_process() is None:
+    enable()
+    atexit.register(_exportOnExit, os.environ[TRACE_ENV_VAR])
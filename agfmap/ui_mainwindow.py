@@ -15,11 +15,23 @@ from PyQt5.QtWidgets import (
     QListWidget,
     QAbstractItemView,
     QColorDialog,
-    QPushButton, QSizePolicy
+    QPushButton, QSizePolicy,
+    QProgressBar,
+    QWidget,
+    QVBoxLayout,
+    QHBoxLayout,
+    QLabel,
+    QSpinBox,
+    QComboBox,
+    QTableWidget,
+    QTableWidgetItem,
+    QHeaderView
 )
 
 import settings
+import tracing
 import values
+from profiler import RunProfile, formatSize
 from imageview import ImageView
 from ui_newprojectdialog import Ui_NewProjectDialog
 from ui_settingsdialog import Ui_SettingsDialog
@@ -43,6 +55,7 @@ class Ui_MainWindow(object):
         self.saveProjectAct: QAction = None
         self.setSettingsAct: QAction = None
         self.buildCropMapsAct: QAction = None
+        self.runProfileAct: QAction = None
         self.selectImageAct: QAction = None
         self.selectRoiPolyAct: QAction = None
         self.setCropRowsDirAct: QAction = None
@@ -52,6 +65,7 @@ class Ui_MainWindow(object):
         self.zoomOutAct: QAction = None
         self.exitAct: QAction = None
         self.aboutAct: QAction = None
+        self.recordTraceAct: QAction = None
         self.toggleImageListViewAct: QAction = None
         self.fileMenu: QMenu = None
         self.viewMenu: QMenu = None
@@ -62,6 +76,9 @@ class Ui_MainWindow(object):
         self.cropToolBar: QToolBar = None
         self.settingsDialog: SettingsDialog = None
         self.newProjectDialog: NewProjectDialog = None
+        self.runProfileDialog: RunProfileDialog = None
+        self.runProgressBar: QProgressBar = None
+        self.cancelRunButton: QPushButton = None
 
     def setupUi(self, mainWindow):
         
@@ -162,6 +179,12 @@ class Ui_MainWindow(object):
         )
         self.buildCropMapsAct.setStatusTip(values.analyzeCropActTip)
 
+        self.runProfileAct = QAction(
+            values.runProfileActText,
+            self.mainWindow
+        )
+        self.runProfileAct.setStatusTip(values.runProfileActTip)
+
         self.selectRoiPolyAct = QAction(
             QIcon(values.setRoiImage),
             values.setRoiActText,
@@ -220,6 +243,14 @@ class Ui_MainWindow(object):
             self.mainWindow
         )
 
+        self.recordTraceAct = QAction(
+            values.recordTraceActText,
+            self.mainWindow
+        )
+        self.recordTraceAct.setStatusTip(values.recordTraceActTip)
+        self.recordTraceAct.setCheckable(True)
+        self.recordTraceAct.setChecked(tracing.isEnabled())
+
         action = self.imageListDockWidget.toggleViewAction()
         action.setIcon(QIcon(values.panelViewImage))
         action.setText(values.togglePanelViewActText)
@@ -244,6 +275,7 @@ class Ui_MainWindow(object):
 
         self.toolsMenu = self.mainWindow.menuBar().addMenu(values.toolsMenuText)
         self.toolsMenu.addAction(self.buildCropMapsAct)
+        self.toolsMenu.addAction(self.runProfileAct)
         self.toolsMenu.addAction(self.shownShapesAct)
         self.toolsMenu.addSeparator()
         self.toolsMenu.addAction(self.selectRoiPolyAct)
@@ -251,6 +283,8 @@ class Ui_MainWindow(object):
         self.toolsMenu.addAction(self.imageInfoToolAct)
 
         self.helpMenu = self.mainWindow.menuBar().addMenu(values.helpMenuText)
+        self.helpMenu.addAction(self.recordTraceAct)
+        self.helpMenu.addSeparator()
         self.helpMenu.addAction(self.aboutAct)
 
     def createToolBars(self):
@@ -283,11 +317,25 @@ class Ui_MainWindow(object):
         self.cropToolBar.addAction(self.shownShapesAct)
         
     def createStatusBar(self):
-        self.mainWindow.statusBar().showMessage("Ready")
+        statusBar = self.mainWindow.statusBar()
+        statusBar.showMessage(values.readyStatusMessage)
+
+        self.runProgressBar = QProgressBar(statusBar)
+        self.runProgressBar.setMaximumWidth(200)
+        self.runProgressBar.setVisible(False)
+        statusBar.addPermanentWidget(self.runProgressBar)
+
+        self.cancelRunButton = QPushButton(
+            values.cancelRunButtonText,
+            statusBar
+        )
+        self.cancelRunButton.setVisible(False)
+        statusBar.addPermanentWidget(self.cancelRunButton)
 
     def createDialogs(self):
         self.settingsDialog = SettingsDialog(self.mainWindow)
         self.newProjectDialog = NewProjectDialog(self.mainWindow)
+        self.runProfileDialog = RunProfileDialog(self.mainWindow)
 
     def errorMsg(self, msg):
         QMessageBox.critical(
@@ -375,6 +423,75 @@ class ColorPickerButton(QPushButton):
         self.setStyleSheet("background-color: " + color.name())
     
 
+class RunProfileDialog(QDialog):
+    def __init__(self, parent=None):
+        super(RunProfileDialog, self).__init__(parent)
+        self.setWindowTitle(values.runProfileDialogTitle)
+        helpFlag = QtCore.Qt.WindowContextHelpButtonHint
+        self.setWindowFlags(self.windowFlags() & ~helpFlag)
+        self.resize(800, 480)
+
+        layout = QVBoxLayout(self)
+        self.profilesComboBox = QComboBox(self)
+        self.profilesComboBox.setMinimumSize(QtCore.QSize(0, 30))
+        layout.addWidget(self.profilesComboBox)
+        self.summaryLabel = QLabel(self)
+        layout.addWidget(self.summaryLabel)
+        columns = len(values.runProfileHeaders)
+        self.entriesTable = QTableWidget(0, columns, self)
+        self.entriesTable.setHorizontalHeaderLabels(values.runProfileHeaders)
+        self.entriesTable.setEditTriggers(QAbstractItemView.NoEditTriggers)
+        self.entriesTable.verticalHeader().setVisible(False)
+        self.entriesTable.horizontalHeader().setSectionResizeMode(
+            QHeaderView.ResizeToContents
+        )
+        layout.addWidget(self.entriesTable, 1)
+
+    def setProfile(self, profile: RunProfile = None):
+        table = self.entriesTable
+        table.setRowCount(0)
+        if profile is None:
+            self.summaryLabel.setText(values.runProfileEmptyText)
+            return
+        self.summaryLabel.setText(values.runProfileSummaryText.format(
+            status=profile.status,
+            wallTime=profile.wallTime,
+            cpuTime=profile.cpuTime,
+            peakRss=formatSize(profile.peakRss)
+        ))
+        for entry in profile.entries:
+            # Layer reads and writes are indented below their stage
+            name = entry.get('title', entry['name'])
+            if entry['kind'] != 'stage':
+                name = '    ' + name
+            data = sum(
+                (info or {}).get('nbytes', 0)
+                for key in ('inputs', 'outputs')
+                for info in entry.get(key, {}).values()
+            )
+            if 'image' in entry:
+                data += (entry['image'] or {}).get('nbytes', 0)
+            cached = entry.get('cached')
+            row = [
+                name,
+                entry['kind'],
+                f'{entry["wallTime"]:.3f} s',
+                f'{entry["cpuTime"]:.3f} s',
+                formatSize(entry.get('peakRss')),
+                formatSize(entry.get('tracemallocPeak')),
+                formatSize(data) if data else '',
+                '' if cached is None else ('yes' if cached else 'no'),
+            ]
+            table.insertRow(table.rowCount())
+            for column, text in enumerate(row):
+                item = QTableWidgetItem(text)
+                if column >= 2:
+                    item.setTextAlignment(
+                        QtCore.Qt.AlignRight | QtCore.Qt.AlignVCenter
+                    )
+                table.setItem(table.rowCount() - 1, column, item)
+
+
 class SettingsDialog(QDialog):
     def __init__(self, parent=None):
         super(SettingsDialog, self).__init__(parent)
@@ -395,3 +512,79 @@ class SettingsDialog(QDialog):
         self.ui.rowsRidgesColorLayout.addWidget(self.ui.rowsRidgesColorButton)
         self.ui.rowsFurrowsColorButton = ColorPickerButton(self)
         self.ui.rowsFurrowsColorLayout.addWidget(self.ui.rowsFurrowsColorButton)
+
+        self.ui.performancePage = QWidget()
+        self.ui.performanceLayout = QVBoxLayout(self.ui.performancePage)
+        self.ui.performanceLayout.setContentsMargins(10, 20, 10, 10)
+        self.ui.segmentTileSizeSpinBox = self._addSpinBox(
+            values.segmentTileSizeLabel, 256, 65536, ' px'
+        )
+        self.ui.segmentTileSizeSpinBox.setSingleStep(256)
+        self.ui.segmentWorkersSpinBox = self._addSpinBox(
+            values.segmentWorkersLabel, 0, 256
+        )
+        self.ui.segmentWorkersSpinBox.setSpecialValueText(
+            values.segmentWorkersAutoText
+        )
+        self.ui.imagesMemoryBudgetSpinBox = self._addSpinBox(
+            values.imagesMemoryBudgetLabel, 0, 1048576, ' MB'
+        )
+        self.ui.imagesMemoryBudgetSpinBox.setSingleStep(256)
+        self.ui.imagesMemoryBudgetSpinBox.setSpecialValueText(
+            values.imagesMemoryBudgetUnlimitedText
+        )
+        self.ui.tileCacheSizeSpinBox = self._addSpinBox(
+            values.tileCacheSizeLabel, 0, 1048576, ' MB'
+        )
+        self.ui.tileCacheSizeSpinBox.setSingleStep(256)
+        self.ui.tileCacheSizeSpinBox.setSpecialValueText(
+            values.imagesMemoryBudgetUnlimitedText
+        )
+        self.ui.performanceLayout.addStretch()
+        self.ui.pagesTabWidget.addTab(
+            self.ui.performancePage,
+            values.performancePageTitle
+        )
+
+        self.ui.mapsPreviewPage = QWidget()
+        layout = QVBoxLayout(self.ui.mapsPreviewPage)
+        layout.setContentsMargins(10, 20, 10, 10)
+        self.ui.mapsPreviewComboBox = QComboBox(self.ui.mapsPreviewPage)
+        self.ui.mapsPreviewComboBox.setMinimumSize(QtCore.QSize(0, 30))
+        self.ui.mapsPreviewComboBox.addItem(
+            values.mapsPreviewVegText, 'vegDensity'
+        )
+        self.ui.mapsPreviewComboBox.addItem(
+            values.mapsPreviewWeedsText, 'weedDensity'
+        )
+        layout.addWidget(self.ui.mapsPreviewComboBox)
+        self.ui.mapsPreviewLabel = QLabel(self.ui.mapsPreviewPage)
+        self.ui.mapsPreviewLabel.setAlignment(QtCore.Qt.AlignCenter)
+        self.ui.mapsPreviewLabel.setSizePolicy(
+            QSizePolicy.Ignored, QSizePolicy.Ignored
+        )
+        layout.addWidget(self.ui.mapsPreviewLabel, 1)
+        self.ui.mapsPreviewInfoLabel = QLabel(self.ui.mapsPreviewPage)
+        layout.addWidget(self.ui.mapsPreviewInfoLabel)
+        self.ui.pagesTabWidget.addTab(
+            self.ui.mapsPreviewPage,
+            values.mapsPreviewPageTitle
+        )
+
+    def _addSpinBox(
+        self,
+        text: str,
+        minimum: int,
+        maximum: int,
+        suffix: str = ''
+    ) -> QSpinBox:
+        layout = QHBoxLayout()
+        layout.setSpacing(20)
+        layout.addWidget(QLabel(text, self.ui.performancePage))
+        spinBox = QSpinBox(self.ui.performancePage)
+        spinBox.setMinimumSize(QtCore.QSize(0, 30))
+        spinBox.setRange(minimum, maximum)
+        spinBox.setSuffix(suffix)
+        layout.addWidget(spinBox)
+        self.ui.performanceLayout.addLayout(layout)
+        return spinBox
@@ -41,3 +41,37 @@ def isValidImage(img):
 
 def swapExt(filePath, newExt):
     return os.path.splitext(filePath)[0] + newExt
+
+
+def writeFileAtomic(filePath, data):
+    """Replace a file with `data` at once. The data is written to a
+    temporary file of its own, synced to disk before it takes the place of
+    the file, and removed if writing fails."""
+    fp = tempfile.NamedTemporaryFile(
+        'wb',
+        dir=os.path.dirname(filePath) or '.',
+        prefix=os.path.basename(filePath) + '.',
+        suffix='.tmp',
+        delete=False
+    )
+    try:
+        with fp:
+            fp.write(data)
+            fp.flush()
+            os.fsync(fp.fileno())
+        os.replace(fp.name, filePath)
+    except BaseException:
+        try:
+            os.remove(fp.name)
+        except OSError:
+            pass
+        raise
+
+
+def formatDuration(seconds):
+    seconds = int(round(seconds))
+    if seconds >= 3600:
+        return f'{seconds // 3600}h {seconds % 3600 // 60:02d}m'
+    if seconds >= 60:
+        return f'{seconds // 60}m {seconds % 60:02d}s'
+    return f'{seconds}s'
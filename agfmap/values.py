@@ -11,16 +11,54 @@ errorDialogTitle = 'Error'
 warnDialogTitle = 'Warning'
 aboutDialogTitle = f'About {appName}'
 openProjectDialogTitle = 'Open Project'
+runProfileDialogTitle = 'Run Profile'
+saveTraceDialogTitle = 'Save Trace'
 
 # Messages
 aboutDialogMessage = f'<p><b>{appName}</b></p> <p>Author: {author}</p>'
 
 # Error messages
+loadProjectErrorMessage = 'Error loading project {path}.'
 saveProjectErrorMessage = 'Error saving project file.'
+saveTraceErrorMessage = 'Error saving trace file.'
 projectPathErrorMessage = 'Invalid project directory.'
+runErrorMessage = 'Crop analysis failed: {error}'
+
+# Status messages
+readyStatusMessage = 'Ready'
+openingProjectStatusMessage = 'Opening project {name}...'
+runStageStatusMessage = 'Step {index}/{count}: {title}...'
+runEtaStatusMessage = ' (about {eta} left)'
+runFinishedStatusMessage = 'Crop analysis finished in {elapsed}'
+runCancellingStatusMessage = 'Cancelling crop analysis after the current step...'
+runCancelledStatusMessage = 'Crop analysis cancelled'
+traceStartedStatusMessage = 'Recording a performance trace'
+traceSavedStatusMessage = 'Trace of {count} events saved to {path}'
 
 # Widgets
 imageListPanelTitle = 'Images'
+cancelRunButtonText = 'Cancel'
+performancePageTitle = 'Performance'
+segmentTileSizeLabel = 'Segmentation tile size:'
+segmentWorkersLabel = 'Worker processes:'
+segmentWorkersAutoText = 'Automatic'
+imagesMemoryBudgetLabel = 'Memory for images:'
+imagesMemoryBudgetUnlimitedText = 'Unlimited'
+tileCacheSizeLabel = 'Disk space for image overviews:'
+mapsPreviewPageTitle = 'Density Preview'
+mapsPreviewVegText = 'Vegetation density'
+mapsPreviewWeedsText = 'Weed density'
+mapsPreviewEmptyText = 'Run the crop analysis to preview density maps.'
+mapsPreviewInfoText = '{cols} x {rows} cells, computed in {elapsed} ms'
+runProfileEmptyText = 'Run the crop analysis to profile it.'
+runProfileSummaryText = (
+    'Crop analysis {status} in {wallTime:.2f} s, {cpuTime:.2f} s of CPU '
+    'time, peak memory {peakRss}'
+)
+runProfileHeaders = (
+    'Step', 'Kind', 'Wall time', 'CPU time', 'Peak memory',
+    'Python peak', 'Data', 'Cached'
+)
 
 # Actions
 newProjectActText = '&New Project...'
@@ -52,6 +90,10 @@ showShapesActText = 'Shape &Visibility...'
 showShapesActTip = 'Select Visible Shapes'
 togglePanelViewActText = 'Image List &Panel...'
 togglePanelViewActTip = 'Image List Panel'
+runProfileActText = 'Run &Profile...'
+runProfileActTip = 'Show the Time and Memory Taken by the Last Crop Analyses'
+recordTraceActText = 'Record Performance &Trace'
+recordTraceActTip = 'Record a Trace of the Application, Saved When Stopped'
 
 # Menus
 fileMenuText = '&File'
@@ -0,0 +1,102 @@
+import time
+
+from PyQt5.QtCore import QObject, pyqtSignal, pyqtSlot
+
+import tracing
+from applog import logger
+from pipeline import (
+    Pipeline, PipelineCancelled, buildLayers, IMAGE_CROP_FIELD
+)
+from settings import ProjectSettings
+from tilecache import projectTileCache
+
+
+class PipelineWorker(QObject):
+    """Runs a `Pipeline` in the thread this object is moved to.
+
+    Signals are delivered to the GUI thread through queued connections, so
+    the receiving slots can safely touch widgets and project layers.
+    """
+
+    # Stage index, number of stages, stage title, ETA in seconds (-1 unknown)
+    stageStarted = pyqtSignal(int, int, str, float)
+    layerUpdated = pyqtSignal(object)
+    finished = pyqtSignal()
+    cancelled = pyqtSignal()
+    failed = pyqtSignal(str)
+
+    def __init__(self, pipeline: Pipeline):
+        super(PipelineWorker, self).__init__()
+
+        self.pipeline: Pipeline = pipeline
+        self.pipeline.onStageStarted = self._stageStarted
+        self.pipeline.onLayerUpdated = self.layerUpdated.emit
+        self._startTime: float = 0
+
+    @pyqtSlot()
+    def run(self):
+        self._startTime = time.monotonic()
+        try:
+            self.pipeline.run()
+        except PipelineCancelled:
+            logger.info('Pipeline cancelled')
+            self.cancelled.emit()
+        except Exception as err:
+            logger.exception(err)
+            self.failed.emit(str(err))
+        else:
+            self.finished.emit()
+
+    def cancel(self):
+        # Called from the GUI thread, the pipeline checks the flag between
+        # stages
+        self.pipeline.cancel()
+
+    def _stageStarted(self, index: int, count: int, title: str):
+        eta = -1.0
+        if index > 0:
+            elapsed = time.monotonic() - self._startTime
+            eta = elapsed / index * (count - index)
+        self.stageStarted.emit(index, count, title, eta)
+
+
+class ProjectLoader(QObject):
+    """Opens a project file in the thread this object is moved to.
+
+    Reads the project settings and layer metadata, and prepares the image
+    shown first, so the window stays responsive while a large project is
+    restored. The layers are handed to the GUI thread once ready.
+    """
+
+    # Project settings, layers by name, tile cache
+    loaded = pyqtSignal(object, object, object)
+    failed = pyqtSignal(str)
+
+    def __init__(self, filePath: str, tileCacheSize: int = 0):
+        super(ProjectLoader, self).__init__()
+
+        self.filePath: str = filePath
+        self.tileCacheSize: int = tileCacheSize
+
+    @pyqtSlot()
+    def run(self):
+        try:
+            with tracing.span('loadProject', 'app'):
+                projectSettings = ProjectSettings.load(self.filePath)
+                layers = buildLayers(projectSettings)
+                tileCache = projectTileCache(
+                    projectSettings.projectPath, self.tileCacheSize
+                )
+                for layer in layers.values():
+                    layer.tileCache = tileCache
+                shownLayer = layers.get(
+                    projectSettings.shownImageName,
+                    layers[IMAGE_CROP_FIELD]
+                )
+                # Overviews, or else the pixels, the view draws first
+                _ = shownLayer.pyramid
+        except Exception as err:
+            logger.error(err)
+            self.failed.emit(str(err))
+        else:
+            self.loaded.emit(projectSettings, layers, tileCache)
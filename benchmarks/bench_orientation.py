@@ -0,0 +1,111 @@
+"""Speed and accuracy of the ROI and rows direction detection on mask
+overviews, against the full resolution `mcrops` functions.
+
+Usage::
+
+    python benchmarks/bench_orientation.py [--size 6000x8000] [--resolution 50]
+"""
+import argparse
+import math
+import os
+import sys
+import time
+
+import mcrops
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'agfmap'))
+
+from fields import angleError, polygonDistance, polygonIou, rowsMask
+from mask import PackedMask, maskOverview
+from orientation import (
+    detectDirection, detectRoi, directionLevel, overviewLevel, refineRoi
+)
+
+WINDOW_SHAPE = (20, 30)
+
+
+def timed(function, *args, **kwargs):
+    startTime = time.perf_counter()
+    result = function(*args, **kwargs)
+    return result, time.perf_counter() - startTime
+
+
+def fullResolution(mask, rowsSeparation, resolution):
+    roiPoly = mcrops.veget.detect_roi(
+        mask, row_sep=rowsSeparation, resolution=resolution
+    )
+    rowsDir = mcrops.rows.detect_direction(
+        mask, resolution=resolution, window_shape=WINDOW_SHAPE
+    )
+    return roiPoly.reshape((-1, 2)), rowsDir
+
+
+def overviewPath(mask, rowsSeparation, resolution, refine):
+    level = overviewLevel(resolution, rowsSeparation)
+    dirLevel = directionLevel(resolution, rowsSeparation)
+    dirOverview = maskOverview(mask, dirLevel)
+    overview = maskOverview(dirOverview, level - dirLevel)
+    roiPoly = detectRoi(overview, level, rowsSeparation, resolution)
+    if roiPoly is None:
+        h, w = mask.shape[0:2]
+        roiPoly = np.int32([[0, 0], [w, 0], [w, h], [0, h]])
+    elif refine and level > 0:
+        roiPoly = refineRoi(mask, roiPoly, level, rowsSeparation, resolution)
+    rowsDir = detectDirection(
+        dirOverview, dirLevel, resolution, WINDOW_SHAPE, refine
+    )
+    return roiPoly, rowsDir
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--size', default='6000x8000')
+    parser.add_argument('--resolution', type=float, default=50)
+    parser.add_argument('--rows-separation', type=float, default=0.7)
+    parser.add_argument('--direction', type=float, default=0.3)
+    args = parser.parse_args()
+
+    h, w = map(int, args.size.split('x'))
+    mask = rowsMask(
+        (h, w), args.resolution, args.rows_separation, args.direction
+    )
+    packed = PackedMask.fromArray(mask)
+    level = overviewLevel(args.resolution, args.rows_separation)
+    dirLevel = directionLevel(args.resolution, args.rows_separation)
+    print(
+        f'Field {w}x{h} px, {args.resolution} px/m, overview levels {level} '
+        f'for the ROI and {dirLevel} for the direction'
+    )
+
+    (fullPoly, fullDir), fullTime = timed(
+        fullResolution, mask, args.rows_separation, args.resolution
+    )
+    print(
+        f'{"method":<22}{"time s":>9}{"speedup":>9}{"dir err":>9}'
+        f'{"vs full":>9}{"ROI IoU":>9}{"ROI px":>9}'
+    )
+    truth = args.direction
+    print(
+        f'{"full resolution":<22}{fullTime:>9.3f}{1:>9.1f}'
+        f'{angleError(fullDir, truth):>9.3f}{0:>9.3f}{1:>9.4f}{0:>9.1f}'
+    )
+    for name, refine in (('overview', False), ('overview + refine', True)):
+        (roiPoly, rowsDir), elapsed = timed(
+            overviewPath, packed, args.rows_separation, args.resolution,
+            refine
+        )
+        print(
+            f'{name:<22}{elapsed:>9.3f}{fullTime / elapsed:>9.1f}'
+            f'{angleError(rowsDir, truth):>9.3f}'
+            f'{angleError(rowsDir, fullDir):>9.3f}'
+            f'{polygonIou(roiPoly, fullPoly, mask.shape):>9.4f}'
+            f'{polygonDistance(roiPoly, fullPoly):>9.1f}'
+        )
+    print('Direction errors in degrees, ROI distances in pixels, against '
+          f'the full resolution path; pixel size {1 / args.resolution:g} m, '
+          f'angle step {math.degrees(math.pi / 359):.2f} degrees.')
+
+
+if __name__ == '__main__':
+    main()
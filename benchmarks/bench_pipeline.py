@@ -0,0 +1,116 @@
+"""Time taken by every stage of the crop analysis pipeline, by project
+loading and by the reads and writes of every layer, on synthetic fields.
+
+Usage::
+
+    python benchmarks/bench_pipeline.py [--sizes small,medium] [--repeat 3]
+
+Metrics are named ``<size>/<metric>`` and given in seconds, the best of
+`repeat` runs, each one in a new project. See ``suite.py`` to compare them
+with a baseline.
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+from typing import Dict, List
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'agfmap'))
+
+from fields import writeCropField
+
+# Pixels per meter of the synthetic fields
+RESOLUTION = 50
+
+
+def layerMetric(name: str) -> str:
+    return '_'.join(name.lower().split())
+
+
+def runOnce(window, imagePath: str, projectPath: str) -> Dict[str, float]:
+    from layer import Layer
+    from pipeline import Pipeline
+    from settings import ProjectSettings
+
+    metrics = {}
+    se = ProjectSettings()
+    se.projectName = 'bench'
+    se.projectPath = projectPath
+    se.cropFieldImagePath = imagePath
+    se.resolution = RESOLUTION
+    window.projectSettings = se
+
+    # The first time the crop field is imported into the project
+    startTime = time.perf_counter()
+    window.buildImages()
+    metrics['buildImages.import'] = time.perf_counter() - startTime
+
+    pipeline = Pipeline(se, window.images)
+    pipeline.run()
+    for entry in pipeline.profile.stages:
+        metrics[f'pipeline.{entry["name"]}'] = entry['wallTime']
+    metrics['pipeline.total'] = pipeline.profile.wallTime
+
+    startTime = time.perf_counter()
+    window.buildImages()
+    metrics['buildImages.open'] = time.perf_counter() - startTime
+
+    for layer in window.images.values():
+        name = layerMetric(layer.name)
+        startTime = time.perf_counter()
+        pixels = layer.pixels
+        metrics[f'layer.read.{name}'] = time.perf_counter() - startTime
+        if pixels is None:
+            continue
+        copy = Layer(layer.name, layer.filePath, layer.flags, layer.storage)
+        copy.image = pixels
+        copy.filePath = os.path.join(
+            projectPath, 'copy-' + os.path.basename(layer.filePath)
+        )
+        startTime = time.perf_counter()
+        copy.save()
+        metrics[f'layer.save.{name}'] = time.perf_counter() - startTime
+    return metrics
+
+
+def benchmark(sizes: List[str], repeat: int = 3) -> Dict[str, float]:
+    from app import MainWindow
+
+    window = MainWindow()
+    metrics = {}
+    workDir = tempfile.mkdtemp(prefix='agfmap-bench-')
+    try:
+        for size in sizes:
+            imagePath = writeCropField(workDir, size, RESOLUTION)
+            for run in range(repeat):
+                projectPath = os.path.join(workDir, f'{size}-{run}')
+                os.makedirs(projectPath)
+                for name, value in runOnce(
+                    window, imagePath, projectPath
+                ).items():
+                    key = f'{size}/{name}'
+                    metrics[key] = min(metrics.get(key, value), value)
+                window.images = {}
+                shutil.rmtree(projectPath)
+    finally:
+        shutil.rmtree(workDir, ignore_errors=True)
+    return metrics
+
+
+def main():
+    from suite import printMetrics, startApplication
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', default='small')
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    application = startApplication()
+    printMetrics(benchmark(args.sizes.split(','), args.repeat))
+    del application
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,148 @@
+"""Time taken by the application to start, each time in a new process, until
+its window is shown and until the last project is restored in it.
+
+Usage::
+
+    python benchmarks/bench_startup.py [--sizes small,medium] [--repeat 3]
+
+Metrics are named ``<size>/startup.<step>``, the size being that of the
+crop field of the restored project, and given in seconds from the start of
+the process, the best of `repeat` runs. Steps are ``import``, the import of
+the ``app`` module, ``window``, the main window drawn on screen, and
+``project``, the project layers shown. See ``suite.py`` to compare them with
+a baseline.
+"""
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, List
+
+START_TIME = time.perf_counter()
+
+AGFMAP_DIR = os.path.join(os.path.dirname(__file__), '..', 'agfmap')
+sys.path.insert(0, AGFMAP_DIR)
+
+# Pixels per meter of the synthetic fields
+RESOLUTION = 50
+
+# Seconds a started application has to restore its project
+RESTORE_TIMEOUT = 120
+
+
+def prepareProject(dirPath: str, size: str) -> str:
+    """Project of a crop field, with its overviews cached as they are after
+    a first session, and application settings reopening it. Returns the
+    path of the settings file."""
+    from fields import writeCropField
+    from pipeline import buildLayers
+    from settings import APP_SETTINGS_FILE_NAME, AppSettings, ProjectSettings
+    from tilecache import projectTileCache
+    import settings
+
+    se = ProjectSettings()
+    se.projectName = size
+    se.projectPath = os.path.join(dirPath, size)
+    se.cropFieldImagePath = writeCropField(dirPath, size, RESOLUTION)
+    se.resolution = RESOLUTION
+    os.makedirs(se.projectPath)
+    tileCache = projectTileCache(se.projectPath)
+    for layer in buildLayers(se).values():
+        layer.tileCache = tileCache
+        layer.cacheTiles()
+    tileCache.write()
+    se.save()
+
+    appSettings = AppSettings()
+    appSettings.lastProjectPath = se.projectSettingsPath
+    appSettings.recentFiles = [se.projectSettingsPath]
+    settingsPath = os.path.join(dirPath, f'{size}-{APP_SETTINGS_FILE_NAME}')
+    savedPath = settings.APP_SETTINGS_PATH
+    settings.APP_SETTINGS_PATH = settingsPath
+    try:
+        appSettings.save()
+    finally:
+        settings.APP_SETTINGS_PATH = savedPath
+    return settingsPath
+
+
+def startOnce(settingsPath: str) -> Dict[str, float]:
+    """Times of a new application process, see `child`."""
+    env = dict(os.environ)
+    env.setdefault('QT_QPA_PLATFORM', 'offscreen')
+    result = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), '--child', settingsPath],
+        stdout=subprocess.PIPE,
+        env=env,
+        check=True,
+        timeout=RESTORE_TIMEOUT * 2
+    )
+    return json.loads(result.stdout.decode().splitlines()[-1])
+
+
+def child(settingsPath: str):
+    """Start the application with the given settings, and print the times
+    of its startup steps as JSON on the last line of the output."""
+    import settings
+    settings.APP_SETTINGS_PATH = settingsPath
+
+    import app
+    times = {'import': time.perf_counter() - START_TIME}
+
+    from PyQt5.QtCore import QEventLoop, QTimer
+    from PyQt5.QtWidgets import QApplication
+
+    application = QApplication(sys.argv[:1])
+    loop = QEventLoop()
+    window = app.MainWindow()
+    window.projectLoaded.connect(loop.quit)
+    window.show()
+    application.processEvents()
+    times['window'] = time.perf_counter() - START_TIME
+
+    QTimer.singleShot(RESTORE_TIMEOUT * 1000, loop.quit)
+    loop.exec_()
+    # The view draws the restored layer
+    application.processEvents()
+    if window.images:
+        times['project'] = time.perf_counter() - START_TIME
+    window.close()
+    print(json.dumps(times), flush=True)
+
+
+def benchmark(sizes: List[str], repeat: int = 3) -> Dict[str, float]:
+    metrics = {}
+    workDir = tempfile.mkdtemp(prefix='agfmap-bench-')
+    try:
+        for size in sizes:
+            settingsPath = prepareProject(workDir, size)
+            for _ in range(max(1, repeat)):
+                for step, value in startOnce(settingsPath).items():
+                    key = f'{size}/startup.{step}'
+                    metrics[key] = min(metrics.get(key, value), value)
+    finally:
+        shutil.rmtree(workDir, ignore_errors=True)
+    return metrics
+
+
+def main():
+    from suite import printMetrics
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', default='small')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--child', default='', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child(args.child)
+    else:
+        printMetrics(benchmark(args.sizes.split(','), args.repeat))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,284 @@
+"""Frame times of the image viewer, replaying a scripted session of wheel
+zooms, drags and layer switches on synthetic layers with thousands of crop
+row polylines.
+
+Usage::
+
+    python benchmarks/bench_viewer.py [--sizes small,medium] [--repeat 1]
+
+A frame is the handling of one burst of input events, repaints included,
+and the settling of the view once input stops. Metrics are the percentiles
+of the frame times and of the ``Canvas.paintEvent`` times, in seconds, and
+the peak resident memory of the process, in bytes. The strips drawn while
+panning are drawn as the mouse moves, they count in frame times but not in
+paint times. See ``suite.py`` to compare them with a baseline.
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+from typing import Dict, List
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'agfmap'))
+
+from fields import FIELD_SIZES, cropField, rowPolylines, rowsMask
+
+# Crop rows drawn on the field and mask layers, by field size, each as a
+# ridge and a furrow polyline
+ROWS_COUNT = {
+    'small': 500,
+    'medium': 2000,
+    'large': 4000,
+}
+ROWS_VERTICES = 500
+
+VIEW_SIZE = (1280, 800)
+
+# Wheel notches sent at once, as a trackpad does within a frame
+WHEEL_BURST = 3
+
+# Seconds the view is left idle after every group of actions, for timers
+# refining it once input stops
+SETTLE_TIME = 0.3
+
+PERCENTILES = (50, 90, 99)
+
+
+def buildLayers(dirPath: str, size: str) -> list:
+    """Field, vegetation mask and density map layers, saved in `dirPath`."""
+    from density import DensityMap, colormapColors
+    from layer import Layer
+    from mask import PackedMask
+    from pipeline import SHAPE_ROWS_FURROWS, SHAPE_ROWS_RIDGES
+    from settings import ProjectSettings
+    from shape import Shape, ShapeCollection
+    import cv2 as cv
+
+    shape = FIELD_SIZES[size]
+    se = ProjectSettings()
+    field = Layer('Field', os.path.join(dirPath, 'field.png'))
+    field.image = cropField(shape)
+    mask = Layer('Mask', os.path.join(dirPath, 'mask.npy'),
+                 storage=PackedMask)
+    mask.image = rowsMask(shape)
+    density = Layer('Density', os.path.join(dirPath, 'density.npz'),
+                    storage=DensityMap)
+    rng = np.random.default_rng(0)
+    density.image = DensityMap(
+        rng.random((shape[0] // 250 + 1, shape[1] // 250 + 1)),
+        (250, 250), shape
+    )
+    density.colormap = colormapColors(cv.COLORMAP_JET)
+    density.maprange = density.pixels.maprange
+
+    count = ROWS_COUNT[size]
+    for name, offset, color in (
+        (SHAPE_ROWS_RIDGES, 0, se.rowsRidgesColor),
+        (SHAPE_ROWS_FURROWS, 0.5, se.rowsFurrowsColor),
+    ):
+        shapes = ShapeCollection.fromArray(
+            rowPolylines(shape, count, ROWS_VERTICES, offset),
+            name=name,
+            form=Shape.POLYLINE,
+            lineColor=color,
+            lineWidth=se.drawLineWidth
+        )
+        field.shapes[name] = shapes
+        mask.shapes[name] = shapes
+
+    layers = [field, mask, density]
+    for layer in layers:
+        layer.save()
+    return layers
+
+
+class Session:
+    """Sends input to an `ImageView` and times the frames it takes."""
+
+    def __init__(self, view, application):
+        import tracing
+
+        self.view = view
+        self.application = application
+        self.tracing = tracing
+        self.frameTimes: List[float] = []
+        self.paintTimes: List[float] = []
+        self.peakRss: int = 0
+
+    def frame(self, *events):
+        """Deliver a burst of events, then process everything they caused
+        until the view is drawn."""
+        from profiler import currentRss
+
+        self.tracing.clear()
+        startTime = time.perf_counter()
+        for receiver, event in events:
+            self.application.sendEvent(receiver, event)
+        self.application.processEvents()
+        self.frameTimes.append(time.perf_counter() - startTime)
+        self._collectPaints()
+        self.peakRss = max(self.peakRss, currentRss() or 0)
+
+    def settle(self):
+        """Let timers fire while input is idle, each round of events that
+        paints the view counting as a frame."""
+        endTime = time.perf_counter() + SETTLE_TIME
+        while time.perf_counter() < endTime:
+            self.tracing.clear()
+            startTime = time.perf_counter()
+            self.application.processEvents()
+            elapsed = time.perf_counter() - startTime
+            if self._collectPaints():
+                self.frameTimes.append(elapsed)
+            time.sleep(0.005)
+
+    def _collectPaints(self) -> int:
+        events, _ = self.tracing.takeEvents()
+        paints = [
+            event['dur'] / 1e6 for event in events
+            if event['name'] == 'paintEvent'
+        ]
+        self.paintTimes.extend(paints)
+        return len(paints)
+
+    def wheel(self, notches: int, count: int):
+        from PyQt5.QtCore import QPoint, QPointF, Qt
+        from PyQt5.QtGui import QWheelEvent
+
+        center = QPointF(self.view.width() / 2, self.view.height() / 2)
+        globalPos = QPointF(self.view.mapToGlobal(QPoint(
+            int(center.x()), int(center.y())
+        )))
+        for _ in range(count):
+            events = [
+                (self.view, QWheelEvent(
+                    center, globalPos, QPoint(), QPoint(0, 120 * notches),
+                    Qt.NoButton, Qt.NoModifier, Qt.NoScrollPhase, False
+                ))
+                for _ in range(WHEEL_BURST)
+            ]
+            self.frame(*events)
+        self.settle()
+
+    def drag(self, dx: int, dy: int, steps: int):
+        from PyQt5.QtCore import QEvent, QPoint, Qt
+        from PyQt5.QtGui import QMouseEvent
+
+        def mouseEvent(kind, pos, buttons):
+            target = self.view.childAt(pos) or self.view
+            local = target.mapFrom(self.view, pos)
+            return target, QMouseEvent(
+                kind, local, self.view.mapToGlobal(pos),
+                Qt.LeftButton, buttons, Qt.NoModifier
+            )
+
+        pos = QPoint(self.view.width() // 2, self.view.height() // 2)
+        target, event = mouseEvent(
+            QEvent.MouseButtonPress, pos, Qt.LeftButton
+        )
+        self.frame((target, event))
+        for _ in range(steps):
+            pos += QPoint(dx, dy)
+            # Events go to the widget that got the press, as Qt does
+            local = target.mapFrom(self.view, pos)
+            self.frame((target, QMouseEvent(
+                QEvent.MouseMove, local, self.view.mapToGlobal(pos),
+                Qt.NoButton, Qt.LeftButton, Qt.NoModifier
+            )))
+        local = target.mapFrom(self.view, pos)
+        self.frame((target, QMouseEvent(
+            QEvent.MouseButtonRelease, local, self.view.mapToGlobal(pos),
+            Qt.LeftButton, Qt.NoButton, Qt.NoModifier
+        )))
+        self.settle()
+
+    def show(self, layer):
+        startTime = time.perf_counter()
+        self.tracing.clear()
+        self.view.showImage(layer)
+        self.application.processEvents()
+        self.frameTimes.append(time.perf_counter() - startTime)
+        self._collectPaints()
+        self.settle()
+
+
+def replay(session: Session, layers: list):
+    """The scripted session: zoom in and out around the center of every
+    layer, with drags at high zoom, switching layers in between."""
+    for layer in layers:
+        session.show(layer)
+        session.wheel(1, 4)
+        session.drag(12, 8, 10)
+        session.wheel(1, 2)
+        session.drag(-16, -4, 10)
+        session.wheel(-1, 6)
+
+
+def percentileMetrics(name: str, values: List[float]) -> Dict[str, float]:
+    metrics = {}
+    for percentile in PERCENTILES:
+        metrics[f'{name}.p{percentile}'] = float(
+            np.percentile(values, percentile)
+        )
+    metrics[f'{name}.max'] = float(np.max(values))
+    return metrics
+
+
+def benchmark(sizes: List[str], repeat: int = 1) -> Dict[str, float]:
+    from PyQt5.QtWidgets import QApplication
+    from imageview import ImageView
+    import tracing
+
+    application = QApplication.instance()
+    wasTracing = tracing.isEnabled()
+    tracing.enable()
+    metrics = {}
+    workDir = tempfile.mkdtemp(prefix='agfmap-bench-')
+    try:
+        for size in sizes:
+            dirPath = os.path.join(workDir, size)
+            os.makedirs(dirPath)
+            layers = buildLayers(dirPath, size)
+            view = ImageView(None)
+            view.resize(*VIEW_SIZE)
+            view.show()
+            session = Session(view, application)
+            for _ in range(max(1, repeat)):
+                replay(session, layers)
+            for name, values in (
+                ('frame', session.frameTimes),
+                ('paint', session.paintTimes),
+            ):
+                for key, value in percentileMetrics(name, values).items():
+                    metrics[f'{size}/viewer.{key}'] = value
+            metrics[f'{size}/viewer.rssBytes'] = session.peakRss
+            view.close()
+            view.deleteLater()
+            application.processEvents()
+    finally:
+        if not wasTracing:
+            tracing.disable()
+        tracing.clear()
+        shutil.rmtree(workDir, ignore_errors=True)
+    return metrics
+
+
+def main():
+    from suite import printMetrics, startApplication
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', default='small')
+    parser.add_argument('--repeat', type=int, default=1)
+    args = parser.parse_args()
+
+    application = startApplication()
+    printMetrics(benchmark(args.sizes.split(','), args.repeat))
+    del application
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,189 @@
+"""Synthetic crop fields for the benchmarks.
+
+Fields are drawn from their ground truth, crop rows of a known direction and
+separation inside a known ROI polygon, so detection errors can be measured.
+`cropField` renders them as color images, with weeds and nodata borders like
+those of orthomosaics.
+"""
+import math
+import os
+from typing import Tuple
+
+import cv2 as cv
+import numpy as np
+
+
+# Height and width of the fields the benchmarks run on, in pixels
+FIELD_SIZES = {
+    'small': (1500, 2000),
+    'medium': (4000, 5000),
+    'large': (8000, 10000),
+}
+
+
+def rowsMask(
+    shape: Tuple[int, int],
+    resolution: float = 50,
+    rowsSeparation: float = 0.7,
+    rowsDirection: float = 0.3,
+    roiPoly: np.ndarray = None,
+    rowWidth: float = 0.25,
+    gaps: float = 0.2,
+    seed: int = 0
+) -> np.ndarray:
+    """Vegetation mask of a field of crop rows.
+
+    Rows are `rowsSeparation` meters apart and `rowWidth` meters wide, along
+    `rowsDirection` radians, clockwise. About a `gaps` fraction of every row
+    is missing plants. Only the inside of `roiPoly` is planted, the central
+    80 % of the image by default.
+    """
+    h, w = shape
+    rng = np.random.default_rng(seed)
+    if roiPoly is None:
+        roiPoly = defaultRoi(shape)
+
+    mask = np.zeros((h, w), np.uint8)
+    separation = rowsSeparation * resolution
+    thickness = max(1, int(round(rowWidth * resolution)))
+    dx, dy = math.cos(rowsDirection), math.sin(rowsDirection)
+    nx, ny = -dy, dx
+    cx, cy = w / 2, h / 2
+    length = math.hypot(w, h)
+    count = int(length / separation) + 1
+    for k in range(-count, count + 1):
+        x0, y0 = cx + k * separation * nx, cy + k * separation * ny
+        pt1 = (int(x0 - length * dx), int(y0 - length * dy))
+        pt2 = (int(x0 + length * dx), int(y0 + length * dy))
+        cv.line(mask, pt1, pt2, 255, thickness)
+
+    # Missing plants, as gaps of up to a meter along the rows
+    area = (w * h) / (separation * resolution)
+    for _ in range(int(gaps * area)):
+        x, y = int(rng.integers(0, w)), int(rng.integers(0, h))
+        cv.circle(mask, (x, y), int(rng.integers(1, resolution)), 0, -1)
+
+    roi = np.zeros((h, w), np.uint8)
+    cv.fillPoly(roi, [np.int32(roiPoly).reshape((-1, 1, 2))], 255)
+    return cv.bitwise_and(mask, roi)
+
+
+def cropField(
+    shape: Tuple[int, int],
+    resolution: float = 50,
+    rowsSeparation: float = 0.7,
+    rowsDirection: float = 0.3,
+    weeds: float = 0.002,
+    border: float = 0.05,
+    seed: int = 0
+) -> np.ndarray:
+    """BGR image of a field of crop rows, as `rowsMask`, over bare soil.
+
+    Weeds are patches of up to 20 cm, about a `weeds` fraction of the field
+    area being covered. A `border` fraction of the image on every side is
+    nodata, left black, and the corners are cut as if the image had been
+    rotated.
+    """
+    h, w = shape
+    rng = np.random.default_rng(seed)
+    mask = rowsMask(shape, resolution, rowsSeparation, rowsDirection,
+                    seed=seed)
+
+    noise = rng.integers(0, 24, (h, w), np.uint8)
+    soil = cv.merge([noise + np.uint8(value) for value in (60, 90, 120)])
+
+    plants = np.zeros((h, w), np.uint8)
+    radius = max(1, int(0.1 * resolution))
+    count = int(weeds * w * h / (math.pi * radius ** 2))
+    for _ in range(count):
+        x, y = int(rng.integers(0, w)), int(rng.integers(0, h))
+        cv.circle(plants, (x, y), int(rng.integers(1, radius + 1)), 255, -1)
+    plants = cv.bitwise_or(plants, mask)
+    image = soil
+    image[plants > 0] = (40, 150, 50)
+
+    # Nodata outside of an octagon inset by the border
+    bx, by = int(border * w), int(border * h)
+    cx, cy = int(0.2 * w), int(0.2 * h)
+    valid = np.zeros((h, w), np.uint8)
+    cv.fillPoly(valid, [np.int32([
+        [bx + cx, by], [w - bx - cx, by], [w - bx, by + cy],
+        [w - bx, h - by - cy], [w - bx - cx, h - by], [bx + cx, h - by],
+        [bx, h - by - cy], [bx, by + cy],
+    ]).reshape((-1, 1, 2))], 255)
+    return cv.bitwise_and(image, image, mask=valid)
+
+
+def rowPolylines(
+    shape: Tuple[int, int],
+    count: int,
+    vertices: int = 500,
+    offset: float = 0,
+    seed: int = 0
+) -> np.ndarray:
+    """Array of `count` horizontal polylines of `vertices` (x, y) points
+    each, evenly spread over an image and shifted down by `offset` times
+    their separation, like the crop rows `mcrops.rows.detect_rows` finds
+    in normalized images."""
+    h, w = shape
+    rng = np.random.default_rng(seed)
+    separation = h / count
+    xs = np.linspace(0, w - 1, vertices)
+    ys = (np.arange(count) + 0.5 + offset) * separation
+    wobble = rng.normal(0, separation / 8, (count, vertices))
+    rows = np.empty((count, vertices, 2), np.int32)
+    rows[:, :, 0] = xs
+    rows[:, :, 1] = np.clip(ys[:, None] + wobble, 0, h - 1)
+    return rows
+
+
+def writeCropField(dirPath: str, size: str, resolution: float = 50) -> str:
+    """Path of the PNG image of the field of a `FIELD_SIZES` size, which is
+    created the first time."""
+    filePath = os.path.join(dirPath, f'field-{size}-{resolution:g}.png')
+    if not os.path.isfile(filePath):
+        image = cropField(FIELD_SIZES[size], resolution)
+        if not cv.imwrite(filePath, image):
+            raise OSError(f'Cannot write image {filePath}')
+    return filePath
+
+
+def defaultRoi(shape: Tuple[int, int]) -> np.ndarray:
+    """A slanted quadrilateral over most of an image."""
+    h, w = shape
+    return np.int32([
+        [0.12 * w, 0.08 * h],
+        [0.90 * w, 0.14 * h],
+        [0.86 * w, 0.92 * h],
+        [0.08 * w, 0.86 * h],
+    ])
+
+
+def angleError(a: float, b: float) -> float:
+    """Difference of two line directions, in degrees."""
+    diff = abs(a - b) % math.pi
+    return math.degrees(min(diff, math.pi - diff))
+
+
+def polygonIou(poly1: np.ndarray, poly2: np.ndarray, shape) -> float:
+    masks = []
+    for poly in (poly1, poly2):
+        mask = np.zeros(shape[0:2], np.uint8)
+        cv.fillPoly(mask, [np.int32(poly).reshape((-1, 1, 2))], 1)
+        masks.append(mask.astype(bool))
+    union = np.count_nonzero(masks[0] | masks[1])
+    return np.count_nonzero(masks[0] & masks[1]) / union if union else 1.0
+
+
+def polygonDistance(poly1: np.ndarray, poly2: np.ndarray) -> float:
+    """Largest distance from a vertex of either polygon to the outline of
+    the other one, in pixels."""
+    poly1 = np.float32(poly1).reshape((-1, 1, 2))
+    poly2 = np.float32(poly2).reshape((-1, 1, 2))
+    distance = 0.0
+    for points, poly in ((poly1, poly2), (poly2, poly1)):
+        for x, y in points.reshape((-1, 2)):
+            distance = max(distance, abs(
+                cv.pointPolygonTest(poly, (float(x), float(y)), True)
+            ))
+    return distance
@@ -0,0 +1,196 @@
+"""Benchmark suite, failing when a metric regresses against a baseline.
+
+Usage::
+
+    python benchmarks/suite.py [--only pipeline,viewer] [--sizes small,medium]
+                               [--repeat 3] [--tolerance 0.25]
+                               [--baseline benchmarks/baseline.json]
+                               [--update-baseline] [--output results.json]
+
+Every metric is a duration or an amount of memory, lower being better. A
+metric regresses when it exceeds its baseline value by more than the
+tolerance, a fraction of that value, and by more than a minimum difference
+below which measurements are noise. The tolerance is taken from the command
+line, or else from the baseline file. The exit status is 1 if any metric
+regressed.
+
+The suite runs headless, Qt uses the ``offscreen`` platform unless
+``QT_QPA_PLATFORM`` is set. Baselines depend on the machine they were
+recorded on, update them with ``--update-baseline`` after a deliberate
+change or on a new reference machine.
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+from typing import Dict
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCHMARKS_DIR, '..', 'agfmap'))
+
+BASELINE_PATH = os.path.join(BENCHMARKS_DIR, 'baseline.json')
+
+DEFAULT_TOLERANCE = 0.25
+
+# Differences ignored whatever the tolerance, by metric unit
+MIN_DIFFERENCES = {
+    's': 0.02,
+    'B': 16 * 2 ** 20,
+}
+
+
+def metricUnit(name: str) -> str:
+    """Memory metrics end with ``Bytes``, all the other ones are seconds."""
+    return 'B' if name.endswith('Bytes') else 's'
+
+
+def startApplication():
+    """QApplication the benchmarks create their widgets in, after isolating
+    the application settings from those of the user."""
+    os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+    import settings
+    settings.APP_SETTINGS_PATH = os.path.join(
+        tempfile.mkdtemp(prefix='agfmap-settings-'),
+        settings.APP_SETTINGS_FILE_NAME
+    )
+    settings.AppSettings().save()
+    from PyQt5.QtWidgets import QApplication
+    return QApplication.instance() or QApplication(sys.argv[:1])
+
+
+def benchmarks() -> dict:
+    import bench_pipeline
+    import bench_startup
+    import bench_viewer
+    return {
+        'pipeline': bench_pipeline.benchmark,
+        'startup': bench_startup.benchmark,
+        'viewer': bench_viewer.benchmark,
+    }
+
+
+def compare(
+    metrics: Dict[str, float],
+    baseline: Dict[str, float],
+    tolerance: float
+) -> Dict[str, str]:
+    """Status of every metric: ``ok``, ``faster``, ``regressed`` or
+    ``new`` when it has no baseline."""
+    statuses = {}
+    for name, value in metrics.items():
+        base = baseline.get(name)
+        if base is None:
+            statuses[name] = 'new'
+            continue
+        minDifference = MIN_DIFFERENCES[metricUnit(name)]
+        if value > base * (1 + tolerance) and value - base > minDifference:
+            statuses[name] = 'regressed'
+        elif value < base / (1 + tolerance) and \
+                base - value > minDifference:
+            statuses[name] = 'faster'
+        else:
+            statuses[name] = 'ok'
+    return statuses
+
+
+def formatValue(name: str, value: float) -> str:
+    if metricUnit(name) == 'B':
+        return f'{value / 2 ** 20:.1f} MB'
+    return f'{value * 1000:.1f} ms'
+
+
+def printMetrics(
+    metrics: Dict[str, float],
+    baseline: Dict[str, float] = None,
+    statuses: Dict[str, str] = None
+):
+    baseline = baseline or {}
+    statuses = statuses or {}
+    width = max([len(name) for name in metrics] + [6])
+    print(f'{"metric":<{width}}{"value":>14}{"baseline":>14}{"ratio":>8}  '
+          f'status')
+    for name, value in sorted(metrics.items()):
+        base = baseline.get(name)
+        ratio = f'{value / base:.2f}' if base else ''
+        print(
+            f'{name:<{width}}{formatValue(name, value):>14}'
+            f'{formatValue(name, base) if base is not None else "":>14}'
+            f'{ratio:>8}  {statuses.get(name, "")}'
+        )
+
+
+def loadBaseline(filePath: str) -> dict:
+    if not os.path.isfile(filePath):
+        return {}
+    with open(filePath) as fp:
+        return json.load(fp)
+
+
+def saveBaseline(filePath: str, metrics: Dict[str, float], tolerance: float):
+    data = loadBaseline(filePath)
+    data['platform'] = platform.platform()
+    data['processor'] = platform.processor() or platform.machine()
+    data['cpuCount'] = os.cpu_count()
+    data['tolerance'] = tolerance
+    # Metrics not measured this time are kept
+    data['metrics'] = dict(data.get('metrics', {}), **metrics)
+    with open(filePath, 'w') as fp:
+        json.dump(data, fp, indent=2, sort_keys=True)
+        fp.write('\n')
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--only', default='',
+                        help='comma separated benchmarks, all by default')
+    parser.add_argument('--sizes', default='small,medium')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--tolerance', type=float, default=None)
+    parser.add_argument('--baseline', default=BASELINE_PATH)
+    parser.add_argument('--update-baseline', action='store_true')
+    parser.add_argument('--output', default='',
+                        help='JSON file the metrics are written to')
+    args = parser.parse_args()
+
+    application = startApplication()
+    available = benchmarks()
+    names = args.only.split(',') if args.only else list(available)
+    for name in names:
+        if name not in available:
+            parser.error(f'unknown benchmark "{name}"')
+
+    metrics = {}
+    for name in names:
+        print(f'Running the {name} benchmark...', flush=True)
+        metrics.update(available[name](args.sizes.split(','), args.repeat))
+    del application
+
+    baselineData = loadBaseline(args.baseline)
+    tolerance = args.tolerance
+    if tolerance is None:
+        tolerance = baselineData.get('tolerance', DEFAULT_TOLERANCE)
+    baseline = baselineData.get('metrics', {})
+    statuses = compare(metrics, baseline, tolerance)
+    printMetrics(metrics, baseline, statuses)
+
+    if args.output:
+        with open(args.output, 'w') as fp:
+            json.dump(metrics, fp, indent=2, sort_keys=True)
+    if args.update_baseline:
+        saveBaseline(args.baseline, metrics, tolerance)
+        print(f'Baseline written to {args.baseline}')
+        return 0
+
+    regressed = [name for name, status in statuses.items()
+                 if status == 'regressed']
+    if regressed:
+        print(f'{len(regressed)} metrics regressed by more than '
+              f'{tolerance:.0%}: {", ".join(sorted(regressed))}')
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
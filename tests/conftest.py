@@ -0,0 +1,27 @@
+import os
+import sys
+
+import pytest
+
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+
+# Modules of the application import each other by name, and the tests reuse
+# the synthetic fields of the benchmarks
+rootPath = os.path.join(os.path.dirname(__file__), '..')
+sys.path.insert(0, os.path.join(rootPath, 'agfmap'))
+sys.path.insert(0, os.path.join(rootPath, 'benchmarks'))
+
+from fields import writeCropField  # noqa: E402
+from settings import ProjectSettings  # noqa: E402
+
+
+@pytest.fixture
+def project(tmp_path) -> ProjectSettings:
+    """Settings of a new project of the small synthetic field."""
+    se = ProjectSettings()
+    se.projectName = 'test'
+    se.projectPath = str(tmp_path / 'project')
+    se.cropFieldImagePath = writeCropField(str(tmp_path), 'small')
+    se.resolution = 50
+    (tmp_path / 'project').mkdir()
+    return se
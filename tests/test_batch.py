@@ -0,0 +1,16 @@
+from batch import FIELD_SKIPPED, processField
+from pipeline import IMAGE_VEG_MASK, SHAPE_ROWS_RIDGES, buildLayers
+
+
+def test_complete_field_saves_styles(project):
+    se = project
+    processField(se)
+
+    se.rowsRidgesColor = (10, 20, 30)
+    status, message = processField(se)
+    assert status == FIELD_SKIPPED
+    assert 'settings updated' in message
+
+    layer = buildLayers(se)[IMAGE_VEG_MASK]
+    pen = layer.shapes[SHAPE_ROWS_RIDGES].pen
+    assert pen.color().getRgb()[0:3] == (10, 20, 30)
@@ -0,0 +1,20 @@
+import mcrops
+import pytest
+
+from fields import rowsMask
+from orientation import detectDirection
+
+RESOLUTION = 20
+WINDOW_SHAPE = (20, 30)
+
+
+@pytest.mark.parametrize('direction', [0.3, 0.8, 1.2, -0.5])
+def test_direction_matches_mcrops(direction):
+    mask = rowsMask((800, 1000), RESOLUTION, rowsDirection=direction)
+    expected = mcrops.rows.detect_direction(
+        mask, window_shape=WINDOW_SHAPE, resolution=RESOLUTION
+    )
+    for refine in (False, True):
+        assert detectDirection(
+            mask, 0, RESOLUTION, WINDOW_SHAPE, refine
+        ) == pytest.approx(expected)
@@ -0,0 +1,27 @@
+from pipeline import (
+    IMAGE_NORM_FIELD,
+    IMAGE_VEG_MASK,
+    SHAPE_ROWS_RIDGES,
+    Pipeline,
+    buildLayers
+)
+
+
+def test_cached_run_restyles_shapes(project):
+    se = project
+    Pipeline(se, buildLayers(se)).run()
+
+    se.rowsRidgesColor = (10, 20, 30)
+    se.drawLineWidth = 5
+    layers = buildLayers(se)
+    pipeline = Pipeline(se, layers)
+    assert pipeline.plan() == []
+    pipeline.run()
+
+    # Saved along with the layers, not only applied to the loaded shapes
+    for layer in buildLayers(se).values():
+        if layer.name not in (IMAGE_NORM_FIELD, IMAGE_VEG_MASK):
+            continue
+        pen = layer.shapes[SHAPE_ROWS_RIDGES].pen
+        assert pen.color().getRgb()[0:3] == (10, 20, 30)
+        assert pen.width() == 5